@@ -0,0 +1,174 @@
+# Batch consultations: run a day's worth of photo + voice-note pairs through STT, vision and TTS.
+# Items come from a manifest (.jsonl or .csv with id, audio, image columns) or from a directory,
+# where files sharing a name are paired (visit1.mp3 + visit1.jpg). Results are appended to a JSONL
+# file as each item finishes; rerunning with the same output skips items that already succeeded.
+#
+#   python batch.py uploads/ --output results.jsonl --audio-dir replies/ --workers 4
+
+# Load .env before the pipeline modules read their settings
+from settings import load_env
+load_env()
+
+import os
+import csv
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+
+from consultation import process_inputs
+from groq_scheduler import priority, BACKGROUND
+from voice_of_the_patient import warm_transcoder
+
+BATCH_WORKERS=int(os.environ.get("BATCH_WORKERS", "4"))
+AUDIO_EXTENSIONS={".mp3", ".wav", ".m4a", ".ogg", ".webm", ".flac"}
+IMAGE_EXTENSIONS={".jpg", ".jpeg", ".png", ".webp", ".gif"}
+
+
+#Step1: find the work
+def load_items(source):
+    """
+    Return a list of {"id", "audio", "image"} dicts, image possibly None.
+
+    Args:
+    source (str): A directory of paired files, or a .jsonl/.csv manifest. Relative paths in a manifest
+    are taken relative to the manifest itself.
+
+    Raises ValueError when two items share an id.
+    """
+    if os.path.isdir(source):
+        return _check_unique(_pair_directory(source), source)
+
+    base=os.path.dirname(os.path.abspath(source))
+    with open(source, newline="") as manifest:
+        if source.endswith(".csv"):
+            rows=list(csv.DictReader(manifest))
+        else:
+            rows=[json.loads(line) for line in manifest if line.strip()]
+
+    items=[]
+    for row in rows:
+        audio=os.path.join(base, row["audio"])
+        image=os.path.join(base, row["image"]) if row.get("image") else None
+        items.append({"id": row.get("id") or os.path.splitext(os.path.basename(audio))[0], "audio": audio, "image": image})
+    return _check_unique(items, source)
+
+
+def _check_unique(items, source):
+    # Items sharing an id would overwrite each other's <id>.mp3 and be merged in the checkpoint
+    seen, duplicates=set(), set()
+    for item in items:
+        (duplicates if item["id"] in seen else seen).add(item["id"])
+    if duplicates:
+        raise ValueError(f"{source} has more than one item for id(s): {', '.join(sorted(duplicates))}")
+    return items
+
+
+def _pair_directory(directory):
+    audio, images=[], {}
+    for name in sorted(os.listdir(directory)):
+        stem, extension=os.path.splitext(name)
+        if extension.lower() in AUDIO_EXTENSIONS:
+            # visit1.mp3 next to visit1.wav gives two items with one id, which load_items rejects
+            audio.append((stem, os.path.join(directory, name)))
+        elif extension.lower() in IMAGE_EXTENSIONS:
+            images[stem]=os.path.join(directory, name)
+    for stem in sorted(set(images)-{stem for stem, _ in audio}):
+        logging.warning(f"Skipping {images[stem]}: no voice note with the same name")
+    return [{"id": stem, "audio": path, "image": images.get(stem)} for stem, path in sorted(audio)]
+
+
+def finished_ids(output_path):
+    """Ids that already have a successful result in output_path (the checkpoint)."""
+    done=set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path) as results:
+        for line in results:
+            try:
+                result=json.loads(line)
+            except ValueError:
+                continue  # a line cut short by the interruption
+            if not result.get("error"):
+                done.add(result["id"])
+    return done
+
+
+#Step2: run it
+async def run_item(item, audio_dir):
+    start=time.perf_counter()
+    result={"id": item["id"], "audio": item["audio"], "image": item["image"]}
+    reply_path=os.path.join(audio_dir, f"{item['id']}.mp3") if audio_dir else None
+    try:
+        transcript=response=audio=None
+        # Without an audio directory the reply would be thrown away, so it is not synthesized at all
+        async for transcript, response, audio in process_inputs(item["audio"], item["image"], output_filepath=reply_path, speak=bool(reply_path)):
+            pass
+        result.update(transcript=transcript, response=response, reply_audio=audio if reply_path else None)
+    except Exception as e:
+        logging.warning(f"Batch item {item['id']} failed: {e}")
+        result["error"]=f"{type(e).__name__}: {e}"
+    result["seconds"]=round(time.perf_counter()-start, 3)
+    return result
+
+
+async def run_batch(items, output_path, audio_dir=None, workers=BATCH_WORKERS):
+    """
+    Process items with at most workers in flight, appending one JSON line per item to output_path.
+    Items already finished in output_path are skipped. Returns (processed, failed, skipped) counts.
+
+    Groq calls run at BACKGROUND priority, so interactive consultations go first.
+    """
+    done=finished_ids(output_path)
+    pending=[item for item in items if item["id"] not in done]
+    if audio_dir:
+        os.makedirs(audio_dir, exist_ok=True)
+    slots=asyncio.Semaphore(workers)
+    counts={"processed": 0, "failed": 0}
+
+    with open(output_path, "a+b") as results:
+        # Start on a fresh line if the last run died halfway through writing one
+        if results.tell():
+            results.seek(-1, os.SEEK_END)
+            if results.read(1)!=b"\n":
+                results.write(b"\n")
+
+        async def worker(item):
+            async with slots:
+                result=await run_item(item, audio_dir)
+            # Written and synced one item at a time, so an interruption loses at most the items in flight
+            results.write((json.dumps(result)+"\n").encode("utf-8"))
+            results.flush()
+            os.fsync(results.fileno())
+            counts["processed"]+=1
+            counts["failed"]+=bool(result.get("error"))
+            logging.info(f"Batch {counts['processed']}/{len(pending)}: {item['id']} in {result['seconds']:.1f}s")
+
+        with priority(BACKGROUND):
+            await asyncio.gather(*(worker(item) for item in pending))
+    return counts["processed"], counts["failed"], len(items)-len(pending)
+
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description="Run queued photo and voice-note pairs through the consultation pipeline.")
+    parser.add_argument("source", help="directory of paired files, or a .jsonl/.csv manifest")
+    parser.add_argument("--output", default="results.jsonl", help="JSONL results file, also the resume checkpoint")
+    parser.add_argument("--audio-dir", help="write each spoken reply here as <id>.mp3")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="items processed at the same time")
+    args=parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    warm_transcoder()
+    try:
+        items=load_items(args.source)
+    except ValueError as e:
+        parser.error(str(e))
+    processed, failed, skipped=asyncio.run(run_batch(items, args.output, args.audio_dir, args.workers))
+    print(f"{processed} processed ({failed} failed), {skipped} already done, results in {args.output}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
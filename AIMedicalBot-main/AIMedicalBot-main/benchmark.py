@@ -0,0 +1,334 @@
+# Offline load test for the consultation pipeline.
+# Drives process_inputs on the local fake providers at several concurrency levels and reports
+# p50/p95/p99 latency per stage, throughput and peak RSS. Results can be saved as a baseline
+# and later runs checked against it, so performance regressions fail the check (CI runs it on every push).
+#
+#   python benchmark.py --concurrency 1 8 32 --requests 64
+#   python benchmark.py --check-baseline
+#   RUN_BENCHMARK=1 pytest test_benchmark.py   # the same check from pytest
+#   python benchmark.py --transcode 50   # pydub vs the transcoder on a 10s recording
+#
+# The fake latencies come from the FAKE_* settings in providers.py. The committed baseline was saved with
+#   FAKE_STT_LATENCY=0.05 FAKE_VISION_LATENCY=0.05 FAKE_TOKEN_LATENCY=0.002 FAKE_TTS_LATENCY=0.02 \
+#   python benchmark.py --concurrency 1 8 --requests 16 --save-baseline
+
+# Load .env before the pipeline modules read their settings
+from settings import load_env
+load_env()
+
+import os
+import sys
+import json
+import time
+import asyncio
+import shutil
+import argparse
+import tempfile
+from collections import deque
+
+import consultation
+import providers
+import speech_pipeline
+import transcoder
+from response_cache import DiskCache, MemoryCache, TieredCache
+
+HERE=os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE=os.environ.get("BENCHMARK_BASELINE", os.path.join(HERE, "benchmark_baseline.json"))
+# A run regresses when a stage gets slower than baseline*TOLERANCE+SLACK seconds (see find_regressions
+# for how loaded levels are scaled), throughput drops below baseline/TOLERANCE or peak RSS grows past baseline*TOLERANCE
+BENCHMARK_TOLERANCE=float(os.environ.get("BENCHMARK_TOLERANCE", "1.5"))
+BENCHMARK_SLACK_SECONDS=float(os.environ.get("BENCHMARK_SLACK_SECONDS", "0.05"))
+
+DEFAULT_SETTINGS={
+    "concurrency": [1, 8, 32],
+    "requests": 64,
+    "image": "skin_rash.jpg",
+    "stt_latency": providers.FAKE_STT_LATENCY,
+    "vision_latency": providers.FAKE_VISION_LATENCY,
+    "text_latency": providers.FAKE_TEXT_LATENCY,
+    "token_latency": providers.FAKE_TOKEN_LATENCY,
+    "tts_latency": providers.FAKE_TTS_LATENCY,
+    "cache": False,
+    "speculative": False,
+}
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered=sorted(values)
+    rank=max(1, -(-len(ordered)*percent//100))
+    return ordered[int(rank)-1]
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None where it cannot be read (Windows)."""
+    # On Linux ru_maxrss survives exec, so a child of a big process would report its parent's peak
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])/1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # macOS reports bytes, other systems kilobytes
+    peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak/(1024*1024) if sys.platform=="darwin" else peak/1024
+
+
+def configure(settings, cache_dir):
+    """Point the pipeline at the fake providers and at caches of its own."""
+    providers.FAKE_STT_LATENCY=settings["stt_latency"]
+    providers.FAKE_VISION_LATENCY=settings["vision_latency"]
+    providers.FAKE_TEXT_LATENCY=settings["text_latency"]
+    providers.FAKE_TOKEN_LATENCY=settings["token_latency"]
+    providers.FAKE_TTS_LATENCY=settings["tts_latency"]
+    consultation.STT_PROVIDER="fake"
+    consultation.VISION_PROVIDER="fake"
+    consultation.TTS_ENGINE="fake"
+    consultation.AUDIO_OUTPUT="bytes"
+    consultation.SPECULATIVE_VISION=settings["speculative"]
+    # A cache limited to zero bytes keeps nothing, so every request does the full work
+    max_bytes=200*1024*1024 if settings["cache"] else 0
+    tts_cache=TieredCache(MemoryCache(max_bytes), DiskCache(os.path.join(cache_dir, "tts.sqlite3"), max_bytes=max_bytes))
+    consultation.tts_cache=tts_cache
+    speech_pipeline.tts_cache=tts_cache
+    consultation.vision_cache=DiskCache(os.path.join(cache_dir, "vision.sqlite3"), max_bytes=max_bytes)
+
+
+async def run_level(concurrency, requests, image_filepath):
+    """Run requests turns with at most concurrency in flight and summarize them."""
+    consultation.stage_timings=deque()
+    semaphore=asyncio.Semaphore(concurrency)
+
+    async def one_turn():
+        async with semaphore:
+            async for _ in consultation.process_inputs("benchmark.wav", image_filepath):
+                pass
+
+    start=time.perf_counter()
+    await asyncio.gather(*(one_turn() for _ in range(requests)))
+    elapsed=time.perf_counter()-start
+
+    stages={}
+    for timings in consultation.stage_timings:
+        for stage, seconds in timings.items():
+            stages.setdefault(stage, []).append(seconds)
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "seconds": round(elapsed, 4),
+        "throughput": round(requests/elapsed, 3),
+        "stages": {stage: {f"p{p}": round(percentile(values, p), 4) for p in (50, 95, 99)} for stage, values in stages.items()},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_benchmark(settings=None):
+    """
+    Run the load test and return its report.
+
+    Args:
+    settings (dict): Overrides for DEFAULT_SETTINGS (concurrency levels, request count, fake latencies, cache and speculation on/off).
+    """
+    settings=dict(DEFAULT_SETTINGS, **(settings or {}))
+    image_filepath=os.path.join(HERE, settings["image"])
+    with tempfile.TemporaryDirectory() as cache_dir:
+        configure(settings, cache_dir)
+        levels=[asyncio.run(run_level(concurrency, settings["requests"], image_filepath)) for concurrency in settings["concurrency"]]
+        consultation.vision_cache.close()
+        consultation.tts_cache.disk.close()
+    return {"settings": settings, "levels": levels}
+
+
+def find_regressions(report, baseline, tolerance=BENCHMARK_TOLERANCE, slack=BENCHMARK_SLACK_SECONDS):
+    """
+    List what got worse in report compared with baseline, as readable strings.
+
+    The lowest concurrency level is compared with the baseline as is: on the fake providers a
+    single turn is mostly their sleeps, whatever the machine. Higher levels measure how the pipeline
+    holds up under load, so their limits are scaled by how much slower that single turn ran here
+    than in the baseline, and their throughput is compared as a multiple of the single-turn level's.
+    """
+    regressions=[]
+    previous={level["concurrency"]: level for level in baseline["levels"]}
+    shared=[level for level in report["levels"] if level["concurrency"] in previous]
+    if not shared:
+        return regressions
+    reference=min(shared, key=lambda level: level["concurrency"])
+    reference_before=previous[reference["concurrency"]]
+    # A slower machine (never a faster one) loosens the limits of the loaded levels
+    single, single_before=(level["stages"].get("total", {}).get("p50") for level in (reference, reference_before))
+    scale=max(1.0, single/single_before) if single and single_before else 1.0
+    for level in shared:
+        before=previous[level["concurrency"]]
+        name=f"concurrency {level['concurrency']}"
+        level_scale=1.0 if level is reference else scale
+        for stage, percentiles in level["stages"].items():
+            for key, seconds in percentiles.items():
+                limit=before["stages"].get(stage, {}).get(key)
+                if limit is not None and seconds>limit*level_scale*tolerance+slack:
+                    regressions.append(f"{name}: {stage} {key} {seconds:.3f}s > baseline {limit:.3f}s")
+        if level is reference:
+            if level["throughput"]<before["throughput"]/tolerance:
+                regressions.append(f"{name}: throughput {level['throughput']:.2f}/s < baseline {before['throughput']:.2f}/s")
+        else:
+            speedup=level["throughput"]/reference["throughput"]
+            speedup_before=before["throughput"]/reference_before["throughput"]
+            if speedup<speedup_before/tolerance:
+                regressions.append(f"{name}: throughput {speedup:.1f}x the single-turn level's < baseline {speedup_before:.1f}x")
+        if level["peak_rss_mb"] and before.get("peak_rss_mb") and level["peak_rss_mb"]>before["peak_rss_mb"]*tolerance:
+            regressions.append(f"{name}: peak RSS {level['peak_rss_mb']:.0f} MB > baseline {before['peak_rss_mb']:.0f} MB")
+    return regressions
+
+
+def print_report(report):
+    for level in report["levels"]:
+        print(f"\nconcurrency {level['concurrency']}: {level['requests']} requests in {level['seconds']:.2f}s, "
+              f"{level['throughput']:.2f} req/s, peak RSS {level['peak_rss_mb'] or 0:.0f} MB")
+        print(f"  {'stage':<8}{'p50':>9}{'p95':>9}{'p99':>9}")
+        for stage, percentiles in level["stages"].items():
+            print(f"  {stage:<8}" + "".join(f"{percentiles[key]:>8.3f}s" for key in ("p50", "p95", "p99")))
+
+
+def run_transcode_benchmark(runs, seconds=10, sample_rate=16000, pause=0.1):
+    """
+    Time the recording conversions the old way (pydub, one ffmpeg spawn and temp files per call)
+    against the transcoder (NumPy in-process, ffmpeg on pipes), each case doing the same work on
+    both paths. ffmpeg cases run twice on the transcoder: with a fresh spawn per call (cold) and
+    with pre-started processes (warm). Returns {case: {path: {"p50", "p95"}}}; the ffmpeg cases
+    are skipped when ffmpeg is not installed.
+
+    Args:
+    runs (int): Conversions timed per case and path.
+    seconds (int): Length of the test recording (a 440 Hz tone, stereo 44.1 kHz).
+    sample_rate (int): Rate the upload cases convert to.
+    pause (float): Untimed gap between runs, like the gap between real conversions, in which
+    the pool starts its replacement spares.
+    """
+    from io import BytesIO
+    from pydub import AudioSegment
+    from pydub.generators import Sine
+
+    recording=Sine(440).to_audio_segment(duration=seconds*1000).set_frame_rate(44100).set_channels(2)
+    buffer=BytesIO()
+    recording.export(buffer, format="wav")
+    upload=buffer.getvalue()
+    buffer=BytesIO()
+    recording.set_channels(1).export(buffer, format="wav")
+    microphone=buffer.getvalue()  # what record_audio gets from speech_recognition
+
+    def pydub_convert(wav_data, output_format, bitrate=None, rate=None):
+        segment=AudioSegment.from_wav(BytesIO(wav_data))
+        if rate:
+            segment=segment.set_channels(1).set_frame_rate(rate)
+        output=BytesIO()
+        segment.export(output, format=output_format, bitrate=bitrate)
+        return output.getvalue()
+
+    def pool_convert(ffmpeg, audio, output_format, bitrate):
+        return ffmpeg.run(transcoder.encode_args(audio.sample_rate, audio.channels, output_format, bitrate), audio.raw)
+
+    cases={
+        "upload to 16k pcm": {
+            "pydub": lambda: AudioSegment.from_wav(BytesIO(upload)).set_channels(1).set_frame_rate(sample_rate),
+            "transcoder": lambda: transcoder.decode(upload, sample_rate),
+        },
+        "upload to wav": {
+            "pydub": lambda: pydub_convert(upload, "wav", rate=sample_rate),
+            "transcoder": lambda: transcoder.encode(transcoder.decode(upload, sample_rate), "wav"),
+        },
+    }
+    if shutil.which(transcoder.FFMPEG_BINARY):
+        cold=transcoder.FfmpegPool(spares=0)
+        warm=transcoder.FfmpegPool()
+        warm.warm(transcoder.encode_args(sample_rate, 1, "mp3", "32k"))
+        warm.warm(transcoder.encode_args(44100, 1, "mp3", "128k"))
+        cases["upload to mp3"]={
+            "pydub": lambda: pydub_convert(upload, "mp3", "32k", rate=sample_rate),
+            "cold": lambda: pool_convert(cold, transcoder.decode(upload, sample_rate), "mp3", "32k"),
+            "warm": lambda: pool_convert(warm, transcoder.decode(upload, sample_rate), "mp3", "32k"),
+        }
+        cases["record to mp3"]={
+            "pydub": lambda: pydub_convert(microphone, "mp3", "128k"),
+            "cold": lambda: pool_convert(cold, transcoder.read_wav(microphone), "mp3", "128k"),
+            "warm": lambda: pool_convert(warm, transcoder.read_wav(microphone), "mp3", "128k"),
+        }
+    else:
+        print(f"{transcoder.FFMPEG_BINARY} not found, skipping the mp3 cases")
+
+    results={}
+    try:
+        for case, paths in cases.items():
+            results[case]={}
+            for path, convert in paths.items():
+                timings=[]
+                for _ in range(runs):
+                    time.sleep(pause)
+                    start=time.perf_counter()
+                    convert()
+                    timings.append(time.perf_counter()-start)
+                results[case][path]={f"p{p}": round(percentile(timings, p), 5) for p in (50, 95)}
+    finally:
+        if "upload to mp3" in cases:
+            warm.close()
+    return results
+
+
+def print_transcode_report(results):
+    print(f"  {'case':<20}{'path':<12}{'p50':>10}{'p95':>10}")
+    for case, paths in results.items():
+        for path, percentiles in paths.items():
+            print(f"  {case:<20}{path:<12}" + "".join(f"{percentiles[key]*1000:>8.2f}ms" for key in ("p50", "p95")))
+
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description="Load test the consultation pipeline on local fake providers.")
+    parser.add_argument("--concurrency", type=int, nargs="+", help="concurrency levels to run")
+    parser.add_argument("--requests", type=int, help="requests per concurrency level")
+    parser.add_argument("--cache", action="store_true", help="keep the vision and TTS caches on")
+    parser.add_argument("--speculative", action="store_true", help="pre-analyze the image while STT runs (SPECULATIVE_VISION)")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--save-baseline", action="store_true", help=f"save the report as the baseline ({BASELINE_FILE})")
+    parser.add_argument("--check-baseline", action="store_true", help="rerun the baseline settings and fail on regressions")
+    parser.add_argument("--transcode", type=int, metavar="RUNS", help="only compare audio conversion latency, over RUNS runs")
+    args=parser.parse_args(argv)
+
+    if args.transcode:
+        print_transcode_report(run_transcode_benchmark(args.transcode))
+        return 0
+
+    settings={}
+    if args.check_baseline:
+        with open(BASELINE_FILE) as baseline_file:
+            baseline=json.load(baseline_file)
+        settings=baseline["settings"]
+    if args.concurrency:
+        settings["concurrency"]=args.concurrency
+    if args.requests:
+        settings["requests"]=args.requests
+    if args.cache:
+        settings["cache"]=True
+    if args.speculative:
+        settings["speculative"]=True
+
+    report=run_benchmark(settings)
+    print_report(report)
+    for path in filter(None, [args.output, BASELINE_FILE if args.save_baseline else None]):
+        with open(path, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+        print(f"\nSaved report to {path}")
+
+    if args.check_baseline:
+        regressions=find_regressions(report, baseline)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
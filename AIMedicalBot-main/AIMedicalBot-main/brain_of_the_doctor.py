@@ -1,49 +1,288 @@
-# if you dont use pipenv uncomment the following:
-from dotenv import load_dotenv
-load_dotenv()
-
 #Step1: Setup GROQ API key
+# The key is read from the environment (or .env) by groq_client on first use
 import os
 
-GROQ_API_KEY=os.environ.get("GROQ_API_KEY")
-
 #Step2: Convert image to required format
-import base64
+import io
+import mimetypes
+import time
+from dataclasses import dataclass
+from ingest import MAX_IMAGE_BYTES, check_size, encode_base64, encode_file
+from telemetry import span, start_span
 
 #I am Tanmay
 #image_path="acne.jpg"
 
+MAX_IMAGE_EDGE=int(os.environ.get("MAX_IMAGE_EDGE", "1024"))
+IMAGE_QUALITY=int(os.environ.get("IMAGE_QUALITY", "85"))
+
+# Formats the vision model accepts as-is
+SUPPORTED_IMAGE_FORMATS={"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+
+@dataclass
+class PreparedImage:
+    encoded: str
+    mime_type: str
+    bytes_before: int
+    bytes_after: int
+    size: tuple
+    seconds: float
+    # Of the payload that is sent, so callers can tell whether the image changed
+    sha256: str=None
+
+    @property
+    def bytes_saved(self):
+        return self.bytes_before-self.bytes_after
+
+    @property
+    def data_url(self):
+        return f"data:{self.mime_type};base64,{self.encoded}"
+
+
+def preprocess_image(image_path, max_edge=MAX_IMAGE_EDGE, quality=IMAGE_QUALITY, max_bytes=MAX_IMAGE_BYTES):
+    """
+    Detect the real format, strip EXIF, downscale and re-encode an image before upload.
+
+    Args:
+    image_path (str): Path to the uploaded image.
+    max_edge (int): Longest allowed edge in pixels; larger images are downscaled.
+    quality (int): JPEG quality used when re-encoding.
+    max_bytes (int): Largest upload accepted; bigger files raise UploadTooLarge without being read.
+    """
+    with span("image") as current:
+        prepared=_prepare_image(image_path, max_edge, quality, max_bytes)
+        current.set(bytes_in=prepared.bytes_before, bytes_out=prepared.bytes_after, mime_type=prepared.mime_type)
+        return prepared
+
+
+def _prepare_image(image_path, max_edge, quality, max_bytes):
+    from PIL import Image, ImageOps
+
+    start=time.perf_counter()
+    # Oversize uploads are turned away before a byte is read
+    bytes_before=check_size(image_path, max_bytes)
+
+    try:
+        # Pillow reads from the file itself, so the raw upload is never held as one bytes object
+        with Image.open(image_path) as source:
+            source.load()
+            source_format=source.format
+            has_exif="exif" in source.info
+            # Apply the EXIF rotation before the metadata is dropped
+            image=ImageOps.exif_transpose(source)
+    except OSError:
+        # Not something Pillow understands, send it untouched like we used to
+        upload=encode_file(image_path, max_bytes)
+        mime_type=mimetypes.guess_type(image_path)[0] or "image/jpeg"
+        return PreparedImage(upload.encoded, mime_type, upload.size, upload.size, None, time.perf_counter()-start, upload.sha256)
+
+    resized=max(image.size)>max_edge
+    if resized:
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+    output=io.BytesIO()
+    if image.mode in ("RGBA", "LA") or (image.mode=="P" and "transparency" in image.info):
+        image.save(output, format="PNG", optimize=True)
+        mime_type="image/png"
+    else:
+        image.convert("RGB").save(output, format="JPEG", quality=quality, optimize=True)
+        mime_type="image/jpeg"
+
+    # Keep the original when it is already small, clean and in a format the model accepts
+    if not resized and not has_exif and source_format in SUPPORTED_IMAGE_FORMATS and bytes_before<=output.tell():
+        output.close()
+        upload=encode_file(image_path, max_bytes)
+        mime_type=SUPPORTED_IMAGE_FORMATS[source_format]
+    else:
+        payload_size=output.tell()
+        output.seek(0)
+        with output:
+            upload=encode_base64(output, max_bytes, size_hint=payload_size)
+
+    return PreparedImage(
+        encoded=upload.encoded,
+        mime_type=mime_type,
+        bytes_before=bytes_before,
+        bytes_after=upload.size,
+        size=image.size,
+        seconds=time.perf_counter()-start,
+        sha256=upload.sha256
+    )
+
+
 def encode_image(image_path):   
-    image_file=open(image_path, "rb")
-    return base64.b64encode(image_file.read()).decode('utf-8')
+    return preprocess_image(image_path).encoded
+
+
+def _sniff_mime_type(encoded_image):
+    # base64 prefixes of the JPEG, PNG, WEBP and GIF magic bytes
+    for prefix, mime_type in (("/9j/", "image/jpeg"), ("iVBORw0KGgo", "image/png"), ("UklGR", "image/webp"), ("R0lGOD", "image/gif")):
+        if encoded_image.startswith(prefix):
+            return mime_type
+    return "image/jpeg"
 
 #Step3: Setup Multimodal LLM 
-from groq import Groq
+from groq_client import get_groq_client, get_async_groq_client
+from groq_scheduler import scheduler
+from response_cache import CACHE_DIR, DiskCache, make_key, normalize_text
 
 query="Is there something wrong with my face?"
 model="llama-3.2-90b-vision-preview"
 
-def analyze_image_with_query(query, model, encoded_image):
-    client=Groq()  
-    messages=[
+VISION_CACHE_TTL=float(os.environ.get("VISION_CACHE_TTL", str(24*60*60)))
+VISION_CACHE_MAX_BYTES=int(os.environ.get("VISION_CACHE_MAX_BYTES", str(20*1024*1024)))
+
+vision_cache=DiskCache(os.path.join(CACHE_DIR, "vision.sqlite3"), max_bytes=VISION_CACHE_MAX_BYTES, ttl=VISION_CACHE_TTL)
+
+def vision_cache_key(query, model, encoded_image):
+    # The encoded payload is a deterministic function of the preprocessed bytes
+    return make_key(encoded_image, model, normalize_text(query))
+
+def _build_messages(query, encoded_image, mime_type, history=None):
+    """
+    The chat messages for one vision request. history holds earlier {"role", "content"} text
+    messages of the conversation, oldest first; without encoded_image the request is text only.
+    """
+    content=[
+        {
+            "type": "text", 
+            "text": query
+        },
+    ]
+    if encoded_image:
+        mime_type=mime_type or _sniff_mime_type(encoded_image)
+        content.append({
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:{mime_type};base64,{encoded_image}",
+            },
+        })
+    return list(history or [])+[
         {
             "role": "user",
-            "content": [
-                {
-                    "type": "text", 
-                    "text": query
-                },
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{encoded_image}",
-                    },
-                },
-            ],
+            "content": content,
         }]
-    chat_completion=client.chat.completions.create(
-        messages=messages,
-        model=model
-    )
 
-    return chat_completion.choices[0].message.content
\ No newline at end of file
+def _request_bytes(query, encoded_image, history=None):
+    return len(encoded_image or "")+len(query)+sum(len(message["content"]) for message in history or [])
+
+def analyze_image_with_query(query, model, encoded_image, mime_type=None, use_cache=True):
+    with span("vision", model=model, bytes_in=len(encoded_image)+len(query)) as current:
+        if use_cache:
+            cache_key=vision_cache_key(query, model, encoded_image)
+            cached=vision_cache.get(cache_key)
+            current.set(cache="miss" if cached is None else "hit")
+            if cached is not None:
+                current.set(bytes_out=len(cached))
+                return cached.decode('utf-8')
+
+        client=get_groq_client()
+        chat_completion=scheduler.call(model, lambda: client.chat.completions.create(
+            messages=_build_messages(query, encoded_image, mime_type),
+            model=model
+        ))
+
+        response=chat_completion.choices[0].message.content
+        current.set(bytes_out=len((response or "").encode('utf-8')))
+        if use_cache and response:
+            vision_cache.set(cache_key, response)
+        return response
+
+
+#Step4: Stream the answer token by token
+def stream_image_with_query(query, model, encoded_image, mime_type=None, use_cache=True):
+    """
+    Same as analyze_image_with_query, but yields text chunks as the model produces them.
+    A cached answer is yielded in one piece.
+    """
+    current=start_span("vision", model=model, stream=True, bytes_in=len(encoded_image)+len(query))
+    error=None
+    try:
+        if use_cache:
+            cache_key=vision_cache_key(query, model, encoded_image)
+            cached=vision_cache.get(cache_key)
+            current.set(cache="miss" if cached is None else "hit")
+            if cached is not None:
+                current.set(bytes_out=len(cached))
+                yield cached.decode('utf-8')
+                return
+
+        client=get_groq_client()
+        # Only opening the stream is retried, never a half-delivered answer
+        stream=scheduler.call(model, lambda: client.chat.completions.create(
+            messages=_build_messages(query, encoded_image, mime_type),
+            model=model,
+            stream=True
+        ))
+
+        parts=[]
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            token=chunk.choices[0].delta.content
+            if token:
+                parts.append(token)
+                yield token
+
+        response="".join(parts)
+        current.set(bytes_out=len(response.encode('utf-8')))
+        if use_cache and response:
+            vision_cache.set(cache_key, response)
+    except BaseException as e:
+        error=e
+        raise
+    finally:
+        current.end(error)
+
+
+#Step5: Async variant for the asyncio request engine
+async def astream_image_with_query(query, model, encoded_image, mime_type=None, use_cache=True, history=None):
+    """
+    Async version of stream_image_with_query built on the pooled AsyncGroq client.
+    With history (earlier turns of a session) the answer depends on more than the query and
+    image, so it is neither looked up in nor stored to the cache.
+    """
+    import asyncio
+
+    current=start_span("vision", model=model, stream=True, image=bool(encoded_image), bytes_in=_request_bytes(query, encoded_image, history))
+    error=None
+    use_cache=use_cache and not history
+    try:
+        if use_cache:
+            cache_key=vision_cache_key(query, model, encoded_image)
+            cached=await asyncio.to_thread(vision_cache.get, cache_key)
+            current.set(cache="miss" if cached is None else "hit")
+            if cached is not None:
+                current.set(bytes_out=len(cached))
+                yield cached.decode('utf-8')
+                return
+
+        client=get_async_groq_client()
+        stream=await scheduler.acall(model, lambda: client.chat.completions.create(
+            messages=_build_messages(query, encoded_image, mime_type, history),
+            model=model,
+            stream=True
+        ))
+
+        parts=[]
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                token=chunk.choices[0].delta.content
+                if token:
+                    parts.append(token)
+                    yield token
+        finally:
+            # Give the connection back to the pool even when the consumer walks away
+            await stream.close()
+
+        response="".join(parts)
+        current.set(bytes_out=len(response.encode('utf-8')))
+        if use_cache and response:
+            await asyncio.to_thread(vision_cache.set, cache_key, response)
+    except BaseException as e:
+        error=e
+        raise
+    finally:
+        current.end(error)
@@ -0,0 +1,300 @@
+# Async consultation engine: STT -> vision -> TTS for one patient turn.
+# Everything waits on the event loop instead of holding a worker thread per request.
+import os
+import asyncio
+import logging
+from collections import deque
+
+from brain_of_the_doctor import preprocess_image, vision_cache, vision_cache_key
+from ingest import MAX_IMAGE_BYTES, hash_upload
+from providers import get_provider
+from sessions import sessions
+from speech_pipeline import AsyncSentenceTTSPipeline, SilentTTSPipeline, cached_synthesizer, tts_cache
+from output_manager import outputs
+from stage_graph import StageGraph
+from telemetry import activate, start_span, record_stages, cache_lookups, speculative_vision
+
+system_prompt="""You have to act as a professional doctor, i know you are not but this is for learning purpose.
+            What's in this image?. Do you find anything wrong with it medically?
+            If you make a differential, suggest some remedies for them. Donot add any numbers or special characters in
+            your response. Your response should be in one long paragraph. Also always answer as if you are answering to a real person.
+            Donot say 'In the image I see' but say 'With what I see, I think you have ....'
+            Dont respond as an AI model in markdown, your answer should mimic that of an actual doctor not an AI bot,
+            Keep your answer concise (max 2 sentences). No preamble, start your answer right away please"""
+
+# Follow-ups about an image the session already sent go out as text, after the earlier turns
+follow_up_prompt="""You are the same doctor, answering the patient's follow-up about the image you already looked at.
+            Answer like before: to a real person, no numbers, special characters or markdown, concise (max 2 sentences),
+            no preamble. The patient says: """
+
+STT_MODEL=os.environ.get("STT_MODEL", "whisper-large-v3")
+VISION_MODEL=os.environ.get("VISION_MODEL", "llama-3.2-11b-vision-preview")
+
+# Backends by name, see providers.PROVIDERS: "groq" or "fake" for STT, "hedged" (Groq with a
+# fallback model for slow requests), "groq" or "fake" for vision, "gtts", "elevenlabs" or "fake" for speech
+STT_PROVIDER=os.environ.get("STT_PROVIDER", "groq")
+VISION_PROVIDER=os.environ.get("VISION_PROVIDER", "hedged")
+TTS_ENGINE=os.environ.get("TTS_ENGINE", "gtts")
+# "bytes" hands the encoded reply straight to the caller, "file" writes a per-request file
+AUDIO_OUTPUT=os.environ.get("AUDIO_OUTPUT", "bytes")
+# "1" starts an image-only pre-analysis while STT is still running; the answer is then a short
+# text-only refinement of it. Hides most of the STT time at the cost of a second (small) vision call.
+SPECULATIVE_VISION=os.environ.get("SPECULATIVE_VISION", "0")=="1"
+
+# Per-stage timeouts in seconds
+STT_TIMEOUT=float(os.environ.get("STT_TIMEOUT", "30"))
+IMAGE_TIMEOUT=float(os.environ.get("IMAGE_TIMEOUT", "10"))
+VISION_TIMEOUT=float(os.environ.get("VISION_TIMEOUT", "60"))
+TTS_TIMEOUT=float(os.environ.get("TTS_TIMEOUT", "30"))
+
+# Per-stage timings ({"stt": seconds, ..., "total": seconds}) of the most recent requests
+STAGE_TIMINGS_KEPT=int(os.environ.get("STAGE_TIMINGS_KEPT", "100"))
+stage_timings=deque(maxlen=STAGE_TIMINGS_KEPT)
+
+# Marks the end of a turn on the update queue
+_DONE=object()
+
+
+async def iterate_with_deadline(chunks, timeout):
+    """Yield from an async iterator, raising asyncio.TimeoutError once timeout seconds have passed in total."""
+    loop=asyncio.get_running_loop()
+    deadline=loop.time()+timeout
+    iterator=chunks.__aiter__()
+    try:
+        while True:
+            remaining=deadline-loop.time()
+            if remaining<=0:
+                raise asyncio.TimeoutError()
+            try:
+                chunk=await asyncio.wait_for(iterator.__anext__(), remaining)
+            except StopAsyncIteration:
+                return
+            yield chunk
+    finally:
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
+
+
+def get_synthesizer(engine=None):
+    """Return the sentence synthesizer for engine, backed by the phrase cache."""
+    voice = get_provider("tts", engine or TTS_ENGINE)
+    return cached_synthesizer(voice.synthesize, voice.engine, voice.voice, voice.model, voice.output_format)
+
+
+def _write_audio(path, audio):
+    with open(path, "wb") as audio_file:
+        audio_file.write(audio)
+
+
+def prepare_image(image_filepath, session=None):
+    """
+    Return (image, digest, changed). Within a session, an upload with the same content as the
+    image analyzed last is not preprocessed again: image is None and the turn goes out as text.
+    """
+    if session is None:
+        return preprocess_image(image_filepath), None, True
+    digest = hash_upload(image_filepath, MAX_IMAGE_BYTES)
+    if session.image_digest is not None and digest == session.image_digest:
+        return None, digest, False
+    return preprocess_image(image_filepath), digest, True
+
+
+async def lookup_vision_cache(query, model, encoded_image):
+    """Return the cached answer for this transcript and image, or None."""
+    cached = await asyncio.to_thread(vision_cache.get, vision_cache_key(query, model, encoded_image))
+    cache_lookups.inc(cache="vision", result="miss" if cached is None else "hit")
+    return cached.decode('utf-8') if cached is not None else None
+
+
+async def _await_pre_analysis(graph):
+    """The speculative pre-analysis, or None when it failed and the full request has to be sent."""
+    try:
+        return await graph["preview"]
+    except Exception as e:
+        logging.warning(f"Speculative pre-analysis failed, sending the full request: {e}")
+        return None
+
+
+async def process_inputs(audio_filepath, image_filepath, output_filepath=None, session_id=None, speak=True):
+    """
+    Run one consultation turn, yielding (transcript, doctor_response, audio) as they fill in.
+    If the caller stops iterating (the user left), in-flight Groq and TTS work is cancelled.
+
+    audio is the output_filepath when one is given. Otherwise it is the encoded MP3 bytes,
+    or a fresh per-request file for session_id when AUDIO_OUTPUT is "file". With speak=False
+    nothing is synthesized and audio is None.
+
+    STT and image preprocessing run side by side; the vision cache lookup and the vision call
+    wait for both. Per-stage timings are logged, kept in stage_timings and exported as metrics.
+    The turn runs in its own task under a "consultation" span, so every span it starts
+    (STT, image, vision, TTS) belongs to the same trace.
+
+    With a session_id the turn is part of a conversation (see sessions.py): a follow-up about the
+    session's image, re-uploaded or not, is sent as text with the trimmed history instead of
+    sending the image again.
+
+    With SPECULATIVE_VISION a new image is pre-analyzed on its own while STT runs. Once the
+    transcript lands the pre-analysis is reused as is (nothing was said) or refined with a
+    text-only turn; pre-analyses that end up unused are cancelled and counted as discarded.
+    """
+    root = start_span("consultation", session=session_id, image=bool(image_filepath))
+    # One update at a time: each one repeats the answer so far, so a slow consumer holds the turn
+    # back instead of letting ever longer copies pile up
+    updates = asyncio.Queue(maxsize=1)
+
+    async def produce():
+        try:
+            async for update in _run_turn(audio_filepath, image_filepath, output_filepath, session_id, speak):
+                await updates.put(update)
+        finally:
+            # With the last update still unread there is no room; the consumer sees the producer is done instead
+            if not updates.full():
+                updates.put_nowait(_DONE)
+
+    with activate(root):
+        producer = asyncio.ensure_future(produce())
+    error = None
+    try:
+        while not (producer.done() and updates.empty()):
+            update = await updates.get()
+            if update is _DONE:
+                break
+            yield update
+        # Re-raise whatever ended the turn early, e.g. a stage timeout
+        await producer
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        producer.cancel()
+        root.end(error)
+
+
+async def _run_turn(audio_filepath, image_filepath, output_filepath, session_id, speak=True):
+    transcriber = get_provider("stt", STT_PROVIDER, model=STT_MODEL)
+    vision = get_provider("vision", VISION_PROVIDER, model=VISION_MODEL)
+    session = sessions.get(session_id) if session_id else None
+    history = session.history() if session is not None else []
+    graph = StageGraph()
+    tts_pipeline = AsyncSentenceTTSPipeline(get_synthesizer()) if speak else SilentTTSPipeline()
+    speculated = False
+    speculation = None
+
+    async def lookup(transcript, prepared):
+        image, _, changed = prepared
+        # Answers that depend on earlier turns are not cached
+        if not changed or history:
+            return None
+        return await lookup_vision_cache(system_prompt+transcript, vision.model, image.encoded)
+
+    async def pre_analyze(prepared):
+        nonlocal speculated
+        image, _, changed = prepared
+        if not changed:
+            return None  # a follow-up, the session already has the analysis
+        speculated = True
+        analysis = await lookup_vision_cache(system_prompt, vision.model, image.encoded)
+        if analysis is None:
+            tokens = vision.stream(system_prompt, image.encoded, image.mime_type)
+            analysis = "".join([token async for token in iterate_with_deadline(tokens, VISION_TIMEOUT)])
+            if analysis:
+                await asyncio.to_thread(vision_cache.set, vision_cache_key(system_prompt, vision.model, image.encoded), analysis)
+        return analysis
+
+    try:
+        #Step1: start the independent stages together
+        graph.add("stt", lambda: transcriber.transcribe(audio_filepath), timeout=STT_TIMEOUT)
+        if image_filepath:
+            graph.add("image", lambda: asyncio.to_thread(prepare_image, image_filepath, session), timeout=IMAGE_TIMEOUT)
+            graph.add("cache", lookup, "stt", "image")
+            if SPECULATIVE_VISION:
+                graph.add("preview", pre_analyze, "image")
+
+        speech_to_text_output = await graph["stt"]
+        yield speech_to_text_output, "", None
+
+        #Step2: stream the answer into the textbox as it arrives.
+        # Each finished sentence is already being synthesized while the rest is generated.
+        if image_filepath:
+            image, image_digest, send_image = await graph["image"]
+        elif session is not None and session.image_digest is not None:
+            image, image_digest, send_image = None, session.image_digest, False
+        else:
+            image, image_digest, send_image = None, None, False
+
+        if send_image or image_digest is not None:
+            # Follow-ups go out as text: the session's history keeps the turn that described the image
+            mime_type = image.mime_type if send_image else None
+            request_history = history
+            if send_image:
+                logging.info(f"Image preprocessed in {image.seconds:.2f}s: {image.bytes_before} -> {image.bytes_after} bytes ({image.mime_type})")
+                query = system_prompt+speech_to_text_output
+                encoded_image = image.encoded
+                doctor_response = await graph["cache"]
+                if SPECULATIVE_VISION and doctor_response is not None:
+                    graph["preview"].cancel()
+                elif SPECULATIVE_VISION:
+                    analysis = await _await_pre_analysis(graph)
+                    if analysis and not speech_to_text_output.strip():
+                        # Nothing was said, so the pre-analysis is the whole answer
+                        speculation = "reused"
+                        doctor_response = analysis
+                    elif analysis:
+                        # Build on the pre-analysis with a short text-only turn instead of sending the image again
+                        speculation = "refined"
+                        request_history = history+[{"role": "user", "content": system_prompt}, {"role": "assistant", "content": analysis}]
+                        query = follow_up_prompt+speech_to_text_output
+                        encoded_image = None
+                    else:
+                        speculation = "failed"
+            else:
+                logging.info(f"Follow-up on the session's image, sent as text with {len(history)//2} earlier turn(s)")
+                query = follow_up_prompt+speech_to_text_output
+                encoded_image = None
+                doctor_response = None
+            if doctor_response is not None:
+                tts_pipeline.submit(doctor_response)
+                yield speech_to_text_output, doctor_response, None
+            else:
+                doctor_response = ""
+                with graph.timed("vision"):
+                    tokens = vision.stream(query, encoded_image, mime_type, request_history)
+                    async for token in tts_pipeline.feed(iterate_with_deadline(tokens, VISION_TIMEOUT)):
+                        doctor_response += token
+                        yield speech_to_text_output, doctor_response, None
+                if doctor_response and send_image and not history:
+                    await asyncio.to_thread(vision_cache.set, vision_cache_key(system_prompt+speech_to_text_output, vision.model, image.encoded), doctor_response)
+            if session is not None and doctor_response:
+                session.record(speech_to_text_output, doctor_response, image_digest if send_image else None)
+            # Process totals: the caches are shared, so a per-turn difference would count concurrent turns too
+            stats = vision_cache.stats()
+            logging.info(f"Vision cache since startup: {stats['hits']} hits / {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate, {stats['entries']} entries, {stats['bytes']} bytes)")
+        else:
+            doctor_response = "No image provided for me to analyze"
+            tts_pipeline.submit(doctor_response)
+
+        #Step3: collect the voice reply
+        audio = None
+        if speak:
+            with graph.timed("tts"):
+                audio = await asyncio.wait_for(tts_pipeline.join(), TTS_TIMEOUT)
+            stats = tts_cache.stats()
+            logging.info(f"TTS phrase cache since startup: {stats['hits']} hits / {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)")
+            if output_filepath:
+                await asyncio.to_thread(_write_audio, output_filepath, audio)
+                audio = output_filepath
+            elif AUDIO_OUTPUT == "file":
+                audio = await asyncio.to_thread(outputs.write, audio, session_id)
+    finally:
+        graph.cancel()
+        tts_pipeline.cancel()
+        if speculated:
+            # Whatever was not reused or refined (a cache hit, a cancelled turn) was wasted
+            speculative_vision.inc(outcome=speculation or "discarded")
+            logging.info(f"Speculative pre-analysis: {speculation or 'discarded'}")
+        timings = dict(graph.timings, total=graph.total())
+        stage_timings.append(timings)
+        record_stages(timings)
+        logging.info(f"Stage timings: {graph.summary()}")
+
+    yield speech_to_text_output, doctor_response, audio
@@ -1,46 +1,37 @@
-# if you dont use pipenv uncomment the following:
-from dotenv import load_dotenv
-load_dotenv()
+# Load .env before anything reads its settings
+from settings import load_env
+load_env()
 
 #VoiceBot UI with Gradio
 import os
+import logging
 import gradio as gr
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 
-from brain_of_the_doctor import encode_image, analyze_image_with_query
-from voice_of_the_patient import record_audio, transcribe_with_groq
-from voice_of_the_doctor import text_to_speech_with_gtts
+# process_inputs is an async generator, so Gradio runs it on its event loop
+# instead of parking a worker thread on every Groq and TTS call
+from consultation import process_inputs
+from ingest import MAX_AUDIO_BYTES, MAX_IMAGE_BYTES
+from output_manager import outputs
+from telemetry import render_metrics
+from voice_of_the_patient import warm_transcoder
 
-load_dotenv()
+# Every request writes its own audio file, so sessions can run side by side
+CONCURRENCY_LIMIT=int(os.environ.get("GRADIO_CONCURRENCY_LIMIT", "8"))
+SERVER_NAME=os.environ.get("GRADIO_SERVER_NAME", "127.0.0.1")
+SERVER_PORT=int(os.environ.get("GRADIO_SERVER_PORT", "7860"))
 
-system_prompt="""You have to act as a professional doctor, i know you are not but this is for learning purpose. 
-            What's in this image?. Do you find anything wrong with it medically? 
-            If you make a differential, suggest some remedies for them. Donot add any numbers or special characters in 
-            your response. Your response should be in one long paragraph. Also always answer as if you are answering to a real person.
-            Donot say 'In the image I see' but say 'With what I see, I think you have ....'
-            Dont respond as an AI model in markdown, your answer should mimic that of an actual doctor not an AI bot, 
-            Keep your answer concise (max 2 sentences). No preamble, start your answer right away please"""
 
-
-def process_inputs(audio_filepath, image_filepath):
-    speech_to_text_output = transcribe_with_groq(GROQ_API_KEY=os.environ.get("GROQ_API_KEY"), 
-                                                 audio_filepath=audio_filepath,
-                                                 stt_model="whisper-large-v3")
-
-    # Handle the image input
-    if image_filepath:
-        doctor_response = analyze_image_with_query(query=system_prompt+speech_to_text_output, encoded_image=encode_image(image_filepath), model="llama-3.2-11b-vision-preview")
-    else:
-        doctor_response = "No image provided for me to analyze"
-
-    # voice_of_doctor = text_to_speech_with_elevenlabs(input_text=doctor_response, output_filepath="final.mp3") 
-    voice_of_doctor = text_to_speech_with_gtts(input_text=doctor_response, output_filepath="final.mp3")
-
-    return speech_to_text_output, doctor_response, voice_of_doctor
+async def consult(audio_filepath, image_filepath, request: gr.Request):
+    session_id = request.session_hash if request else None
+    async for update in process_inputs(audio_filepath, image_filepath, session_id=session_id):
+        yield update
 
 
 # Create the interface
 iface = gr.Interface(
-    fn=process_inputs,
+    fn=consult,
     inputs=[
         gr.Audio(sources=["microphone"], type="filepath"),
         gr.Image(type="filepath")
@@ -48,11 +39,31 @@ iface = gr.Interface(
     outputs=[
         gr.Textbox(label="Speech to Text"),
         gr.Textbox(label="Doctor's Response"),
-        gr.Audio("Temp.mp3")
+        # The reply arrives as MP3 bytes and plays in the browser, nothing is played on the server
+        gr.Audio(label="Doctor's Voice", autoplay=True)
     ],
     title="Medipulse with Vision and Voice"
 )
 
-iface.launch(debug=True)
+iface.queue(default_concurrency_limit=CONCURRENCY_LIMIT)
+
+# Prometheus scrapes /metrics on the same server; the UI is mounted at the root
+app = FastAPI()
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+# Oversize uploads are refused by the server before they reach the pipeline
+app = gr.mount_gradio_app(app, iface, path="/", max_file_size=max(MAX_AUDIO_BYTES, MAX_IMAGE_BYTES))
+
+if __name__ == "__main__":
+    import uvicorn
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    outputs.start_cleanup()
+    warm_transcoder()
+    uvicorn.run(app, host=SERVER_NAME, port=SERVER_PORT)
 
 #http://127.0.0.1:7860
+#http://127.0.0.1:7860/metrics
\ No newline at end of file
@@ -0,0 +1,149 @@
+# Process-wide Groq client registry shared by the STT and vision calls.
+# Building a new Groq() per call means a new connection pool and a new TLS
+# handshake every time, so both modules borrow clients from here instead.
+# Async clients are kept per event loop: their connections belong to the loop that opened them,
+# so a client from an earlier asyncio.run would hand out dead keep-alive connections.
+import os
+import asyncio
+import logging
+import threading
+
+from settings import get_env
+from telemetry import record_retry
+
+#Step1: Pool settings (override through the environment)
+GROQ_POOL_SIZE=int(os.environ.get("GROQ_POOL_SIZE", "10"))
+GROQ_KEEPALIVE_CONNECTIONS=int(os.environ.get("GROQ_KEEPALIVE_CONNECTIONS", str(GROQ_POOL_SIZE)))
+GROQ_KEEPALIVE_EXPIRY=float(os.environ.get("GROQ_KEEPALIVE_EXPIRY", "60"))
+GROQ_TIMEOUT=float(os.environ.get("GROQ_TIMEOUT", "60"))
+GROQ_CONNECT_TIMEOUT=float(os.environ.get("GROQ_CONNECT_TIMEOUT", "10"))
+
+_lock=threading.Lock()
+_clients={}
+_stats={"hits": 0, "misses": 0}
+
+
+def _is_retryable(status_code):
+    # groq_scheduler retries these; counting them shows rate limiting and provider trouble
+    return status_code==429 or status_code>=500
+
+
+def _count_retry(response):
+    if _is_retryable(response.status_code):
+        record_retry("groq", response.status_code)
+
+
+async def _acount_retry(response):
+    _count_retry(response)
+
+
+def _build_http_client(asynchronous=False):
+    import httpx
+
+    limits=httpx.Limits(
+        max_connections=GROQ_POOL_SIZE,
+        max_keepalive_connections=GROQ_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=GROQ_KEEPALIVE_EXPIRY
+    )
+    timeout=httpx.Timeout(GROQ_TIMEOUT, connect=GROQ_CONNECT_TIMEOUT)
+    if asynchronous:
+        return httpx.AsyncClient(limits=limits, timeout=timeout, event_hooks={"response": [_acount_retry]})
+    return httpx.Client(limits=limits, timeout=timeout, event_hooks={"response": [_count_retry]})
+
+
+#Step2: Hand out one client per API key
+def get_groq_client(api_key=None):
+    """
+    Return the shared Groq client for api_key, creating it on first use.
+
+    Args:
+    api_key (str): Groq API key. Defaults to the GROQ_API_KEY environment variable.
+    """
+    from groq import Groq
+
+    return _get_client(Groq, api_key, asynchronous=False)
+
+
+def get_async_groq_client(api_key=None):
+    """Return the shared AsyncGroq client for api_key, for use from the asyncio pipeline."""
+    from groq import AsyncGroq
+
+    return _get_client(AsyncGroq, api_key, asynchronous=True)
+
+
+def _get_client(client_class, api_key, asynchronous):
+    api_key=api_key or get_env("GROQ_API_KEY")
+    loop=asyncio.get_running_loop() if asynchronous else None
+    key=(client_class.__name__, api_key, loop)
+    with _lock:
+        if asynchronous:
+            # Clients of loops closed without asyncio.run: their connections died with the loop
+            for stale in [other for other in _clients if other[2] is not None and other[2].is_closed()]:
+                del _clients[stale]
+        entry=_clients.get(key)
+        if entry is not None:
+            _stats["hits"]+=1
+            return entry[0]
+
+        _stats["misses"]+=1
+        # groq_scheduler owns retries, so the SDK does not retry on top of it
+        client=client_class(api_key=api_key, timeout=GROQ_TIMEOUT, max_retries=0, http_client=_build_http_client(asynchronous))
+        _clients[key]=(client, _close_with_loop(client) if asynchronous else None)
+        logging.info(f"Created pooled {client_class.__name__} client (pool size {GROQ_POOL_SIZE}, timeout {GROQ_TIMEOUT}s)")
+        return client
+
+
+def _close_with_loop(client):
+    """
+    Tie an async client's lifetime to the running loop and return the tie.
+    The loop tracks started async generators and closes them when it shuts down (asyncio.run does),
+    so this one, parked at its yield, closes the client on the way out.
+    """
+    async def until_loop_ends():
+        try:
+            yield
+        finally:
+            _forget(client)
+            await client.close()
+
+    tie=until_loop_ends()
+    # Run it to its yield now; nothing in it awaits before that
+    try:
+        tie.asend(None).send(None)
+    except StopIteration:
+        pass
+    return tie
+
+
+def _forget(client):
+    with _lock:
+        for key in [key for key, (pooled, _) in _clients.items() if pooled is client]:
+            del _clients[key]
+
+
+def pool_stats():
+    """Return hit/miss counters for the client registry."""
+    with _lock:
+        lookups=_stats["hits"]+_stats["misses"]
+        return {
+            "hits": _stats["hits"],
+            "misses": _stats["misses"],
+            "hit_rate": _stats["hits"]/lookups if lookups else 0.0,
+            "clients": len(_clients),
+        }
+
+
+def close_clients():
+    """Close every pooled client and reset the counters."""
+    with _lock:
+        entries=list(_clients.items())
+        _clients.clear()
+        _stats["hits"]=0
+        _stats["misses"]=0
+    for (_, _, loop), (client, tie) in entries:
+        if loop is None:
+            client.close()
+        elif loop.is_running():
+            asyncio.run_coroutine_threadsafe(tie.aclose(), loop)
+        elif not loop.is_closed():
+            loop.run_until_complete(tie.aclose())
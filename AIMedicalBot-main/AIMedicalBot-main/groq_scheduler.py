@@ -0,0 +1,248 @@
+# Central admission control for Groq calls.
+# Every STT and vision request takes a token from its model's bucket before it goes out, so
+# many sessions at once stay under the per-model rate limit instead of all getting 429s.
+# Waiting requests are served by priority (interactive turns before background jobs), and
+# 429/5xx/connection failures are retried with exponential backoff and full jitter.
+import os
+import sys
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from telemetry import scheduler_wait_seconds
+
+INTERACTIVE=0
+BACKGROUND=1
+PRIORITY_NAMES={INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+#Step1: Limits and retry settings (override through the environment)
+# Requests per minute per model, e.g. GROQ_MODEL_RPM="whisper-large-v3=20,llama-3.2-11b-vision-preview=30"
+GROQ_DEFAULT_RPM=float(os.environ.get("GROQ_DEFAULT_RPM", "30"))
+GROQ_MODEL_RPM=os.environ.get("GROQ_MODEL_RPM", "whisper-large-v3=20")
+# How many requests may go out back to back before the rate applies
+GROQ_BURST=float(os.environ.get("GROQ_BURST", "5"))
+GROQ_MAX_RETRIES=int(os.environ.get("GROQ_MAX_RETRIES", "4"))
+GROQ_BACKOFF_BASE=float(os.environ.get("GROQ_BACKOFF_BASE", "0.5"))
+GROQ_BACKOFF_CAP=float(os.environ.get("GROQ_BACKOFF_CAP", "20"))
+
+_priority=ContextVar("groq_priority", default=INTERACTIVE)
+
+
+def parse_limits(text):
+    """Parse "model=rpm,model=rpm" into a dict."""
+    limits={}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        model, rpm=item.rsplit("=", 1)
+        limits[model.strip()]=float(rpm)
+    return limits
+
+
+@contextmanager
+def priority(level):
+    """Run Groq calls made in the block (and in tasks or threads started from it) at this priority."""
+    token=_priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, clock=time.monotonic):
+        """
+        Args:
+        rate (float): Tokens added per second.
+        burst (float): Most tokens the bucket holds.
+        """
+        self.rate=rate
+        self.burst=burst
+        self.clock=clock
+        self.tokens=burst
+        self.updated=clock()
+
+    def _refill(self):
+        now=self.clock()
+        self.tokens=min(self.burst, self.tokens+(now-self.updated)*self.rate)
+        self.updated=now
+
+    def take(self, cost=1):
+        """Take cost tokens and return 0, or return the seconds until they will be there."""
+        self._refill()
+        if self.tokens>=cost:
+            self.tokens-=cost
+            return 0
+        return (cost-self.tokens)/self.rate
+
+    def pause(self, seconds):
+        """Admit nothing for the next seconds, e.g. after the provider said Retry-After."""
+        self._refill()
+        self.tokens=min(self.tokens, 1-seconds*self.rate)
+
+
+class _Waiter:
+    def __init__(self, level, seq, wake):
+        self.level=level
+        self.seq=seq
+        self.wake=wake
+        self.granted=False
+        self.cancelled=False
+
+    def __lt__(self, other):
+        return (self.level, self.seq)<(other.level, other.seq)
+
+
+class GroqScheduler:
+    def __init__(self, limits=None, default_rpm=GROQ_DEFAULT_RPM, burst=GROQ_BURST, max_retries=GROQ_MAX_RETRIES,
+                 backoff_base=GROQ_BACKOFF_BASE, backoff_cap=GROQ_BACKOFF_CAP):
+        self.limits=parse_limits(GROQ_MODEL_RPM) if limits is None else dict(limits)
+        self.default_rpm=default_rpm
+        self.burst=burst
+        self.max_retries=max_retries
+        self.backoff_base=backoff_base
+        self.backoff_cap=backoff_cap
+        self._lock=threading.Lock()
+        self._buckets={}
+        self._waiting={}
+        self._seq=itertools.count()
+
+    def bucket(self, model):
+        with self._lock:
+            return self._bucket(model)
+
+    def _bucket(self, model):
+        if model not in self._buckets:
+            rpm=self.limits.get(model, self.default_rpm)
+            self._buckets[model]=TokenBucket(rpm/60, min(self.burst, rpm) or 1)
+            self._waiting[model]=[]
+        return self._buckets[model]
+
+    #Step2: admission, in priority order
+    def _dispatch(self, model):
+        """Grant tokens to waiters in priority order. Returns the seconds until the next token, or 0."""
+        bucket=self._bucket(model)
+        waiting=self._waiting[model]
+        while waiting:
+            if waiting[0].cancelled:
+                heapq.heappop(waiting)
+                continue
+            delay=bucket.take()
+            if delay:
+                return delay
+            waiter=heapq.heappop(waiting)
+            waiter.granted=True
+            waiter.wake()
+        return 0
+
+    def _enqueue(self, model, level, wake):
+        waiter=_Waiter(current_priority() if level is None else level, next(self._seq), wake)
+        with self._lock:
+            self._bucket(model)
+            heapq.heappush(self._waiting[model], waiter)
+            delay=self._dispatch(model)
+        return waiter, delay
+
+    def acquire(self, model, level=None):
+        """Block until a request to model may go out."""
+        start=time.perf_counter()
+        event=threading.Event()
+        waiter, delay=self._enqueue(model, level, event.set)
+        while not waiter.granted:
+            event.wait(delay)
+            with self._lock:
+                delay=self._dispatch(model)
+        scheduler_wait_seconds.observe(time.perf_counter()-start, model=model, priority=PRIORITY_NAMES.get(waiter.level, waiter.level))
+
+    async def aacquire(self, model, level=None):
+        """Wait on the event loop until a request to model may go out."""
+        start=time.perf_counter()
+        loop=asyncio.get_running_loop()
+        event=asyncio.Event()
+        waiter, delay=self._enqueue(model, level, lambda: loop.call_soon_threadsafe(event.set))
+        try:
+            while not waiter.granted:
+                try:
+                    await asyncio.wait_for(event.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                with self._lock:
+                    delay=self._dispatch(model)
+        except BaseException:
+            waiter.cancelled=True
+            raise
+        scheduler_wait_seconds.observe(time.perf_counter()-start, model=model, priority=PRIORITY_NAMES.get(waiter.level, waiter.level))
+
+    #Step3: retries with backoff and full jitter
+    def retry_delay(self, error, attempt):
+        """Seconds to wait before retrying after error, or None when it should not be retried."""
+        if attempt>=self.max_retries:
+            return None
+        status=getattr(error, "status_code", None)
+        if status is None:
+            # Connection problems and timeouts are worth another try; the SDK is loaded if it raised one
+            groq=sys.modules.get("groq")
+            if groq is None or not isinstance(error, groq.APIConnectionError):
+                return None
+        elif status!=429 and status<500:
+            return None
+        backoff=random.uniform(0, min(self.backoff_cap, self.backoff_base*2**attempt))
+        return max(backoff, _retry_after(error) or 0)
+
+    def _penalize(self, model, error, delay):
+        # A 429 means the shared quota is gone, so hold back every waiter, not just this one
+        if getattr(error, "status_code", None)==429:
+            with self._lock:
+                self._bucket(model).pause(delay)
+
+    def call(self, model, request, level=None):
+        """
+        Run request() once a token for model is free, retrying rate limits and server errors.
+
+        Args:
+        model (str): Groq model name, which picks the bucket.
+        request (callable): Makes the Groq call and returns its result.
+        level (int): INTERACTIVE or BACKGROUND, defaults to the current priority().
+        """
+        for attempt in itertools.count():
+            self.acquire(model, level)
+            try:
+                return request()
+            except Exception as e:
+                delay=self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                self._penalize(model, e, delay)
+            time.sleep(delay)
+
+    async def acall(self, model, request, level=None):
+        """Async version of call; request() returns an awaitable."""
+        for attempt in itertools.count():
+            await self.aacquire(model, level)
+            try:
+                return await request()
+            except Exception as e:
+                delay=self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                self._penalize(model, e, delay)
+            await asyncio.sleep(delay)
+
+
+def _retry_after(error):
+    response=getattr(error, "response", None)
+    headers=getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+scheduler=GroqScheduler()
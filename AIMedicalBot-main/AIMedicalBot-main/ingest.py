@@ -0,0 +1,105 @@
+# Bounded-memory reading of uploaded images and recordings.
+# An upload is size-checked before anything is read, then read in chunks that are hashed and
+# base64-encoded as they go, so a file never sits in memory as raw bytes, base64 bytes and a str
+# at the same time. Every handle is opened in a with block and closed as soon as it is read.
+import os
+import base64
+import hashlib
+from dataclasses import dataclass
+
+INGEST_CHUNK_BYTES=int(os.environ.get("INGEST_CHUNK_BYTES", str(1024*1024)))
+# Largest uploads accepted, checked before reading (the vision API only ever gets the downscaled image)
+MAX_IMAGE_BYTES=int(os.environ.get("MAX_IMAGE_BYTES", str(20*1024*1024)))
+MAX_AUDIO_BYTES=int(os.environ.get("MAX_AUDIO_BYTES", str(100*1024*1024)))
+
+
+class UploadTooLarge(ValueError):
+    def __init__(self, path, size, max_bytes):
+        super().__init__(f"{path or 'upload'} is {size} bytes, more than the {max_bytes} allowed")
+        self.path=path
+        self.size=size
+        self.max_bytes=max_bytes
+
+
+@dataclass
+class EncodedUpload:
+    encoded: str
+    sha256: str
+    size: int
+
+
+def check_size(path, max_bytes):
+    """Return the size of path, raising UploadTooLarge (without reading it) when it is over max_bytes."""
+    size=os.stat(path).st_size
+    if size>max_bytes:
+        raise UploadTooLarge(path, size, max_bytes)
+    return size
+
+
+def read_chunks(source, max_bytes, chunk_size=INGEST_CHUNK_BYTES):
+    """Yield chunks of an open binary file, raising UploadTooLarge once more than max_bytes came through."""
+    total=0
+    for chunk in iter(lambda: source.read(chunk_size), b""):
+        total+=len(chunk)
+        if total>max_bytes:
+            raise UploadTooLarge(getattr(source, "name", None), total, max_bytes)
+        yield chunk
+
+
+def hash_upload(path, max_bytes, chunk_size=INGEST_CHUNK_BYTES):
+    """sha256 of a file's content, read in chunks so a large recording is never held in memory."""
+    check_size(path, max_bytes)
+    digest=hashlib.sha256()
+    with open(path, "rb") as source:
+        for chunk in read_chunks(source, max_bytes, chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_upload(path, max_bytes):
+    """Read a whole upload that has to go out as bytes, after checking its size."""
+    size=check_size(path, max_bytes)
+    with open(path, "rb") as source:
+        # At most the size we checked, even if the file is still growing
+        return source.read(size)
+
+
+def encode_base64(source, max_bytes, chunk_size=INGEST_CHUNK_BYTES, size_hint=None):
+    """
+    Base64-encode an open binary file (or BytesIO) chunk by chunk, hashing it on the way.
+
+    Args:
+    source: File object positioned at the start of the payload.
+    max_bytes (int): Raise UploadTooLarge past this many bytes.
+    chunk_size (int): Bytes read at a time.
+    size_hint (int): Expected payload size, to allocate the output once instead of growing it.
+    """
+    digest=hashlib.sha256()
+    encoded=bytearray(-(-size_hint//3)*4 if size_hint else 0)
+    position=0
+    carry=b""
+    size=0
+    # Only whole 3-byte groups encode without padding, so the pieces join into one valid payload
+    for chunk in read_chunks(source, max_bytes, max(3, chunk_size//3*3)):
+        digest.update(chunk)
+        size+=len(chunk)
+        if carry:
+            chunk=carry+chunk  # only after a short read
+        cut=len(chunk)//3*3
+        view=memoryview(chunk)
+        piece=base64.b64encode(view[:cut])
+        encoded[position:position+len(piece)]=piece
+        position+=len(piece)
+        carry=bytes(view[cut:])
+    piece=base64.b64encode(carry)
+    encoded[position:position+len(piece)]=piece
+    # Only shrinks when the hint was too big
+    del encoded[position+len(piece):]
+    return EncodedUpload(encoded.decode('ascii'), digest.hexdigest(), size)
+
+
+def encode_file(path, max_bytes, chunk_size=INGEST_CHUNK_BYTES):
+    """encode_base64 for a file on disk, rejected before reading when it is over max_bytes."""
+    size=check_size(path, max_bytes)
+    with open(path, "rb") as source:
+        return encode_base64(source, max_bytes, chunk_size, size_hint=size)
@@ -0,0 +1,126 @@
+# Per-request output files, so concurrent consultations never overwrite each other's audio.
+# Old files are swept in the background and the directory is kept under a disk quota.
+import os
+import re
+import time
+import uuid
+import logging
+import tempfile
+import threading
+
+OUTPUT_DIR=os.environ.get("MEDIPULSE_OUTPUT_DIR", os.path.join(tempfile.gettempdir(), "medipulse"))
+OUTPUT_TTL=float(os.environ.get("OUTPUT_TTL", str(60*60)))
+OUTPUT_QUOTA_BYTES=int(os.environ.get("OUTPUT_QUOTA_BYTES", str(200*1024*1024)))
+OUTPUT_CLEANUP_INTERVAL=float(os.environ.get("OUTPUT_CLEANUP_INTERVAL", "60"))
+# Session ids come from the client, so only plain names are used as directory names
+SAFE_SESSION_ID=re.compile(r"[A-Za-z0-9_-]+")
+
+
+class OutputManager:
+    def __init__(self, root=OUTPUT_DIR, ttl=OUTPUT_TTL, quota_bytes=OUTPUT_QUOTA_BYTES, cleanup_interval=OUTPUT_CLEANUP_INTERVAL):
+        """
+        Args:
+        root (str): Directory holding one sub-directory per session.
+        ttl (float): Seconds a file is kept before the cleaner removes it.
+        quota_bytes (int): Oldest files are removed once the directory grows past this.
+        cleanup_interval (float): Seconds between background sweeps.
+        """
+        self.root=root
+        self.ttl=ttl
+        self.quota_bytes=quota_bytes
+        self.cleanup_interval=cleanup_interval
+        self._lock=threading.Lock()
+        self._stop=threading.Event()
+        self._thread=None
+
+    def new_path(self, session_id=None, suffix=".mp3"):
+        """Return a fresh, unique file path for one request of session_id."""
+        if not session_id or not SAFE_SESSION_ID.fullmatch(session_id):
+            session_id="anonymous"  # e.g. a crafted "../.." that would escape the root
+        session_dir=os.path.join(self.root, session_id)
+        os.makedirs(session_dir, exist_ok=True)
+        return os.path.join(session_dir, f"{uuid.uuid4().hex}{suffix}")
+
+    def write(self, data, session_id=None, suffix=".mp3"):
+        """Write data to a new per-request file and return its path."""
+        path=self.new_path(session_id, suffix)
+        with open(path, "wb") as output_file:
+            output_file.write(data)
+        self.enforce_quota()
+        return path
+
+    def _files(self):
+        files=[]
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path=os.path.join(directory, name)
+                try:
+                    stat=os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def cleanup(self, now=None):
+        """Remove expired files and empty session directories. Returns the number of files removed."""
+        now=now or time.time()
+        removed=0
+        with self._lock:
+            for mtime, _, path in self._files():
+                if now-mtime>self.ttl:
+                    self._remove(path)
+                    removed+=1
+            for directory, subdirs, names in os.walk(self.root, topdown=False):
+                if directory!=self.root and not subdirs and not names:
+                    try:
+                        os.rmdir(directory)
+                    except OSError:
+                        pass
+        return removed+self.enforce_quota()
+
+    def enforce_quota(self):
+        """Remove the oldest files until the directory fits in quota_bytes. Returns the number removed."""
+        removed=0
+        with self._lock:
+            files=self._files()
+            total=sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total<=self.quota_bytes:
+                    break
+                self._remove(path)
+                total-=size
+                removed+=1
+        if removed:
+            logging.info(f"Output quota reached, removed {removed} old files")
+        return removed
+
+    def start_cleanup(self):
+        """Start the background sweeper thread (once)."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+
+        def sweep():
+            while not self._stop.wait(self.cleanup_interval):
+                try:
+                    self.cleanup()
+                except Exception as e:
+                    logging.error(f"Output cleanup failed: {e}")
+
+        self._thread=threading.Thread(target=sweep, name="output-cleanup", daemon=True)
+        self._thread.start()
+
+    def stop_cleanup(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread=None
+
+
+outputs=OutputManager()
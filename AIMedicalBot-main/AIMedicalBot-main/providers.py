@@ -0,0 +1,154 @@
+# Pluggable backends for the three pipeline stages: speech to text, image+text completion and speech synthesis.
+# The consultation engine picks them by name (STT_PROVIDER, VISION_PROVIDER, TTS_ENGINE), so the whole
+# pipeline can run against the deterministic "fake" backends below for offline load tests.
+#
+# A transcriber has   async transcribe(audio_filepath) -> str
+# A vision backend has stream(query, encoded_image, mime_type, history) -> async iterator of tokens, and a model name
+# A voice has         synthesize(text) -> bytes (blocking), plus engine/voice/model/output_format for the phrase cache
+import os
+import time
+import asyncio
+
+import voice_of_the_patient
+import brain_of_the_doctor
+import voice_of_the_doctor
+from settings import get_env
+from vision_router import VisionRouter
+
+# Latency of the fake backends in seconds
+FAKE_STT_LATENCY=float(os.environ.get("FAKE_STT_LATENCY", "0.5"))
+FAKE_VISION_LATENCY=float(os.environ.get("FAKE_VISION_LATENCY", "0.5"))  # before the first token
+FAKE_TEXT_LATENCY=float(os.environ.get("FAKE_TEXT_LATENCY", "0.2"))  # the same for a text-only request, no image to read
+FAKE_TOKEN_LATENCY=float(os.environ.get("FAKE_TOKEN_LATENCY", "0.02"))  # between tokens
+FAKE_TTS_LATENCY=float(os.environ.get("FAKE_TTS_LATENCY", "0.2"))  # per sentence
+# Roughly what a 32 kbps MP3 of normal speech weighs per character
+FAKE_TTS_BYTES_PER_CHAR=int(os.environ.get("FAKE_TTS_BYTES_PER_CHAR", "256"))
+
+FAKE_TRANSCRIPT="I have had red itchy spots on my cheek for about two weeks."
+FAKE_RESPONSE=("With what I see, I think you have mild acne with some irritation around it. "
+               "Wash the area gently twice a day and try a benzoyl peroxide gel for a few weeks.")
+
+
+#Step1: the real backends, delegating to the existing Groq, gTTS and ElevenLabs functions
+class GroqTranscriber:
+    def __init__(self, model=None):
+        self.model=model or voice_of_the_patient.stt_model
+
+    async def transcribe(self, audio_filepath):
+        return await voice_of_the_patient.atranscribe_with_groq(stt_model=self.model,
+                                                                audio_filepath=audio_filepath,
+                                                                GROQ_API_KEY=get_env("GROQ_API_KEY"))
+
+
+class GroqVision:
+    def __init__(self, model=None):
+        self.model=model or "llama-3.2-11b-vision-preview"
+
+    def stream(self, query, encoded_image, mime_type=None, history=None):
+        # The consultation engine does its own cache lookup as a separate stage
+        return brain_of_the_doctor.astream_image_with_query(query=query, model=self.model, encoded_image=encoded_image,
+                                                            mime_type=mime_type, use_cache=False, history=history)
+
+
+class HedgedVision:
+    """GroqVision that hedges slow requests to VISION_FALLBACK_MODEL, see vision_router."""
+
+    def __init__(self, model=None):
+        self.router=VisionRouter(model or "llama-3.2-11b-vision-preview")
+        self.model=self.router.model
+
+    def stream(self, query, encoded_image, mime_type=None, history=None):
+        return self.router.stream(query, encoded_image, mime_type, history)
+
+
+class GttsVoice:
+    engine="gtts"
+    voice="en"
+    model="gtts"
+    output_format="mp3"
+
+    def synthesize(self, text):
+        return voice_of_the_doctor.synthesize_with_gtts(text, language=self.voice)
+
+
+class ElevenLabsVoice:
+    engine="elevenlabs"
+
+    def __init__(self, voice=None, model=None, output_format=None):
+        self.voice=voice or voice_of_the_doctor.ELEVENLABS_VOICE
+        self.model=model or voice_of_the_doctor.ELEVENLABS_MODEL
+        self.output_format=output_format or voice_of_the_doctor.ELEVENLABS_OUTPUT_FORMAT
+
+    def synthesize(self, text):
+        return voice_of_the_doctor.synthesize_with_elevenlabs(text, voice=self.voice, model=self.model, output_format=self.output_format)
+
+
+#Step2: deterministic local stand-ins with configurable latency.
+# They ignore the configured model so their answers never land in the cache under a real model name.
+class FakeTranscriber:
+    def __init__(self, model=None, transcript=FAKE_TRANSCRIPT, latency=None):
+        self.model="fake"
+        self.transcript=transcript
+        self.latency=FAKE_STT_LATENCY if latency is None else latency
+
+    async def transcribe(self, audio_filepath):
+        await asyncio.sleep(self.latency)
+        return self.transcript
+
+
+class FakeVision:
+    def __init__(self, model=None, response=FAKE_RESPONSE, latency=None, token_latency=None, text_latency=None):
+        self.model="fake"
+        self.response=response
+        self.latency=FAKE_VISION_LATENCY if latency is None else latency
+        self.token_latency=FAKE_TOKEN_LATENCY if token_latency is None else token_latency
+        self.text_latency=FAKE_TEXT_LATENCY if text_latency is None else text_latency
+
+    async def stream(self, query, encoded_image, mime_type=None, history=None):
+        await asyncio.sleep(self.latency if encoded_image else self.text_latency)
+        words=self.response.split(" ")
+        for index, word in enumerate(words):
+            if index:
+                await asyncio.sleep(self.token_latency)
+            yield word if index==len(words)-1 else word+" "
+
+
+class FakeVoice:
+    engine="fake"
+    voice="fake"
+    model="fake"
+    output_format="raw"
+
+    def __init__(self, latency=None, bytes_per_char=None):
+        self.latency=FAKE_TTS_LATENCY if latency is None else latency
+        self.bytes_per_char=FAKE_TTS_BYTES_PER_CHAR if bytes_per_char is None else bytes_per_char
+
+    def synthesize(self, text):
+        """Block like a real synthesizer would and return the text padded to a realistic audio size."""
+        time.sleep(self.latency)
+        return text.encode("utf-8").ljust(len(text)*self.bytes_per_char, b"\0")
+
+
+#Step3: registry and lookup by name
+PROVIDERS={
+    "stt": {"groq": GroqTranscriber, "fake": FakeTranscriber},
+    "vision": {"groq": GroqVision, "hedged": HedgedVision, "fake": FakeVision},
+    "tts": {"gtts": GttsVoice, "elevenlabs": ElevenLabsVoice, "fake": FakeVoice},
+}
+
+
+def get_provider(kind, name, **options):
+    """
+    Build the backend registered as name for a pipeline stage.
+
+    Args:
+    kind (str): "stt", "vision" or "tts".
+    name (str): The configured provider name, e.g. "groq" or "fake".
+    options: Passed to the provider, e.g. model="whisper-large-v3".
+    """
+    try:
+        factory=PROVIDERS[kind][name]
+    except KeyError:
+        choices=", ".join(sorted(PROVIDERS.get(kind, {})))
+        raise ValueError(f"Unknown {kind} provider {name!r}, expected one of: {choices}") from None
+    return factory(**options)
@@ -0,0 +1,229 @@
+# Small LRU caches with a TTL and a byte cap: on disk (sqlite), in memory, or both.
+# Used to skip repeat round trips for inputs we have already seen.
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+CACHE_DIR=os.environ.get("MEDIPULSE_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+
+def make_key(*parts):
+    """Hash the given parts (str or bytes) into a stable cache key."""
+    digest=hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part=part.encode('utf-8')
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def normalize_text(text):
+    """Lowercase, drop punctuation and collapse whitespace so near-identical wording shares a key."""
+    text=re.sub(r"[^\w\s]", " ", (text or "").lower())
+    return " ".join(text.split())
+
+
+class DiskCache:
+    def __init__(self, path, max_bytes, ttl=None):
+        """
+        Args:
+        path (str): sqlite file holding the cache.
+        max_bytes (int): Total size of stored values before least recently used entries are evicted.
+        ttl (float): Seconds an entry stays valid, or None to keep entries until evicted.
+        """
+        self.path=path
+        self.max_bytes=max_bytes
+        self.ttl=ttl
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+        self._lock=threading.Lock()
+        self._db=None
+
+    def _connect(self):
+        # Opened on first use so creating a cache never touches the disk
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db=sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value BLOB, size INTEGER, created REAL, accessed REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            self._db.commit()
+        return self._db
+
+    def get(self, key):
+        with self._lock:
+            db=self._connect()
+            row=db.execute("SELECT value, created FROM entries WHERE key=?", (key,)).fetchone()
+            now=time.time()
+            if row is not None and self.ttl is not None and now-row[1]>self.ttl:
+                db.execute("DELETE FROM entries WHERE key=?", (key,))
+                db.commit()
+                row=None
+            if row is None:
+                self.misses+=1
+                return None
+            db.execute("UPDATE entries SET accessed=? WHERE key=?", (now, key))
+            db.commit()
+            self.hits+=1
+            return row[0]
+
+    def set(self, key, value):
+        if isinstance(value, str):
+            value=value.encode('utf-8')
+        if len(value)>self.max_bytes:
+            return
+        with self._lock:
+            db=self._connect()
+            now=time.time()
+            db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now, now)
+            )
+            self._evict(db)
+            db.commit()
+
+    def _evict(self, db):
+        if self.ttl is not None:
+            self.evictions+=db.execute("DELETE FROM entries WHERE created<?", (time.time()-self.ttl,)).rowcount
+        total=db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total<=self.max_bytes:
+            return
+        for key, size in db.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall():
+            db.execute("DELETE FROM entries WHERE key=?", (key,))
+            self.evictions+=1
+            total-=size
+            if total<=self.max_bytes:
+                break
+
+    def stats(self):
+        with self._lock:
+            db=self._connect()
+            entries, size=db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            lookups=self.hits+self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits/lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": entries,
+                "bytes": size,
+            }
+
+    def clear(self):
+        with self._lock:
+            db=self._connect()
+            db.execute("DELETE FROM entries")
+            db.commit()
+            self.hits=self.misses=self.evictions=0
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db=None
+
+
+class MemoryCache:
+    def __init__(self, max_bytes):
+        """
+        Args:
+        max_bytes (int): Total size of stored values before least recently used entries are evicted.
+        """
+        self.max_bytes=max_bytes
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+        self._size=0
+        self._entries=OrderedDict()
+        self._lock=threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value=self._entries.get(key)
+            if value is None:
+                self.misses+=1
+                return None
+            self._entries.move_to_end(key)
+            self.hits+=1
+            return value
+
+    def set(self, key, value):
+        if isinstance(value, str):
+            value=value.encode('utf-8')
+        if len(value)>self.max_bytes:
+            return
+        with self._lock:
+            old=self._entries.pop(key, None)
+            if old is not None:
+                self._size-=len(old)
+            self._entries[key]=value
+            self._size+=len(value)
+            while self._size>self.max_bytes:
+                _, evicted=self._entries.popitem(last=False)
+                self._size-=len(evicted)
+                self.evictions+=1
+
+    def stats(self):
+        with self._lock:
+            lookups=self.hits+self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits/lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._size,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size=0
+            self.hits=self.misses=self.evictions=0
+
+
+class TieredCache:
+    """A memory tier in front of a disk tier. Disk hits are promoted into memory."""
+
+    def __init__(self, memory, disk):
+        self.memory=memory
+        self.disk=disk
+
+    def get(self, key):
+        value=self.memory.get(key)
+        if value is not None:
+            return value
+        value=self.disk.get(key)
+        if value is not None:
+            self.memory.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        self.disk.set(key, value)
+
+    def stats(self):
+        memory=self.memory.stats()
+        disk=self.disk.stats()
+        # Every lookup reaches memory; only memory misses reach the disk
+        lookups=memory["hits"]+memory["misses"]
+        hits=memory["hits"]+disk["hits"]
+        return {
+            "hits": hits,
+            "misses": lookups-hits,
+            "hit_rate": hits/lookups if lookups else 0.0,
+            "memory": memory,
+            "disk": disk,
+        }
+
+    def clear(self):
+        self.memory.clear()
+        self.disk.clear()
@@ -0,0 +1,110 @@
+# Conversation state per consultation session.
+# A session keeps the patient's earlier questions and the doctor's answers (trimmed to a token
+# budget) and the sha256 of the photo it last analyzed. A follow-up about the same photo is sent
+# as a short text request with that history; the image only goes out again when it changes.
+# Only the digest is kept, not the encoded photo, so a session costs a few kilobytes at most.
+# The turn that sent the photo is what follow-ups know about it, so it is never trimmed.
+import os
+import time
+import threading
+from collections import OrderedDict
+
+# Rough token count of the history sent with a follow-up
+HISTORY_TOKEN_BUDGET=int(os.environ.get("HISTORY_TOKEN_BUDGET", "1000"))
+# Idle sessions are dropped after this many seconds, and the least recently used past SESSION_MAX
+SESSION_TTL=float(os.environ.get("SESSION_TTL", str(30*60)))
+SESSION_MAX=int(os.environ.get("SESSION_MAX", "200"))
+
+
+def estimate_tokens(text):
+    """About four characters per token for English, close enough for budgeting."""
+    return len(text)//4+1
+
+
+class Session:
+    def __init__(self, session_id, token_budget=HISTORY_TOKEN_BUDGET):
+        self.id=session_id
+        self.token_budget=token_budget
+        self.turns=[]
+        # sha256 of the upload last sent to the vision model, and the turn that sent it
+        self.image_digest=None
+        self.image_turn=None
+        self.updated=time.monotonic()
+
+    def _kept(self):
+        """Indexes of the turns that fit the token budget: the image turn, then the newest others."""
+        pinned=[index for index, turn in enumerate(self.turns) if turn is self.image_turn]
+        tokens=sum(estimate_tokens(question)+estimate_tokens(answer) for question, answer in (self.turns[index] for index in pinned))
+        kept=set(pinned)
+        for index in reversed(range(len(self.turns))):
+            if index in kept:
+                continue
+            question, answer=self.turns[index]
+            tokens+=estimate_tokens(question)+estimate_tokens(answer)
+            if tokens>self.token_budget:
+                break
+            kept.add(index)
+        return kept
+
+    def history(self):
+        """
+        Earlier turns as chat messages, oldest first. The oldest are dropped to stay within the token
+        budget, except the turn that sent the session's image: it describes what follow-ups are about.
+        """
+        kept=self._kept()
+        messages=[]
+        for index, (question, answer) in enumerate(self.turns):
+            if index in kept:
+                messages.append({"role": "user", "content": question})
+                messages.append({"role": "assistant", "content": answer})
+        return messages
+
+    def record(self, question, answer, image_digest=None):
+        """Remember a finished turn, and the image it was about when one was sent."""
+        turn=(question, answer)
+        self.turns.append(turn)
+        if image_digest is not None:
+            self.image_digest=image_digest
+            self.image_turn=turn
+        # Turns that can no longer fit in any history are not worth keeping
+        kept=self._kept()
+        self.turns=[turn for index, turn in enumerate(self.turns) if index in kept or index==len(self.turns)-1]
+        self.updated=time.monotonic()
+
+
+class SessionStore:
+    def __init__(self, ttl=SESSION_TTL, max_sessions=SESSION_MAX, token_budget=HISTORY_TOKEN_BUDGET):
+        """
+        Args:
+        ttl (float): Seconds a session may sit idle before it is forgotten.
+        max_sessions (int): Least recently used sessions are dropped past this many.
+        token_budget (int): History budget of new sessions.
+        """
+        self.ttl=ttl
+        self.max_sessions=max_sessions
+        self.token_budget=token_budget
+        self._sessions=OrderedDict()
+        self._lock=threading.Lock()
+
+    def get(self, session_id):
+        """Return the session for session_id, starting a new one if it is unknown or expired."""
+        with self._lock:
+            now=time.monotonic()
+            session=self._sessions.pop(session_id, None)
+            if session is None or now-session.updated>self.ttl:
+                session=Session(session_id, self.token_budget)
+            session.updated=now
+            self._sessions[session_id]=session
+            while len(self._sessions)>self.max_sessions or now-next(iter(self._sessions.values())).updated>self.ttl:
+                self._sessions.popitem(last=False)
+            return session
+
+    def drop(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+sessions=SessionStore()
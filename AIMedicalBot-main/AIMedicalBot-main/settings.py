@@ -0,0 +1,29 @@
+# Environment settings. The .env file is read once per process, and only when asked for, so
+# importing the app modules never touches the disk.
+# get_env reads .env first, which covers the API keys. Most other settings (providers, timeouts,
+# rate limits, ...) are module constants read from os.environ at import time, so entry points
+# (gradio_app.py, batch.py, benchmark.py) call load_env() before importing the pipeline.
+import os
+import threading
+
+ENV_FILE=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
+
+_lock=threading.Lock()
+_loaded=False
+
+
+def load_env():
+    """Load .env into os.environ (once). Existing environment variables win."""
+    global _loaded
+    with _lock:
+        if _loaded:
+            return
+        from dotenv import load_dotenv
+
+        load_dotenv(ENV_FILE)
+        _loaded=True
+
+
+def get_env(name, default=None):
+    load_env()
+    return os.environ.get(name, default)
@@ -0,0 +1,191 @@
+# Sentence-pipelined text to speech: every finished sentence of the doctor's
+# answer is handed to a TTS worker while the model is still writing the rest.
+import os
+import re
+import asyncio
+import inspect
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from response_cache import CACHE_DIR, DiskCache, MemoryCache, TieredCache, make_key
+from telemetry import cache_lookups
+
+TTS_WORKERS=int(os.environ.get("TTS_WORKERS", "4"))
+# Very short sentences are merged into the next one to avoid choppy audio
+MIN_SENTENCE_CHARS=int(os.environ.get("MIN_SENTENCE_CHARS", "20"))
+
+SENTENCE_END=re.compile(r"(?<=[.!?])\s+")
+
+# Phrase cache: stock sentences (disclaimers, remedies, the no-image fallback) are synthesized once
+TTS_CACHE_MEMORY_BYTES=int(os.environ.get("TTS_CACHE_MEMORY_BYTES", str(16*1024*1024)))
+TTS_CACHE_DISK_BYTES=int(os.environ.get("TTS_CACHE_DISK_BYTES", str(200*1024*1024)))
+
+tts_cache=TieredCache(
+    MemoryCache(TTS_CACHE_MEMORY_BYTES),
+    DiskCache(os.path.join(CACHE_DIR, "tts.sqlite3"), max_bytes=TTS_CACHE_DISK_BYTES)
+)
+
+
+def tts_cache_key(text, engine, voice="", model="", output_format="mp3"):
+    # Case and spacing do not change the spoken audio
+    return make_key(engine, voice, model, output_format, " ".join(text.split()).lower())
+
+
+def cached_synthesizer(synthesize, engine, voice="", model="", output_format="mp3"):
+    """Wrap a blocking synthesize(text) -> bytes function with the phrase cache."""
+    def synthesize_cached(text):
+        key=tts_cache_key(text, engine, voice, model, output_format)
+        audio=tts_cache.get(key)
+        cache_lookups.inc(cache="tts", result="miss" if audio is None else "hit")
+        if audio is None:
+            audio=synthesize(text)
+            tts_cache.set(key, audio)
+        return audio
+
+    return synthesize_cached
+
+
+class SentenceSplitter:
+    """Collects streamed text and hands back each sentence as soon as it ends."""
+
+    def __init__(self, min_chars=MIN_SENTENCE_CHARS):
+        self.min_chars=min_chars
+        self._buffer=""
+        self._pending=""
+
+    def push(self, chunk):
+        self._buffer+=chunk
+        parts=SENTENCE_END.split(self._buffer)
+        self._buffer=parts.pop()
+        sentences=[]
+        for sentence in parts:
+            self._pending=f"{self._pending} {sentence.strip()}".strip()
+            if len(self._pending)>=self.min_chars:
+                sentences.append(self._pending)
+                self._pending=""
+        return sentences
+
+    def flush(self):
+        tail=f"{self._pending} {self._buffer.strip()}".strip()
+        self._buffer=self._pending=""
+        return [tail] if tail else []
+
+
+def split_sentences(chunks, min_chars=MIN_SENTENCE_CHARS):
+    """Yield complete sentences from a stream of text chunks as soon as each one ends."""
+    splitter=SentenceSplitter(min_chars)
+    for chunk in chunks:
+        yield from splitter.push(chunk)
+    yield from splitter.flush()
+
+
+class SentenceTTSPipeline:
+    def __init__(self, synthesize, max_workers=TTS_WORKERS):
+        """
+        Args:
+        synthesize (callable): Turns one sentence into encoded audio bytes, e.g. synthesize_with_gtts.
+        max_workers (int): Number of sentences synthesized in parallel.
+        """
+        self.synthesize=synthesize
+        self.sentences=[]
+        self._segments=[]
+        self._executor=ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts")
+
+    def submit(self, sentence):
+        self.sentences.append(sentence)
+        self._segments.append(self._executor.submit(self.synthesize, sentence))
+
+    def feed(self, chunks):
+        """Pass text chunks through unchanged while queueing each finished sentence for synthesis."""
+        splitter=SentenceSplitter()
+        for chunk in chunks:
+            for sentence in splitter.push(chunk):
+                self.submit(sentence)
+            yield chunk
+        for sentence in splitter.flush():
+            self.submit(sentence)
+
+    def join(self):
+        """Wait for every segment and return them joined in sentence order."""
+        try:
+            # MP3 is a plain sequence of frames, so segments concatenate byte for byte
+            audio=b"".join(segment.result() for segment in self._segments)
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        logging.info(f"Synthesized {len(self._segments)} sentences into {len(audio)} bytes of audio")
+        return audio
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class AsyncSentenceTTSPipeline:
+    def __init__(self, synthesize, max_workers=TTS_WORKERS):
+        """
+        Asyncio version of SentenceTTSPipeline. Blocking synthesize functions
+        (like gTTS) run in threads, coroutine functions are awaited directly.
+
+        Args:
+        synthesize (callable): Turns one sentence into encoded audio bytes.
+        max_workers (int): Number of sentences synthesized at the same time.
+        """
+        self.synthesize=synthesize
+        self.sentences=[]
+        self._tasks=[]
+        self._slots=asyncio.Semaphore(max_workers)
+
+    async def _synthesize(self, sentence):
+        async with self._slots:
+            if inspect.iscoroutinefunction(self.synthesize):
+                return await self.synthesize(sentence)
+            return await asyncio.to_thread(self.synthesize, sentence)
+
+    def submit(self, sentence):
+        self.sentences.append(sentence)
+        self._tasks.append(asyncio.ensure_future(self._synthesize(sentence)))
+
+    async def feed(self, chunks):
+        """Pass async text chunks through unchanged while queueing each finished sentence for synthesis."""
+        splitter=SentenceSplitter()
+        async for chunk in chunks:
+            for sentence in splitter.push(chunk):
+                self.submit(sentence)
+            yield chunk
+        for sentence in splitter.flush():
+            self.submit(sentence)
+
+    async def join(self):
+        """Wait for every segment and return them joined in sentence order."""
+        segments=await asyncio.gather(*self._tasks)
+        audio=b"".join(segments)
+        logging.info(f"Synthesized {len(segments)} sentences into {len(audio)} bytes of audio")
+        return audio
+
+    def cancel(self):
+        """Drop any synthesis still in flight, e.g. when the user has left."""
+        for task in self._tasks:
+            task.cancel()
+
+
+class SilentTTSPipeline:
+    """Stands in for AsyncSentenceTTSPipeline when no voice reply is wanted: text passes through, nothing is synthesized."""
+    def submit(self, sentence):
+        pass
+
+    async def feed(self, chunks):
+        async for chunk in chunks:
+            yield chunk
+
+    async def join(self):
+        return None
+
+    def cancel(self):
+        pass
+
+
+def synthesize_sentences(text, synthesize, max_workers=TTS_WORKERS):
+    """Synthesize a finished text sentence by sentence in parallel."""
+    pipeline=SentenceTTSPipeline(synthesize, max_workers=max_workers)
+    for _ in pipeline.feed([text]):
+        pass
+    return pipeline.join()
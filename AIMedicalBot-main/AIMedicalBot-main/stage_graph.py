@@ -0,0 +1,59 @@
+# A tiny asyncio stage graph: each stage starts as soon as the stages it depends on are done,
+# so independent work (STT, image preprocessing) overlaps. Every stage is timed.
+import time
+import asyncio
+from contextlib import contextmanager
+
+
+class StageGraph:
+    def __init__(self):
+        self.timings={}
+        self._tasks={}
+        self._start=time.perf_counter()
+
+    def add(self, name, run, *depends_on, timeout=None):
+        """
+        Schedule a stage right away and return its task.
+
+        Args:
+        name (str): Stage name used for timings and as a dependency.
+        run (callable): Coroutine function called with the results of depends_on, in order.
+        depends_on (str): Names of stages whose results this stage needs.
+        timeout (float): Seconds the stage itself may take, not counting the wait for its inputs.
+        """
+        dependencies=[self._tasks[dependency] for dependency in depends_on]
+
+        async def stage():
+            inputs=[await dependency for dependency in dependencies]
+            with self.timed(name):
+                return await asyncio.wait_for(run(*inputs), timeout)
+
+        self._tasks[name]=asyncio.ensure_future(stage())
+        return self._tasks[name]
+
+    def __getitem__(self, name):
+        return self._tasks[name]
+
+    @contextmanager
+    def timed(self, name):
+        """Time work that does not fit a single coroutine, like a streamed stage."""
+        start=time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name]=time.perf_counter()-start
+
+    def total(self):
+        return time.perf_counter()-self._start
+
+    def cancel(self):
+        """Cancel every stage that has not finished, e.g. after a failure or when the user left."""
+        for task in self._tasks.values():
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()  # a failure already surfaced through a dependent stage
+
+    def summary(self):
+        stages=" ".join(f"{name}={seconds:.2f}s" for name, seconds in self.timings.items())
+        return f"{stages} total={self.total():.2f}s"
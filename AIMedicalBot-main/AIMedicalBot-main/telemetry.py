@@ -0,0 +1,238 @@
+# Tracing spans and Prometheus-style metrics for the consultation pipeline.
+# Standard library only, so every module can import it without slowing startup.
+#
+#   with span("stt", model=stt_model) as current:
+#       ...
+#       current.set(bytes_out=len(upload), cache="miss")
+#
+# Finished spans land in recent_spans and feed the metrics below; render_metrics() returns
+# the text exposition format that gradio_app serves on /metrics.
+import os
+import time
+import asyncio
+import uuid
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Finished spans kept in memory for inspection
+TRACE_BUFFER=int(os.environ.get("TRACE_BUFFER", "1000"))
+LATENCY_BUCKETS=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+#Step1: metric types
+def _labels_text(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs=",".join(f'{name}="{str(value)}"' for name, value in zip(labelnames, values))
+    return "{"+pairs+"}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name=name
+        self.documentation=documentation
+        self.labelnames=tuple(labelnames)
+        self._values={}
+        self._lock=threading.Lock()
+        METRICS.append(self)
+
+    def inc(self, amount=1, **labels):
+        key=tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key]=self._values.get(key, 0)+amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(name, "") for name in self.labelnames), 0)
+
+    def render(self):
+        lines=[f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels_text(self.labelnames, key)} {value}")
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name=name
+        self.documentation=documentation
+        self.labelnames=tuple(labelnames)
+        self.buckets=tuple(buckets)
+        self._series={}
+        self._lock=threading.Lock()
+        METRICS.append(self)
+
+    def observe(self, value, **labels):
+        key=tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series=self._series.setdefault(key, {"counts": [0]*len(self.buckets), "count": 0, "sum": 0.0})
+            for index, bound in enumerate(self.buckets):
+                if value<=bound:
+                    series["counts"][index]+=1
+            series["count"]+=1
+            series["sum"]+=value
+
+    def count(self, **labels):
+        series=self._series.get(tuple(labels.get(name, "") for name in self.labelnames))
+        return series["count"] if series else 0
+
+    def render(self):
+        lines=[f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                names=self.labelnames+("le",)
+                for bound, count in zip(self.buckets, series["counts"]):
+                    lines.append(f"{self.name}_bucket{_labels_text(names, key+(bound,))} {count}")
+                lines.append(f"{self.name}_bucket{_labels_text(names, key+('+Inf',))} {series['count']}")
+                labels=_labels_text(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {series['sum']}")
+                lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+METRICS=[]
+
+span_seconds=Histogram("medipulse_span_seconds", "Time spent in traced provider and preprocessing calls.", ("span",))
+span_errors=Counter("medipulse_span_errors_total", "Traced calls that raised.", ("span",))
+stage_seconds=Histogram("medipulse_stage_seconds", "Time per consultation stage.", ("stage",))
+payload_bytes=Counter("medipulse_payload_bytes_total", "Bytes going into and coming out of traced calls.", ("span", "direction"))
+cache_lookups=Counter("medipulse_cache_lookups_total", "Cache lookups by cache and result.", ("cache", "result"))
+scheduler_wait_seconds=Histogram("medipulse_scheduler_wait_seconds", "Time Groq calls waited for a rate limit token.", ("model", "priority"))
+vision_routes=Counter("medipulse_vision_routes_total", "Vision answers by winning path (primary, hedge, fallback) and model.", ("path", "model"))
+retries=Counter("medipulse_retries_total", "Provider responses that trigger a retry (429 and 5xx).", ("provider", "status"))
+speculative_vision=Counter("medipulse_speculative_vision_total", "Speculative image-only pre-analyses by outcome (reused, refined, discarded, failed).", ("outcome",))
+transcodes=Counter("medipulse_transcodes_total", "ffmpeg conversions by whether a pre-started process was ready (warm) or one had to be spawned (cold).", ("start",))
+
+
+def render_metrics():
+    """Return every metric in the Prometheus text exposition format."""
+    lines=[]
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines)+"\n"
+
+
+def reset_metrics():
+    for metric in METRICS:
+        metric.reset()
+    recent_spans.clear()
+
+
+#Step2: spans
+recent_spans=deque(maxlen=TRACE_BUFFER)
+_current_span=ContextVar("current_span", default=None)
+
+
+class Span:
+    def __init__(self, name, parent=None, **attributes):
+        self.name=name
+        self.trace_id=parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id=uuid.uuid4().hex[:16]
+        self.parent_id=parent.span_id if parent else None
+        self.attributes=dict(attributes)
+        self.start=time.time()
+        self._started=time.perf_counter()
+        self.seconds=None
+        self.error=None
+
+    def set(self, **attributes):
+        """
+        Attach attributes. bytes_in (what the call consumed) and bytes_out (what it produced)
+        feed the payload metric, cache="hit"/"miss" the cache metric.
+        """
+        self.attributes.update(attributes)
+        if "cache" in attributes:
+            cache_lookups.inc(cache=self.name, result=attributes["cache"])
+        return self
+
+    def end(self, error=None):
+        if self.seconds is not None:
+            return
+        self.seconds=time.perf_counter()-self._started
+        if isinstance(error, (GeneratorExit, asyncio.CancelledError)):
+            # The caller walked away or timed out, not a provider failure
+            self.attributes["cancelled"]=True
+        elif error is not None:
+            self.error=f"{type(error).__name__}: {error}"
+            span_errors.inc(span=self.name)
+        span_seconds.observe(self.seconds, span=self.name)
+        for direction in ("in", "out"):
+            size=self.attributes.get(f"bytes_{direction}")
+            if size:
+                payload_bytes.inc(size, span=self.name, direction=direction)
+        recent_spans.append(self.to_dict())
+        logging.debug(f"span {self.name} {self.seconds:.3f}s {self.attributes}")
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "seconds": self.seconds,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+def start_span(name, **attributes):
+    """
+    Start a span under the current one without making it current.
+    Use this in generators, which can be resumed from another context; call .end() when done.
+    """
+    return Span(name, _current_span.get(), **attributes)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Trace the enclosed block as a child of the current span (or a new trace)."""
+    current=start_span(name, **attributes)
+    token=_current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(error=e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+def current_span():
+    return _current_span.get()
+
+
+@contextmanager
+def activate(current):
+    """Make current the parent of spans started in the block, and of tasks and threads created there."""
+    token=_current_span.set(current)
+    try:
+        yield current
+    finally:
+        _current_span.reset(token)
+
+
+def record_retry(provider, status):
+    """Count a retryable provider response and note it on the current span."""
+    retries.inc(provider=provider, status=status)
+    current=_current_span.get()
+    if current is not None:
+        current.attributes["retries"]=current.attributes.get("retries", 0)+1
+
+
+def record_stages(timings):
+    """Feed one request's StageGraph timings into the stage histogram."""
+    for stage, seconds in timings.items():
+        stage_seconds.observe(seconds, stage=stage)
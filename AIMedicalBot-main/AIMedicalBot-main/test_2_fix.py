@@ -1,5 +1,6 @@
 # test_error_handling.py
 import os
+import tempfile
 import pytest
 from voice_of_the_patient import transcribe_with_groq
 from brain_of_the_doctor import encode_image, analyze_image_with_query
@@ -29,10 +30,10 @@ def test_missing_inputs():
     
     # Test case 3: Empty query
     print("\nTest case 3: Empty query")
-    # Create a small test image if needed
-    test_image_path = "AIMedicalBot-main/AIMedicalBot-main/acne.jpg"
-    with open(test_image_path, "wb") as f:
+    # Create a small throwaway image, leaving the sample images alone
+    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as f:
         f.write(b"test")  # Minimal file to allow encoding
+        test_image_path = f.name
     
     try:
         encoded_image = encode_image(test_image_path)
@@ -6,6 +6,8 @@ from voice_of_the_patient import transcribe_with_groq
 from brain_of_the_doctor import encode_image, analyze_image_with_query
 from voice_of_the_doctor import text_to_speech_with_gtts, text_to_speech_with_elevenlabs
 
+HERE = os.path.dirname(os.path.abspath(__file__))
+
 def measure_performance(test_name, func, *args, **kwargs):
     """Measure and report the execution time of a function."""
     start_time = time.time()
@@ -19,10 +21,11 @@ def test_different_model_sizes():
     """Test performance with different model sizes if available."""
     # Prepare test data
     test_prompt = "What do you see on my skin?"
-    test_image_path = "AIMedicalBot-main/AIMedicalBot-main/acne.jpg"  # Make sure this exists
+    test_image_path = os.path.join(HERE, "acne.jpg")
     
     if not os.path.exists(test_image_path):
-        # Create a placeholder image if the test image doesn't exist
+        # Use a placeholder in a temp dir, never write over the sample image
+        test_image_path = os.path.join(tempfile.mkdtemp(), "placeholder.jpg")
         with open(test_image_path, "wb") as f:
             f.write(b"X" * 1000)  # Simple placeholder
     
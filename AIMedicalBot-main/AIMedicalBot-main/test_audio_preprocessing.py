@@ -0,0 +1,44 @@
+# test_audio_preprocessing.py
+import logging
+from io import BytesIO
+import pytest
+from pydub import AudioSegment
+from pydub.generators import Sine
+import voice_of_the_patient
+from ingest import UploadTooLarge
+from voice_of_the_patient import preprocess_audio, prepare_uploads
+
+def make_recording(path):
+    """1.5s of silence, 1s of 'speech', 2s of silence, in stereo at 44.1 kHz like a browser capture."""
+    speech = Sine(440).to_audio_segment(duration=1000).set_frame_rate(44100)
+    silence = AudioSegment.silent(duration=1500, frame_rate=44100)
+    recording = (silence + speech + silence + AudioSegment.silent(duration=500, frame_rate=44100)).set_channels(2)
+    recording.export(path, format="wav")
+
+def test_silence_is_trimmed_and_audio_normalized(tmp_path):
+    recording = tmp_path / "patient.wav"
+    make_recording(str(recording))
+
+    prepared = preprocess_audio(str(recording), output_format="wav")
+    audio = AudioSegment.from_file(BytesIO(prepared.data), format="wav")
+
+    assert audio.channels == 1
+    assert audio.frame_rate == 16000
+    # the 1s of speech plus 200ms of padding on each side is kept
+    assert 1.3 <= prepared.seconds_after <= 1.5
+    assert prepared.seconds_removed > 2.5
+    assert prepared.bytes_after < prepared.bytes_before
+    assert prepared.filename == "patient.wav"
+
+def test_unreadable_audio_is_uploaded_as_is(tmp_path, caplog):
+    broken = tmp_path / "broken.wav"
+    broken.write_bytes(b"not really audio")
+    assert prepare_uploads(str(broken)) == [("broken.wav", b"not really audio")]
+    assert [record.levelno for record in caplog.records if "unchunked" in record.message] == [logging.ERROR]
+
+def test_unreadable_audio_too_big_for_one_request_is_rejected(tmp_path, monkeypatch):
+    monkeypatch.setattr(voice_of_the_patient, "MAX_STT_UPLOAD_BYTES", 10)
+    broken = tmp_path / "broken.wav"
+    broken.write_bytes(b"not really audio")
+    with pytest.raises(UploadTooLarge):
+        prepare_uploads(str(broken))
@@ -0,0 +1,100 @@
+# test_batch.py
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import pytest
+import batch
+import consultation
+from test_consultation import install_fakes
+
+def make_uploads(directory, names):
+    directory.mkdir()
+    for name in names:
+        (directory / f"{name}.mp3").write_bytes(b"voice")
+        (directory / f"{name}.jpg").write_bytes(b"photo")
+    (directory / "orphan.png").write_bytes(b"photo without a voice note")
+
+def test_directory_batch_writes_jsonl_and_replies(tmp_path, monkeypatch):
+    install_fakes(monkeypatch, tmp_path)
+    make_uploads(tmp_path / "uploads", ["visit1", "visit2", "visit3"])
+    output = tmp_path / "results.jsonl"
+
+    items = batch.load_items(str(tmp_path / "uploads"))
+    assert [item["id"] for item in items] == ["visit1", "visit2", "visit3"]
+    counts = asyncio.run(batch.run_batch(items, str(output), audio_dir=str(tmp_path / "replies"), workers=2))
+
+    assert counts == (3, 0, 0)
+    results = [json.loads(line) for line in output.read_text().splitlines()]
+    assert sorted(result["id"] for result in results) == ["visit1", "visit2", "visit3"]
+    assert results[0]["response"] == "With what I see, I think you have acne. Keep the area clean."
+    assert (tmp_path / "replies" / "visit2.mp3").exists()
+
+def test_interrupted_batch_resumes_without_redoing_finished_items(tmp_path, monkeypatch):
+    install_fakes(monkeypatch, tmp_path)
+    make_uploads(tmp_path / "uploads", ["visit1", "visit2", "visit3"])
+    output = tmp_path / "results.jsonl"
+    # visit1 finished, visit2 failed, and the run died while writing visit3
+    output.write_text(json.dumps({"id": "visit1", "response": "done"}) + "\n"
+                      + json.dumps({"id": "visit2", "error": "TimeoutError: "}) + "\n"
+                      + '{"id": "visit3", "resp')
+    transcribed = []
+    transcriber = consultation.get_provider("stt", "test")
+    transcribe = transcriber.transcribe
+
+    async def counting_transcribe(audio_filepath):
+        transcribed.append(audio_filepath)
+        return await transcribe(audio_filepath)
+
+    monkeypatch.setattr(transcriber, "transcribe", counting_transcribe)
+    counts = asyncio.run(batch.run_batch(batch.load_items(str(tmp_path / "uploads")), str(output)))
+
+    assert counts == (2, 0, 1)
+    assert sorted(path.rsplit("/", 1)[-1] for path in transcribed) == ["visit2.mp3", "visit3.mp3"]
+    assert batch.finished_ids(str(output)) == {"visit1", "visit2", "visit3"}
+
+def test_manifest_paths_are_relative_to_the_manifest(tmp_path):
+    manifest = tmp_path / "day.csv"
+    manifest.write_text("id,audio,image\nmrs-k,notes/k.mp3,photos/k.jpg\nmr-b,notes/b.mp3,\n")
+    items = batch.load_items(str(manifest))
+    assert items == [
+        {"id": "mrs-k", "audio": str(tmp_path / "notes/k.mp3"), "image": str(tmp_path / "photos/k.jpg")},
+        {"id": "mr-b", "audio": str(tmp_path / "notes/b.mp3"), "image": None},
+    ]
+
+def test_replies_are_not_synthesized_without_an_audio_dir(tmp_path, monkeypatch):
+    voice = install_fakes(monkeypatch, tmp_path)
+    make_uploads(tmp_path / "uploads", ["visit1", "visit2"])
+    spoken = []
+    synthesize = voice.synthesize
+    monkeypatch.setattr(voice, "synthesize", lambda text: spoken.append(text) or synthesize(text))
+
+    counts = asyncio.run(batch.run_batch(batch.load_items(str(tmp_path / "uploads")), str(tmp_path / "results.jsonl")))
+
+    assert counts == (2, 0, 0)
+    assert spoken == []
+    assert all(json.loads(line)["reply_audio"] is None for line in (tmp_path / "results.jsonl").read_text().splitlines())
+
+def test_duplicate_ids_are_rejected(tmp_path):
+    manifest = tmp_path / "day.jsonl"
+    manifest.write_text('{"id": "mrs-k", "audio": "a.mp3"}\n{"id": "mrs-k", "audio": "b.mp3"}\n')
+    with pytest.raises(ValueError, match="mrs-k"):
+        batch.load_items(str(manifest))
+
+    make_uploads(tmp_path / "uploads", ["visit1"])
+    (tmp_path / "uploads" / "visit1.wav").write_bytes(b"the same visit, recorded twice")
+    with pytest.raises(ValueError, match="visit1"):
+        batch.load_items(str(tmp_path / "uploads"))
+
+def test_settings_from_dotenv_reach_the_pipeline_modules(tmp_path):
+    """Module-level settings are read at import time, so .env has to be loaded before the pipeline is imported."""
+    env_file = tmp_path / ".env"
+    env_file.write_text("BATCH_WORKERS=7\nSTT_PROVIDER=fake\n")
+    script = "import json, sys, settings; settings.ENV_FILE = sys.argv[1]; import batch, consultation; print(json.dumps([batch.BATCH_WORKERS, consultation.STT_PROVIDER]))"
+    env = {name: value for name, value in os.environ.items() if name not in ("BATCH_WORKERS", "STT_PROVIDER")}
+    env["PYTHONPATH"] = os.path.dirname(os.path.abspath(batch.__file__))
+
+    result = subprocess.run([sys.executable, "-c", script, str(env_file)], cwd=tmp_path, env=env, capture_output=True, text=True, check=True)
+
+    assert json.loads(result.stdout.strip().splitlines()[-1]) == [7, "fake"]
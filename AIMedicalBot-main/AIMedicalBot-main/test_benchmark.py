@@ -0,0 +1,45 @@
+# test_benchmark.py
+import os
+import subprocess
+import sys
+import pytest
+from benchmark import find_regressions, percentile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# A few seconds of load test; CI runs it as a step of its own (benchmark.py --check-baseline), opt in here with RUN_BENCHMARK=1
+RUN_BENCHMARK = os.environ.get("RUN_BENCHMARK") == "1"
+
+@pytest.mark.skipif(not RUN_BENCHMARK, reason="set RUN_BENCHMARK=1 to check against benchmark_baseline.json")
+def test_pipeline_has_not_regressed_against_the_baseline():
+    """Reruns the committed benchmark_baseline.json settings on the fake providers (a few seconds)."""
+    env = dict(os.environ, PYTHONPATH=HERE)
+    result = subprocess.run([sys.executable, os.path.join(HERE, "benchmark.py"), "--check-baseline"], env=env, capture_output=True, text=True)
+    print(result.stdout)
+    assert result.returncode == 0, result.stdout + result.stderr
+
+def test_regressions_are_reported_per_stage():
+    def report(vision_p95, throughput):
+        stages = {"vision": {"p50": 0.1, "p95": vision_p95, "p99": vision_p95}}
+        return {"levels": [{"concurrency": 8, "stages": stages, "throughput": throughput, "peak_rss_mb": 50}]}
+
+    baseline = report(0.2, 20.0)
+    assert find_regressions(report(0.3, 19.0), baseline) == []
+    assert find_regressions(report(0.5, 5.0), baseline) == [
+        "concurrency 8: vision p95 0.500s > baseline 0.200s",
+        "concurrency 8: vision p99 0.500s > baseline 0.200s",
+        "concurrency 8: throughput 5.00/s < baseline 20.00/s",
+    ]
+    assert percentile(list(range(1, 101)), 95) == 95
+
+def test_a_slower_machine_is_not_a_regression_but_worse_scaling_is():
+    def level(concurrency, total_p50, throughput):
+        return {"concurrency": concurrency, "stages": {"total": {"p50": total_p50}}, "throughput": throughput, "peak_rss_mb": None}
+
+    baseline = {"levels": [level(1, 0.2, 5.0), level(8, 0.25, 30.0)]}
+    # Single turns 20% slower and loaded turns slower by as much: the same pipeline on a slower runner
+    assert find_regressions({"levels": [level(1, 0.24, 4.2), level(8, 0.4, 25.0)]}, baseline) == []
+    # The same single turn, but concurrency no longer helps
+    assert find_regressions({"levels": [level(1, 0.2, 5.0), level(8, 0.8, 10.0)]}, baseline) == [
+        "concurrency 8: total p50 0.800s > baseline 0.250s",
+        "concurrency 8: throughput 2.0x the single-turn level's < baseline 6.0x",
+    ]
@@ -0,0 +1,62 @@
+# test_chunked_transcription.py
+import threading
+import time
+from types import SimpleNamespace
+from pydub import AudioSegment
+from pydub.generators import Sine
+import voice_of_the_patient
+from groq_scheduler import GroqScheduler
+from response_cache import DiskCache
+from voice_of_the_patient import split_audio, merge_transcripts
+
+def test_long_audio_is_cut_at_pauses_with_overlap():
+    """Three 20s phrases separated by 1s pauses should be cut inside the pauses."""
+    phrase = Sine(440).to_audio_segment(duration=20000).set_frame_rate(16000)
+    pause = AudioSegment.silent(duration=1000, frame_rate=16000)
+    audio = phrase + pause + phrase + pause + phrase
+
+    chunks = split_audio(audio, chunk_ms=30000, overlap_ms=1000)
+    assert len(chunks) == 3
+    # first cut lands in the middle of the first pause (20.5s), later chunks start 1s early
+    assert len(chunks[0]) == 20500
+    assert len(chunks[1]) == 21000 + 1000
+    assert sum(len(chunk) for chunk in chunks) == len(audio) + 2 * 1000
+
+def test_overlapping_words_are_stitched_once():
+    texts = [
+        "I have had this rash on my arm for",
+        "on my arm for about two weeks and",
+        "two weeks and it itches at night.",
+    ]
+    assert merge_transcripts(texts) == "I have had this rash on my arm for about two weeks and it itches at night."
+    assert merge_transcripts(["Hello doctor.", "I feel sick."]) == "Hello doctor. I feel sick."
+
+def test_chunks_are_transcribed_concurrently_and_in_order(tmp_path, monkeypatch):
+    uploads = [("voice_0.mp3", b"0"), ("voice_1.mp3", b"1"), ("voice_2.mp3", b"2")]
+    replies = {b"0": "my skin is red and", b"1": "red and itchy since", b"2": "since Monday"}
+    # Requests in flight at once, not wall-clock time, so a slow machine cannot fail the test
+    lock = threading.Lock()
+    in_flight = [0]
+    most_in_flight = [0]
+
+    def create(model, file, language):
+        with lock:
+            in_flight[0] += 1
+            most_in_flight[0] = max(most_in_flight[0], in_flight[0])
+        time.sleep(0.1)
+        with lock:
+            in_flight[0] -= 1
+        return SimpleNamespace(text=replies[file[1]])
+
+    client = SimpleNamespace(audio=SimpleNamespace(transcriptions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(voice_of_the_patient, "get_groq_client", lambda api_key=None: client)
+    monkeypatch.setattr(voice_of_the_patient, "prepare_uploads", lambda path, preprocess=True: uploads)
+    monkeypatch.setattr(voice_of_the_patient, "scheduler", GroqScheduler(default_rpm=600))
+    monkeypatch.setattr(voice_of_the_patient, "transcript_cache", DiskCache(str(tmp_path / "transcripts.sqlite3"), max_bytes=1000))
+    recording = tmp_path / "voice.mp3"
+    recording.write_bytes(b"recording")
+
+    text = voice_of_the_patient.transcribe_with_groq(stt_model="whisper-large-v3", audio_filepath=str(recording), GROQ_API_KEY="test")
+
+    assert text == "my skin is red and itchy since Monday"
+    assert most_in_flight[0] >= 2
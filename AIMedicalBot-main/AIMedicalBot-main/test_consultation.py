@@ -0,0 +1,284 @@
+# test_consultation.py
+import asyncio
+import hashlib
+import os
+import time
+import consultation
+import providers
+import speech_pipeline
+import telemetry
+from sessions import SessionStore
+from brain_of_the_doctor import PreparedImage, preprocess_image
+from providers import FakeTranscriber, FakeVision, FakeVoice
+from response_cache import DiskCache, MemoryCache, TieredCache
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def install_fakes(monkeypatch, tmp_path, vision_delay=0.0, stt_latency=0.0, vision_latency=0.0, text_latency=0.0):
+    """Run turns on the local fake providers, with fresh caches under tmp_path."""
+    transcriber = FakeTranscriber(transcript="I have red spots on my cheek.", latency=stt_latency)
+    vision = FakeVision(response="With what I see, I think you have acne. Keep the area clean.", latency=vision_latency, token_latency=vision_delay, text_latency=text_latency)
+    voice = FakeVoice(latency=0.0, bytes_per_char=1)
+    monkeypatch.setitem(providers.PROVIDERS["stt"], "test", lambda model=None: transcriber)
+    monkeypatch.setitem(providers.PROVIDERS["vision"], "test", lambda model=None: vision)
+    monkeypatch.setitem(providers.PROVIDERS["tts"], "test", lambda: voice)
+    monkeypatch.setattr(consultation, "STT_PROVIDER", "test")
+    monkeypatch.setattr(consultation, "VISION_PROVIDER", "test")
+    monkeypatch.setattr(consultation, "TTS_ENGINE", "test")
+    monkeypatch.setattr(consultation, "preprocess_image", lambda path: PreparedImage("aGk=", "image/jpeg", 2, 2, (1, 1), 0.0))
+    cache = TieredCache(MemoryCache(1024), DiskCache(str(tmp_path / "tts.sqlite3"), max_bytes=1024))
+    monkeypatch.setattr(speech_pipeline, "tts_cache", cache)
+    monkeypatch.setattr(consultation, "tts_cache", cache)
+    monkeypatch.setattr(consultation, "vision_cache", DiskCache(str(tmp_path / "vision.sqlite3"), max_bytes=1024))
+    return voice
+
+def record_vision_requests(monkeypatch):
+    """Remember (query, encoded_image, history) of every request to the fake vision backend."""
+    vision = providers.PROVIDERS["vision"]["test"]()
+    requests = []
+    stream = vision.stream
+    monkeypatch.setattr(vision, "stream", lambda query, encoded_image, mime_type=None, history=None: requests.append((query, encoded_image, history)) or stream(query, encoded_image, mime_type, history))
+    return requests
+
+def test_turn_streams_text_then_audio(tmp_path, monkeypatch):
+    install_fakes(monkeypatch, tmp_path)
+    output = tmp_path / "reply.mp3"
+
+    async def run():
+        return [outputs async for outputs in consultation.process_inputs("voice.mp3", "rash.jpg", output_filepath=str(output))]
+
+    updates = asyncio.run(run())
+    assert updates[0] == ("I have red spots on my cheek.", "", None)
+    assert len(updates) > 3  # the answer arrived word by word
+    assert updates[-1][1] == "With what I see, I think you have acne. Keep the area clean."
+    assert updates[-1][2] == str(output)
+    assert output.read_bytes() == b"With what I see, I think you have acne.Keep the area clean."
+
+def test_server_mode_returns_audio_bytes(tmp_path, monkeypatch):
+    """Without an output path the reply is handed back in memory, no file involved."""
+    install_fakes(monkeypatch, tmp_path)
+    monkeypatch.setattr(consultation, "AUDIO_OUTPUT", "bytes")
+
+    async def run():
+        return [outputs async for outputs in consultation.process_inputs("voice.mp3", None)]
+
+    updates = asyncio.run(run())
+    assert updates[-1] == ("I have red spots on my cheek.", "No image provided for me to analyze", b"No image provided for me to analyze")
+
+def test_stock_phrases_come_from_the_tts_cache(tmp_path, monkeypatch):
+    voice = install_fakes(monkeypatch, tmp_path)
+    synthesized = []
+    synthesize = voice.synthesize
+    monkeypatch.setattr(voice, "synthesize", lambda text: synthesized.append(text) or synthesize(text))
+
+    async def run():
+        return [outputs async for outputs in consultation.process_inputs("voice.mp3", None)]
+
+    first = asyncio.run(run())
+    second = asyncio.run(run())
+    assert first[-1][2] == second[-1][2]
+    assert synthesized == ["No image provided for me to analyze"]  # second reply was served from the cache
+    assert consultation.tts_cache.stats()["hits"] == 1
+
+def test_slow_vision_stage_times_out(tmp_path, monkeypatch):
+    install_fakes(monkeypatch, tmp_path, vision_delay=0.1)
+    monkeypatch.setattr(consultation, "VISION_TIMEOUT", 0.2)
+
+    async def run():
+        async for _ in consultation.process_inputs("voice.mp3", "rash.jpg", output_filepath=str(tmp_path / "reply.mp3")):
+            pass
+
+    try:
+        asyncio.run(run())
+    except asyncio.TimeoutError:
+        pass
+    else:
+        raise AssertionError("the vision stage should have timed out")
+
+def test_a_slow_consumer_holds_the_turn_back(monkeypatch):
+    """Updates repeat the answer so far, so the turn never gets more than one update ahead of its reader."""
+    produced = []
+
+    async def turn(*args):
+        for number in range(20):
+            produced.append(number)
+            yield number
+
+    monkeypatch.setattr(consultation, "_run_turn", turn)
+
+    async def run():
+        received = []
+        async for update in consultation.process_inputs("voice.mp3", None):
+            assert len(produced) <= update + 2  # the one being read, and at most one waiting
+            received.append(update)
+            await asyncio.sleep(0.001)
+        return received
+
+    assert asyncio.run(run()) == list(range(20))
+
+def test_stt_and_image_stages_overlap_and_are_timed(tmp_path, monkeypatch):
+    install_fakes(monkeypatch, tmp_path, stt_latency=0.3)
+    # Order of events, not wall-clock time, so a slow machine cannot fail the test
+    events = []
+    transcriber = providers.PROVIDERS["stt"]["test"]()
+    transcribe = transcriber.transcribe
+    async def logged_transcribe(audio_filepath):
+        events.append("stt started")
+        transcript = await transcribe(audio_filepath)
+        events.append("stt done")
+        return transcript
+    monkeypatch.setattr(transcriber, "transcribe", logged_transcribe)
+
+    def slow_preprocess(path):
+        events.append("image started")
+        time.sleep(0.3)
+        events.append("image done")
+        return PreparedImage("aGk=", "image/jpeg", 2, 2, (1, 1), 0.3)
+
+    monkeypatch.setattr(consultation, "preprocess_image", slow_preprocess)
+
+    async def run():
+        return [outputs async for outputs in consultation.process_inputs("voice.mp3", "rash.jpg", output_filepath=str(tmp_path / "reply.mp3"))]
+
+    asyncio.run(run())
+    timings = consultation.stage_timings[-1]
+    assert set(timings) == {"stt", "image", "cache", "vision", "tts", "total"}
+    assert timings["stt"] >= 0.3 and timings["image"] >= 0.3
+    # Each stage started before the other one finished
+    assert events.index("image started") < events.index("stt done")
+    assert events.index("stt started") < events.index("image done")
+
+def test_vision_cache_hit_skips_the_vision_stage(tmp_path, monkeypatch):
+    install_fakes(monkeypatch, tmp_path)
+
+    async def run():
+        return [outputs async for outputs in consultation.process_inputs("voice.mp3", "rash.jpg", output_filepath=str(tmp_path / "reply.mp3"))]
+
+    first = asyncio.run(run())
+    second = asyncio.run(run())
+    assert second[-1][1] == first[-1][1]
+    assert "vision" not in consultation.stage_timings[-1]
+    assert consultation.vision_cache.stats()["hits"] == 1
+
+def test_whole_turn_runs_on_the_configured_fake_backends(tmp_path, monkeypatch):
+    """STT_PROVIDER=fake etc. is all it takes to run a turn offline."""
+    install_fakes(monkeypatch, tmp_path)
+    monkeypatch.setattr(consultation, "STT_PROVIDER", "fake")
+    monkeypatch.setattr(consultation, "VISION_PROVIDER", "fake")
+    monkeypatch.setattr(consultation, "TTS_ENGINE", "fake")
+    for name in ["FAKE_STT_LATENCY", "FAKE_VISION_LATENCY", "FAKE_TOKEN_LATENCY", "FAKE_TTS_LATENCY"]:
+        monkeypatch.setattr(providers, name, 0.0)
+
+    async def run():
+        return [outputs async for outputs in consultation.process_inputs("voice.mp3", "rash.jpg")]
+
+    updates = asyncio.run(run())
+    assert updates[-1][0] == providers.FAKE_TRANSCRIPT
+    assert updates[-1][1] == providers.FAKE_RESPONSE
+    assert len(updates[-1][2]) == len(providers.FAKE_RESPONSE.replace(". ", ".")) * providers.FAKE_TTS_BYTES_PER_CHAR
+
+def test_unknown_provider_names_are_rejected():
+    try:
+        providers.get_provider("stt", "whisper.cpp")
+    except ValueError as error:
+        assert "fake, groq" in str(error)
+    else:
+        raise AssertionError("an unknown provider should be rejected")
+
+def test_turn_spans_share_one_trace(tmp_path, monkeypatch):
+    install_fakes(monkeypatch, tmp_path)
+    monkeypatch.setattr(consultation, "preprocess_image", preprocess_image)
+    telemetry.reset_metrics()
+
+    async def run():
+        return [outputs async for outputs in consultation.process_inputs("voice.mp3", os.path.join(HERE, "skin_rash.jpg"), output_filepath=str(tmp_path / "reply.mp3"))]
+
+    asyncio.run(run())
+    spans = {item["name"]: item for item in telemetry.recent_spans}
+    assert spans["image"]["parent_id"] == spans["consultation"]["span_id"]
+    assert spans["image"]["attributes"]["bytes_in"] > 0
+    assert telemetry.stage_seconds.count(stage="vision") == 1
+    assert 'medipulse_cache_lookups_total{cache="vision",result="miss"} 1' in telemetry.render_metrics()
+
+def test_follow_ups_reuse_the_session_image(tmp_path, monkeypatch):
+    """Only the first turn sends the image; follow-ups send the question and the earlier turns as text."""
+    install_fakes(monkeypatch, tmp_path)
+    monkeypatch.setattr(consultation, "sessions", SessionStore())
+    preprocessed = []
+    monkeypatch.setattr(consultation, "preprocess_image", lambda path: preprocessed.append(path) or PreparedImage("aGk=" * 1000, "image/jpeg", 3000, 3000, (1, 1), 0.0))
+    requests = record_vision_requests(monkeypatch)
+    photo = tmp_path / "rash.jpg"
+    photo.write_bytes(b"photo")
+    reupload = tmp_path / "rash_again.jpg"
+    reupload.write_bytes(b"photo")
+
+    async def run(image_filepath, session_id="alice"):
+        return [outputs async for outputs in consultation.process_inputs("voice.mp3", image_filepath, session_id=session_id)]
+
+    asyncio.run(run(str(photo)))
+    asyncio.run(run(str(reupload)))  # the same photo again, under a new temp name
+    last = asyncio.run(run(None))  # a follow-up without attaching the photo
+    assert last[-1][1] == "With what I see, I think you have acne. Keep the area clean."
+
+    assert preprocessed == [str(photo)]
+    assert [encoded_image for _, encoded_image, _ in requests] == ["aGk=" * 1000, None, None]
+    assert requests[1][0].startswith(consultation.follow_up_prompt)
+    assert [len(history) for _, _, history in requests] == [0, 2, 4]
+    assert requests[2][2][0] == {"role": "user", "content": "I have red spots on my cheek."}
+    alice = consultation.sessions.get("alice")
+    assert alice.image_digest == hashlib.sha256(b"photo").hexdigest()
+    assert alice.image_turn == alice.turns[0]
+    assert not any(isinstance(value, PreparedImage) for value in vars(alice).values())  # no encoded photo kept
+
+    # Another session starts from scratch, and its first turn can come from the vision cache
+    asyncio.run(run(str(photo), session_id="bob"))
+    assert preprocessed == [str(photo), str(photo)]
+    assert consultation.vision_cache.stats()["hits"] == 1
+    assert len(consultation.sessions.get("bob").history()) == 2
+
+def test_speculative_pre_analysis_overlaps_stt(tmp_path, monkeypatch):
+    """The image is analyzed while STT runs; the transcript only adds a quick text-only refinement."""
+    install_fakes(monkeypatch, tmp_path, stt_latency=0.3, vision_latency=0.3, text_latency=0.05)
+    monkeypatch.setattr(consultation, "SPECULATIVE_VISION", True)
+    requests = record_vision_requests(monkeypatch)
+    telemetry.reset_metrics()
+    # Order of events, not wall-clock time, so a slow machine cannot fail the test
+    events = []
+    transcriber = providers.PROVIDERS["stt"]["test"]()
+    transcribe = transcriber.transcribe
+    async def timed_transcribe(audio_filepath):
+        transcript = await transcribe(audio_filepath)
+        events.append("stt done")
+        return transcript
+    monkeypatch.setattr(transcriber, "transcribe", timed_transcribe)
+    vision = providers.PROVIDERS["vision"]["test"]()
+    stream = vision.stream
+    monkeypatch.setattr(vision, "stream", lambda query, encoded_image, mime_type=None, history=None: events.append(
+        "image request" if encoded_image else "text request") or stream(query, encoded_image, mime_type, history))
+
+    async def run():
+        return [outputs async for outputs in consultation.process_inputs("voice.mp3", "rash.jpg", output_filepath=str(tmp_path / "reply.mp3"))]
+
+    updates = asyncio.run(run())
+    assert updates[-1][1] == "With what I see, I think you have acne. Keep the area clean."
+    assert requests[0] == (consultation.system_prompt, "aGk=", None)
+    query, encoded_image, history = requests[1]
+    assert query == consultation.follow_up_prompt + "I have red spots on my cheek."
+    assert encoded_image is None
+    assert history[-1]["content"] == updates[-1][1]  # the pre-analysis
+    assert events == ["image request", "stt done", "text request"]
+    assert telemetry.speculative_vision.value(outcome="refined") == 1
+
+def test_unused_pre_analysis_is_counted_as_discarded(tmp_path, monkeypatch):
+    install_fakes(monkeypatch, tmp_path, stt_latency=0.1)
+    monkeypatch.setattr(consultation, "SPECULATIVE_VISION", True)
+    telemetry.reset_metrics()
+
+    async def run():
+        return [outputs async for outputs in consultation.process_inputs("voice.mp3", "rash.jpg", output_filepath=str(tmp_path / "reply.mp3"))]
+
+    first = asyncio.run(run())
+    second = asyncio.run(run())  # answered from the vision cache, the pre-analysis is not needed
+    assert second[-1][1] == first[-1][1]
+    assert telemetry.speculative_vision.value(outcome="refined") == 1
+    assert telemetry.speculative_vision.value(outcome="discarded") == 1
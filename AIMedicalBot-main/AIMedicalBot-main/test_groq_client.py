@@ -0,0 +1,78 @@
+# test_groq_client.py
+import asyncio
+import threading
+from groq_client import get_groq_client, get_async_groq_client, pool_stats, close_clients
+
+def test_client_is_reused():
+    """The same API key should always get the same pooled client."""
+    close_clients()
+    first = get_groq_client(api_key="test-key")
+    second = get_groq_client(api_key="test-key")
+    assert first is second
+
+    stats = pool_stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+    assert stats["clients"] == 1
+    close_clients()
+
+def test_concurrent_lookups_share_one_client():
+    """Threads asking at the same time should still only build one client."""
+    close_clients()
+    seen = []
+
+    def worker():
+        seen.append(get_groq_client(api_key="test-key"))
+
+    threads = [threading.Thread(target=worker) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len({id(client) for client in seen}) == 1
+    assert pool_stats()["misses"] == 1
+    assert pool_stats()["hits"] == 15
+    close_clients()
+
+def test_async_client_is_pooled_separately():
+    close_clients()
+
+    async def run():
+        sync_client = get_groq_client(api_key="test-key")
+        async_client = get_async_groq_client(api_key="test-key")
+        assert async_client is not sync_client
+        assert get_async_groq_client(api_key="test-key") is async_client
+        assert pool_stats()["clients"] == 2
+
+    asyncio.run(run())
+    close_clients()
+
+def test_async_clients_do_not_outlive_their_event_loop():
+    """A second asyncio.run must not reuse connections opened on the first, closed loop."""
+    close_clients()
+
+    async def borrow():
+        return get_async_groq_client(api_key="test-key")
+
+    first = asyncio.run(borrow())
+    second = asyncio.run(borrow())
+
+    assert second is not first
+    assert first.is_closed() and second.is_closed()  # closed when their loop ended
+    assert pool_stats()["clients"] == 0
+    close_clients()
+
+def test_close_clients_closes_async_clients():
+    close_clients()
+    loop = asyncio.new_event_loop()
+
+    async def borrow():
+        return get_async_groq_client(api_key="test-key")
+
+    try:
+        client = loop.run_until_complete(borrow())
+        close_clients()
+        assert client.is_closed()
+    finally:
+        loop.close()
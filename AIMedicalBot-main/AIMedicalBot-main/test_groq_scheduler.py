@@ -0,0 +1,66 @@
+# test_groq_scheduler.py
+import asyncio
+import time
+from groq_scheduler import GroqScheduler, TokenBucket, BACKGROUND, INTERACTIVE, priority
+
+class RateLimited(Exception):
+    status_code = 429
+    response = None
+
+class BadRequest(Exception):
+    status_code = 400
+
+def test_bucket_admits_a_burst_then_paces_requests():
+    now = [0.0]
+    bucket = TokenBucket(rate=2, burst=2, clock=lambda: now[0])
+    assert bucket.take() == 0 and bucket.take() == 0
+    assert bucket.take() == 0.5  # the third request has to wait for a refill
+    now[0] += 0.5
+    assert bucket.take() == 0
+    bucket.pause(3)
+    assert bucket.take() == 3.0
+
+def test_interactive_turns_go_ahead_of_background_jobs():
+    scheduler = GroqScheduler(default_rpm=60, burst=1)  # one request per second after the first
+    order = []
+
+    async def request(name, level):
+        await scheduler.acall("vision", lambda: asyncio.sleep(0, result=order.append(name)), level)
+
+    async def run():
+        await request("first", INTERACTIVE)  # uses up the burst
+        background = asyncio.ensure_future(request("batch", BACKGROUND))
+        await asyncio.sleep(0.05)
+        with priority(INTERACTIVE):
+            interactive = asyncio.ensure_future(request("patient", None))
+            await asyncio.sleep(0.05)
+        scheduler.bucket("vision").tokens = 1  # a token frees up while both are waiting
+        await asyncio.wait_for(asyncio.gather(interactive, background), 3)
+
+    asyncio.run(run())
+    assert order == ["first", "patient", "batch"]
+
+def test_rate_limits_are_retried_with_backoff_but_client_errors_are_not():
+    scheduler = GroqScheduler(default_rpm=6000, backoff_base=0.01, backoff_cap=0.05)
+    attempts = []
+
+    def flaky():
+        attempts.append(time.perf_counter())
+        if len(attempts) < 3:
+            raise RateLimited("slow down")
+        return "ok"
+
+    assert scheduler.call("test-model", flaky) == "ok"
+    assert len(attempts) == 3
+
+    def broken():
+        attempts.append(time.perf_counter())
+        raise BadRequest("bad image")
+
+    try:
+        scheduler.call("test-model", broken)
+    except BadRequest:
+        pass
+    else:
+        raise AssertionError("a 400 should not be retried")
+    assert len(attempts) == 4
@@ -0,0 +1,38 @@
+# test_image_preprocessing.py
+import base64
+import io
+import os
+from PIL import Image
+from brain_of_the_doctor import preprocess_image, encode_image
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def test_large_photo_is_downscaled_and_stripped(tmp_path):
+    """A big phone photo with EXIF should come back smaller and without metadata."""
+    photo = Image.new("RGB", (4000, 3000), color=(200, 120, 110))
+    exif = Image.Exif()
+    exif[0x010F] = "PhoneMaker"  # camera make
+    photo_path = tmp_path / "photo.jpg"
+    photo.save(photo_path, format="JPEG", quality=95, exif=exif)
+
+    image = preprocess_image(str(photo_path), max_edge=1024)
+    assert image.mime_type == "image/jpeg"
+    assert max(image.size) == 1024
+    assert image.bytes_after < image.bytes_before
+
+    decoded = Image.open(io.BytesIO(base64.b64decode(image.encoded)))
+    assert max(decoded.size) == 1024
+    assert "exif" not in decoded.info
+
+def test_webp_keeps_its_real_format():
+    """Small, clean inputs in a supported format should not be relabelled as JPEG."""
+    image = preprocess_image(os.path.join(HERE, "dandruff-optimized.webp"), max_edge=2048)
+    assert image.mime_type == "image/webp"
+    assert image.bytes_after == image.bytes_before
+    assert image.data_url.startswith("data:image/webp;base64,")
+
+def test_unreadable_file_is_passed_through(tmp_path):
+    """Files Pillow cannot read are still encoded, as before."""
+    placeholder = tmp_path / "placeholder.jpg"
+    placeholder.write_bytes(b"X" * 1000)
+    assert base64.b64decode(encode_image(str(placeholder))) == b"X" * 1000
@@ -0,0 +1,41 @@
+# test_ingest.py
+import io
+import base64
+import hashlib
+import pytest
+from PIL import Image
+import brain_of_the_doctor
+from ingest import UploadTooLarge, encode_base64, read_chunks
+
+class TrickleFile(io.BytesIO):
+    """Hands out at most 7 bytes per read, like a pipe or a slow network upload."""
+    def read(self, size=-1):
+        return super().read(min(size, 7) if size > 0 else 7)
+
+def test_chunked_base64_matches_one_shot_encoding():
+    """Chunk boundaries, short reads and odd lengths must not change the payload or its hash."""
+    payload = bytes(range(256)) * 41 + b"tail"
+    for source, chunk_size in ((io.BytesIO(payload), 100), (io.BytesIO(payload), 3), (TrickleFile(payload), 64)):
+        upload = encode_base64(source, max_bytes=len(payload), chunk_size=chunk_size)
+        assert upload.encoded == base64.b64encode(payload).decode("ascii")
+        assert upload.sha256 == hashlib.sha256(payload).hexdigest()
+        assert upload.size == len(payload)
+
+def test_oversize_image_is_rejected_before_reading(tmp_path, monkeypatch):
+    photo = tmp_path / "photo.jpg"
+    Image.new("RGB", (64, 64)).save(photo, format="JPEG")
+
+    def no_open(*args, **kwargs):
+        raise AssertionError("an oversize upload should not be opened")
+    monkeypatch.setattr(Image, "open", no_open)
+
+    with pytest.raises(UploadTooLarge):
+        brain_of_the_doctor.preprocess_image(str(photo), max_bytes=100)
+
+def test_stream_that_outgrows_the_limit_stops_early():
+    """A source that keeps producing data past the limit is cut off, not read to the end."""
+    source = io.BytesIO(b"x" * 10000)
+    with pytest.raises(UploadTooLarge):
+        for _ in read_chunks(source, max_bytes=1000, chunk_size=256):
+            pass
+    assert source.tell() == 1024
@@ -0,0 +1,44 @@
+# test_output_manager.py
+import os
+import time
+from output_manager import OutputManager
+
+def test_each_request_gets_its_own_file(tmp_path):
+    manager = OutputManager(root=str(tmp_path))
+    first = manager.write(b"first reply", session_id="alice")
+    second = manager.write(b"second reply", session_id="bob")
+    third = manager.write(b"third reply", session_id="alice")
+
+    assert len({first, second, third}) == 3
+    assert open(first, "rb").read() == b"first reply"
+    assert open(second, "rb").read() == b"second reply"
+
+def test_expired_files_are_swept(tmp_path):
+    manager = OutputManager(root=str(tmp_path), ttl=60)
+    old = manager.write(b"old", session_id="alice")
+    fresh = manager.write(b"fresh", session_id="bob")
+    os.utime(old, (time.time() - 120, time.time() - 120))
+
+    assert manager.cleanup() == 1
+    assert not os.path.exists(old)
+    assert not os.path.exists(os.path.dirname(old))  # empty session directory is removed too
+    assert os.path.exists(fresh)
+
+def test_quota_removes_oldest_files_first(tmp_path):
+    manager = OutputManager(root=str(tmp_path), quota_bytes=25)
+    paths = []
+    for i in range(3):
+        paths.append(manager.write(b"x" * 10, session_id="alice"))
+        os.utime(paths[-1], (time.time() - 100 + i, time.time() - 100 + i))
+    manager.enforce_quota()
+
+    assert not os.path.exists(paths[0])
+    assert os.path.exists(paths[1]) and os.path.exists(paths[2])
+
+def test_session_id_cannot_escape_the_root(tmp_path):
+    root = tmp_path / "outputs"
+    manager = OutputManager(root=str(root))
+    for session_id in ("../..", "../escaped", "a/b", "/etc", "x\n"):
+        path = manager.write(b"reply", session_id=session_id)
+        assert os.path.dirname(path) == str(root / "anonymous")
+    assert sorted(os.listdir(tmp_path)) == ["outputs"]
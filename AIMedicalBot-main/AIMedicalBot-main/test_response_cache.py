@@ -0,0 +1,84 @@
+# test_response_cache.py
+import time
+from types import SimpleNamespace
+import brain_of_the_doctor
+import voice_of_the_patient
+from response_cache import DiskCache, MemoryCache, TieredCache, make_key, normalize_text
+
+def test_lru_eviction_respects_byte_cap(tmp_path):
+    """Least recently used entries should go first once the cap is exceeded."""
+    cache = DiskCache(str(tmp_path / "cache.sqlite3"), max_bytes=10)
+    cache.set("a", b"aaaa")
+    cache.set("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"  # "b" is now the least recently used
+    cache.set("c", b"cccc")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa"
+    assert cache.get("c") == b"cccc"
+    assert cache.stats()["evictions"] == 1
+    cache.close()
+
+def test_entries_expire_after_ttl(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache.sqlite3"), max_bytes=1000, ttl=0.05)
+    cache.set("key", "value")
+    assert cache.get("key") == b"value"
+    time.sleep(0.1)
+    assert cache.get("key") is None
+    cache.close()
+
+def test_memory_tier_evicts_and_disk_tier_refills(tmp_path):
+    """Entries pushed out of memory are still found on disk and promoted back."""
+    cache = TieredCache(MemoryCache(max_bytes=8), DiskCache(str(tmp_path / "tts.sqlite3"), max_bytes=100))
+    cache.set("hello", b"1234")
+    cache.set("bye", b"5678")
+    cache.set("thanks", b"9999")  # memory only has room for two
+    assert cache.memory.get("hello") is None
+
+    assert cache.get("hello") == b"1234"  # served by the disk tier
+    assert cache.memory.get("hello") == b"1234"
+    assert cache.stats()["disk"]["hits"] == 1
+    cache.disk.close()
+
+def test_similar_queries_share_a_key():
+    assert normalize_text("Is there something wrong with my face?") == normalize_text("  is there something WRONG with my face ")
+    assert make_key("img", "model", "q") != make_key("img", "other-model", "q")
+
+def test_repeat_analysis_skips_groq(tmp_path, monkeypatch):
+    """A cache hit should return the stored answer without building a client."""
+    cache = DiskCache(str(tmp_path / "vision.sqlite3"), max_bytes=1000)
+    monkeypatch.setattr(brain_of_the_doctor, "vision_cache", cache)
+    cache.set(brain_of_the_doctor.vision_cache_key("What is this?", "test-model", "aGVsbG8="), "Looks like acne.")
+
+    def no_client(*args, **kwargs):
+        raise AssertionError("Groq should not be called on a cache hit")
+    monkeypatch.setattr(brain_of_the_doctor, "get_groq_client", no_client)
+
+    response = brain_of_the_doctor.analyze_image_with_query(query="what is this", model="test-model", encoded_image="aGVsbG8=")
+    assert response == "Looks like acne."
+    assert cache.stats()["hits"] == 1
+    cache.close()
+
+def test_repeat_audio_is_transcribed_once(tmp_path, monkeypatch):
+    """Identical audio under another name should hit the transcript cache before any upload."""
+    cache = DiskCache(str(tmp_path / "transcripts.sqlite3"), max_bytes=1000)
+    monkeypatch.setattr(voice_of_the_patient, "transcript_cache", cache)
+    uploads = []
+    monkeypatch.setattr(voice_of_the_patient, "prepare_uploads", lambda path, preprocess=True: uploads.append(path) or [("voice.mp3", b"audio")])
+    client = SimpleNamespace(audio=SimpleNamespace(transcriptions=SimpleNamespace(
+        create=lambda model, file, language: SimpleNamespace(text=f"rash on my arm ({language})"))))
+    monkeypatch.setattr(voice_of_the_patient, "get_groq_client", lambda api_key=None: client)
+    first = tmp_path / "first.mp3"
+    retry = tmp_path / "retry.mp3"
+    first.write_bytes(b"same recording")
+    retry.write_bytes(b"same recording")
+
+    assert voice_of_the_patient.transcribe_with_groq("whisper-large-v3", str(first), "test") == "rash on my arm (en)"
+    assert voice_of_the_patient.transcribe_with_groq("whisper-large-v3", str(retry), "test") == "rash on my arm (en)"
+    assert uploads == [str(first)]
+
+    # Another language is another transcript
+    assert voice_of_the_patient.transcribe_with_groq("whisper-large-v3", str(retry), "test", language="fr") == "rash on my arm (fr)"
+    assert uploads == [str(first), str(retry)]
+    assert cache.stats()["hits"] == 1
+    cache.close()
@@ -0,0 +1,43 @@
+# test_sessions.py
+from sessions import Session, SessionStore, estimate_tokens
+
+def test_history_keeps_the_newest_turns_within_the_token_budget():
+    session = Session("alice", token_budget=3 * (estimate_tokens("q" * 40) + estimate_tokens("a" * 40)))
+    for turn in range(5):
+        session.record(f"{turn}" + "q" * 39, f"{turn}" + "a" * 39)
+
+    history = session.history()
+    assert [message["role"] for message in history] == ["user", "assistant"] * 3
+    assert [message["content"][0] for message in history[::2]] == ["2", "3", "4"]  # oldest first
+    assert len(session.turns) == 3  # turns that can never be sent again are not kept either
+
+def test_the_turn_that_sent_the_image_is_never_trimmed():
+    session = Session("alice", token_budget=3 * (estimate_tokens("q" * 40) + estimate_tokens("a" * 40)))
+    session.record("0" + "q" * 39, "0" + "a" * 39, image_digest="digest")
+    for turn in range(1, 5):
+        session.record(f"{turn}" + "q" * 39, f"{turn}" + "a" * 39)
+
+    history = session.history()
+    assert [message["content"][0] for message in history[::2]] == ["0", "3", "4"]  # what the image showed comes first
+    assert session.image_turn in session.turns
+
+    # A new image takes over the pin and the old one ages out like any other turn
+    session.record("5" + "q" * 39, "5" + "a" * 39, image_digest="other")
+    session.record("6" + "q" * 39, "6" + "a" * 39)
+    assert [message["content"][0] for message in session.history()[::2]] == ["4", "5", "6"]
+
+def test_idle_and_surplus_sessions_are_dropped(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("sessions.time.monotonic", lambda: now[0])
+    store = SessionStore(ttl=60, max_sessions=2)
+
+    alice = store.get("alice")
+    alice.record("Is it acne?", "Yes, mild acne.")
+    assert store.get("alice") is alice
+    store.get("bob")
+    store.get("carol")
+    assert len(store) == 2  # alice was the least recently used
+
+    now[0] = 120.0
+    assert store.get("bob").turns == []
+    assert len(store) == 1  # carol expired as well
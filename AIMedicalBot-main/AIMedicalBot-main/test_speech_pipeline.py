@@ -0,0 +1,37 @@
+# test_speech_pipeline.py
+import threading
+import time
+from speech_pipeline import SentenceTTSPipeline, split_sentences
+
+def test_sentences_are_split_while_streaming():
+    chunks = ["With what I see, I think ", "you have acne. Ok. Wash your ", "face twice a day"]
+    assert list(split_sentences(chunks)) == [
+        "With what I see, I think you have acne.",
+        "Ok. Wash your face twice a day",  # too short on its own, so merged forward
+    ]
+
+def test_segments_are_synthesized_in_parallel_and_joined_in_order():
+    """Slow sentences should overlap, and the audio must still come out in reading order."""
+    # Syntheses in flight at once, not wall-clock time, so a slow machine cannot fail the test
+    lock = threading.Lock()
+    in_flight = [0]
+    most_in_flight = [0]
+
+    def fake_synthesize(sentence):
+        with lock:
+            in_flight[0] += 1
+            most_in_flight[0] = max(most_in_flight[0], in_flight[0])
+        time.sleep(0.1)
+        with lock:
+            in_flight[0] -= 1
+        return sentence.encode() + b"|"
+
+    pipeline = SentenceTTSPipeline(fake_synthesize, max_workers=4)
+    chunks = ["First sentence is here. ", "Second sentence is here. ", "Third sentence is here. ", "Fourth sentence is here."]
+
+    streamed = list(pipeline.feed(chunks))
+    audio = pipeline.join()
+
+    assert streamed == chunks  # text passes through untouched
+    assert audio == b"First sentence is here.|Second sentence is here.|Third sentence is here.|Fourth sentence is here.|"
+    assert most_in_flight[0] >= 2
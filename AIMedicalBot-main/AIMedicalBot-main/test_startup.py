@@ -0,0 +1,30 @@
+# test_startup.py
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Seconds allowed for importing the whole pipeline (no provider SDKs, no network). It takes well
+# under half a second; the default leaves room for slow CI machines, tighten it locally to check.
+STARTUP_BUDGET_SECONDS = float(os.environ.get("STARTUP_BUDGET_SECONDS", "2"))
+HEAVY_MODULES = ["gtts", "elevenlabs", "groq", "speech_recognition", "pydub", "PIL", "httpx", "dotenv", "numpy"]
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import consultation, brain_of_the_doctor, voice_of_the_patient, voice_of_the_doctor
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+def test_imports_are_fast_and_side_effect_free(tmp_path):
+    """Importing the voice and vision modules should not call providers, write files or load SDKs."""
+    env = dict(os.environ, PYTHONPATH=HERE)
+    result = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=tmp_path, env=env, capture_output=True, text=True, check=True)
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    print(f"Startup took {report['seconds']:.3f}s (budget {STARTUP_BUDGET_SECONDS}s)")
+
+    assert report["loaded"] == []
+    assert list(tmp_path.iterdir()) == []  # nothing like gtts_testing.mp3 was written
+    assert report["seconds"] < STARTUP_BUDGET_SECONDS
@@ -0,0 +1,32 @@
+# test_streaming_capture.py
+import threading
+import wave
+from io import BytesIO
+from voice_of_the_patient import RollingTranscriber
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+
+def test_windows_are_sent_while_recording_and_stitched():
+    """Each full window goes out as soon as it fills; finish() only sends the short tail."""
+    sent = []
+    replies = iter(["my arm has", "has a red rash", "since Monday"])
+    lock = threading.Lock()
+
+    def fake_transcribe(wav_bytes):
+        with wave.open(BytesIO(wav_bytes)) as wav_file:
+            assert wav_file.getframerate() == SAMPLE_RATE
+            with lock:
+                sent.append(wav_file.getnframes() / SAMPLE_RATE)
+                return next(replies)
+
+    rolling = RollingTranscriber(fake_transcribe, SAMPLE_RATE, SAMPLE_WIDTH, window_seconds=2, overlap_ms=500, max_workers=1)
+    one_second = b"\x00\x01" * SAMPLE_RATE
+    for _ in range(4):
+        rolling.add(one_second)
+    assert len(rolling._futures) == 2  # two full windows already in flight during recording
+
+    rolling.add(one_second[: SAMPLE_RATE])  # half a second more, then the patient stops
+    assert rolling.finish() == "my arm has a red rash since Monday"
+    # first window has no overlap, the later ones reach 0.5s back
+    assert sent == [2.0, 2.5, 1.0]
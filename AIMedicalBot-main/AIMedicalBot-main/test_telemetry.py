@@ -0,0 +1,39 @@
+# test_telemetry.py
+from types import SimpleNamespace
+import groq_client
+import telemetry
+from telemetry import span, render_metrics
+
+def test_spans_nest_and_feed_the_metrics():
+    telemetry.reset_metrics()
+    with span("consultation") as root:
+        with span("vision", model="llama") as vision:
+            vision.set(bytes_in=2048, bytes_out=120, cache="miss")
+    try:
+        with span("tts"):
+            raise RuntimeError("quota exceeded")
+    except RuntimeError:
+        pass
+
+    finished = {item["name"]: item for item in telemetry.recent_spans}
+    assert finished["vision"]["trace_id"] == root.trace_id
+    assert finished["vision"]["parent_id"] == root.span_id
+    assert finished["tts"]["trace_id"] != root.trace_id
+    assert finished["tts"]["error"] == "RuntimeError: quota exceeded"
+
+    text = render_metrics()
+    assert 'medipulse_span_seconds_count{span="vision"} 1' in text
+    assert 'medipulse_span_seconds_bucket{span="vision",le="+Inf"} 1' in text
+    assert 'medipulse_payload_bytes_total{span="vision",direction="in"} 2048' in text
+    assert 'medipulse_cache_lookups_total{cache="vision",result="miss"} 1' in text
+    assert 'medipulse_span_errors_total{span="tts"} 1' in text
+
+def test_rate_limited_and_failed_responses_count_as_retries():
+    telemetry.reset_metrics()
+    with span("stt") as current:
+        for status in (200, 429, 503):
+            groq_client._count_retry(SimpleNamespace(status_code=status))
+    assert telemetry.retries.value(provider="groq", status=429) == 1
+    assert telemetry.retries.value(provider="groq", status=503) == 1
+    assert telemetry.retries.value(provider="groq", status=200) == 0
+    assert current.attributes["retries"] == 2
@@ -0,0 +1,116 @@
+# test_transcoder.py
+import io
+import sys
+import json
+import struct
+import numpy as np
+import pytest
+from pydub import AudioSegment
+from pydub.generators import Sine
+import transcoder
+from telemetry import transcodes
+from transcoder import FfmpegPool, TranscodeError, decode, encode, read_wav
+
+def wav_bytes(segment):
+    buffer = io.BytesIO()
+    segment.export(buffer, format="wav")
+    return buffer.getvalue()
+
+def test_wav_is_decoded_downmixed_and_resampled_in_process(monkeypatch):
+    """WAV never needs ffmpeg: the pool must not be touched."""
+    monkeypatch.setattr(transcoder.pool, "run", lambda *args: pytest.fail("WAV should not go through ffmpeg"))
+    tone = Sine(440).to_audio_segment(duration=1000).set_frame_rate(44100).set_channels(2)
+
+    audio = decode(wav_bytes(tone), 16000, channels=1)
+
+    assert audio.channels == 1 and audio.sample_rate == 16000
+    assert audio.samples.dtype == np.int16
+    assert abs(audio.seconds - 1.0) < 0.001
+    # Same loudness as pydub's own conversion, within a fraction of a dB
+    reference = tone.set_channels(1).set_frame_rate(16000)
+    wav = AudioSegment.from_file(io.BytesIO(encode(audio, "wav")), format="wav")
+    assert wav.frame_rate == 16000 and wav.channels == 1
+    assert abs(wav.dBFS - reference.dBFS) < 0.5
+
+def test_streamed_wav_without_sizes_is_read():
+    """ffmpeg writing WAV to a pipe cannot go back and fill in the sizes."""
+    samples = np.arange(-500, 500, dtype=np.int16)
+    fmt = struct.pack("<HHIIHH", 1, 1, 8000, 16000, 2, 16)
+    data = b"RIFF" + b"\xff" * 4 + b"WAVE" + b"fmt " + struct.pack("<I", len(fmt)) + fmt + b"data" + b"\xff" * 4 + samples.tobytes()
+
+    audio = read_wav(data)
+
+    assert audio.sample_rate == 8000
+    assert np.array_equal(audio.samples[:, 0], samples)
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path):
+    """An executable that reverses stdin onto stdout, or fails when its arguments ask it to. It saves its arguments next to itself."""
+    script = tmp_path / "ffmpeg"
+    script.write_text(
+        f"#!{sys.executable}\n"
+        "import json, sys\n"
+        "open(__file__ + '.args', 'w').write(json.dumps(sys.argv[1:]))\n"
+        "data = sys.stdin.buffer.read()\n"
+        "if 'fail' in sys.argv:\n"
+        "    sys.stderr.write('Invalid data found when processing input')\n"
+        "    sys.exit(1)\n"
+        "sys.stdout.buffer.write(data[::-1])\n"
+    )
+    script.chmod(0o755)
+    return str(script)
+
+def test_pool_hands_out_pre_started_processes(fake_ffmpeg):
+    pool = FfmpegPool(binary=fake_ffmpeg, spares=2, timeout=10)
+    args = ("-f", "mp3", "pipe:1")
+    warm_before = transcodes.value(start="warm")
+    try:
+        pool.warm(args)
+        assert len(pool._idle[args]) == 2
+
+        assert pool.run(args, b"abc") == b"cba"
+        assert pool.run(args, b"xyz") == b"zyx"
+
+        assert transcodes.value(start="warm") == warm_before + 2
+        # Each process used was replaced in the background
+        pool._refill.submit(lambda: None).result()
+        assert len(pool._idle[args]) == 2
+    finally:
+        pool.close()
+    assert pool._idle == {}
+
+def test_failed_transcode_raises_with_ffmpeg_message(fake_ffmpeg):
+    pool = FfmpegPool(binary=fake_ffmpeg, spares=0, timeout=10)
+    with pytest.raises(TranscodeError, match="Invalid data"):
+        pool.run(("fail",), b"garbage")
+
+def test_mp4_audio_is_decoded_from_its_path(fake_ffmpeg, tmp_path, monkeypatch):
+    """A pipe cannot seek to an index at the end of the file, so ffmpeg gets the path instead."""
+    monkeypatch.setattr(transcoder, "pool", FfmpegPool(binary=fake_ffmpeg, spares=2, timeout=10))
+    note = tmp_path / "voice note.m4a"
+    note.write_bytes(b"\x00\x00\x00\x18ftypM4A \x00\x00\x00\x00" + b"\x00" * 64)
+
+    decode(note.read_bytes(), 16000, path=str(note))
+
+    args = json.loads(open(fake_ffmpeg + ".args").read())
+    assert args[args.index("-i") + 1] == f"file:{note}"
+    assert transcoder.pool._idle == {}  # one-off arguments, no spares kept for them
+    with pytest.raises(TranscodeError):
+        decode(note.read_bytes(), 16000)
+
+def test_startup_warms_the_conversions_preprocessing_uses(fake_ffmpeg, tmp_path, monkeypatch):
+    import voice_of_the_patient
+    monkeypatch.setattr(transcoder, "pool", FfmpegPool(binary=fake_ffmpeg, spares=1, timeout=10))
+    tone = Sine(440).to_audio_segment(duration=500).set_frame_rate(44100)
+    recording = tmp_path / "patient.wav"
+    recording.write_bytes(wav_bytes(tone))
+    cold_before = transcodes.value(start="cold")
+    try:
+        voice_of_the_patient.warm_transcoder()
+        assert len(transcoder.pool._idle) == 3  # decode uploads, encode uploads, encode recordings
+
+        voice_of_the_patient.preprocess_audio(str(recording), output_format="mp3")
+
+        assert transcodes.value(start="cold") == cold_before  # the first consultation found a process ready
+    finally:
+        transcoder.pool.close()
@@ -0,0 +1,83 @@
+# test_vision_router.py
+import asyncio
+import telemetry
+import vision_router
+from vision_router import VisionRouter
+
+def fake_models(first_token_delay, fail=()):
+    """Fake streams per model: wait, then answer with the model name; remember what got cancelled."""
+    started, closed = [], []
+
+    async def stream(query, model, encoded_image, mime_type, history=None):
+        started.append(model)
+        try:
+            if model in fail:
+                raise RuntimeError("503 from provider")
+            await asyncio.sleep(first_token_delay[model])
+            yield f"answer from {model}."
+            yield " Keep the area clean."
+        finally:
+            closed.append(model)
+
+    return stream, started, closed
+
+def run(router):
+    async def collect():
+        return "".join([token async for token in router.stream("query", "aGk=", "image/jpeg")])
+    return asyncio.run(collect())
+
+def test_slow_primary_is_hedged_and_cancelled(monkeypatch):
+    monkeypatch.setattr(vision_router, "latencies", {})
+    telemetry.reset_metrics()
+    stream, started, closed = fake_models({"small": 1.0, "large": 0.05})
+    router = VisionRouter("small", "large", stream=stream, default_deadline=0.1)
+
+    assert run(router) == "answer from large. Keep the area clean."
+    assert started == ["small", "large"]
+    assert "small" in closed  # the losing request was cancelled, not left running
+    assert telemetry.vision_routes.value(path="hedge", model="large") == 1
+
+def test_fast_primary_is_not_hedged(monkeypatch):
+    monkeypatch.setattr(vision_router, "latencies", {})
+    stream, started, _ = fake_models({"small": 0.01, "large": 0.01})
+    router = VisionRouter("small", "large", stream=stream, default_deadline=0.5)
+
+    assert run(router) == "answer from small. Keep the area clean."
+    assert started == ["small"]
+
+def test_failed_primary_falls_back_at_once(monkeypatch):
+    monkeypatch.setattr(vision_router, "latencies", {})
+    telemetry.reset_metrics()
+    stream, started, _ = fake_models({"small": 0.01, "large": 0.01}, fail=("small",))
+    router = VisionRouter("small", "large", stream=stream, default_deadline=5)
+
+    assert run(router) == "answer from large. Keep the area clean."
+    assert telemetry.vision_routes.value(path="fallback", model="large") == 1
+
+def test_deadline_follows_the_primary_percentile(monkeypatch):
+    monkeypatch.setattr(vision_router, "latencies", {})
+    router = VisionRouter("small", "large", percentile=90, min_samples=10, default_deadline=3)
+    assert router.deadline() == 3
+    for seconds in range(1, 11):
+        vision_router.tracker("small").add(seconds / 10)
+    assert router.deadline() == 0.9
+
+def test_blocking_wrapper_can_be_called_repeatedly_and_from_a_running_loop(monkeypatch):
+    monkeypatch.setattr(vision_router, "latencies", {})
+    loops = []
+
+    async def stream(query, model, encoded_image, mime_type=None, use_cache=True, history=None):
+        loops.append(asyncio.get_running_loop())
+        yield f"answer from {model}"
+    monkeypatch.setattr(vision_router, "astream_image_with_query", stream)
+
+    def ask():
+        return vision_router.analyze_image_with_hedging("query", "small", "aGk=", use_cache=False, fallback="large")
+
+    async def from_a_handler():
+        return ask()
+
+    assert ask() == "answer from small"
+    assert ask() == "answer from small"
+    assert asyncio.run(from_a_handler()) == "answer from small"
+    assert len(set(loops)) == 1  # one long-lived loop, not one per call
@@ -0,0 +1,32 @@
+# test_vision_streaming.py
+from types import SimpleNamespace
+import brain_of_the_doctor
+from response_cache import DiskCache
+
+class FakeCompletions:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.calls = []
+
+    def create(self, messages, model, stream=False):
+        self.calls.append({"messages": messages, "model": model, "stream": stream})
+        return iter([SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=t))]) for t in self.tokens])
+
+def fake_client(completions):
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+def test_tokens_are_yielded_as_they_arrive(tmp_path, monkeypatch):
+    completions = FakeCompletions(["With what I see, ", "I think you have ", "acne."])
+    monkeypatch.setattr(brain_of_the_doctor, "get_groq_client", lambda *a, **k: fake_client(completions))
+    monkeypatch.setattr(brain_of_the_doctor, "vision_cache", DiskCache(str(tmp_path / "vision.sqlite3"), max_bytes=1000))
+
+    stream = brain_of_the_doctor.stream_image_with_query(query="rash?", model="test-model", encoded_image="/9j/abc")
+    assert next(stream) == "With what I see, "
+    assert "".join(stream) == "I think you have acne."
+    assert completions.calls[0]["stream"] is True
+    assert completions.calls[0]["messages"][0]["content"][1]["image_url"]["url"].startswith("data:image/jpeg;base64,")
+
+    # The full answer is cached, so asking again does not open a new stream
+    again = list(brain_of_the_doctor.stream_image_with_query(query="rash?", model="test-model", encoded_image="/9j/abc"))
+    assert again == ["With what I see, I think you have acne."]
+    assert len(completions.calls) == 1
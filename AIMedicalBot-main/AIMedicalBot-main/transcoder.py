@@ -0,0 +1,312 @@
+# Audio transcoding without a fresh ffmpeg per conversion.
+# Simple PCM work (reading WAV, downmixing, resampling, writing WAV) happens in-process on NumPy
+# arrays. Compressed formats go through ffmpeg processes that are started ahead of time and wait
+# on their stdin: a conversion writes to a pipe and reads the result from another, with no temp
+# files, and does not pay for fork/exec and ffmpeg startup. ffmpeg handles one stream per process,
+# so every process used is replaced by a new spare in the background.
+# MP4-family uploads are the exception: ffmpeg has to seek in them, so it reads them from their path.
+# NumPy is imported on first use so importing this module stays cheap.
+import os
+import io
+import time
+import wave
+import atexit
+import struct
+import logging
+import threading
+import subprocess
+from collections import deque
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+
+from telemetry import span, transcodes
+
+FFMPEG_BINARY=os.environ.get("FFMPEG_BINARY", "ffmpeg")
+# Pre-started processes kept ready per kind of conversion (input and output settings)
+TRANSCODE_SPARES=int(os.environ.get("TRANSCODE_SPARES", "2"))
+TRANSCODE_TIMEOUT=float(os.environ.get("TRANSCODE_TIMEOUT", "30"))
+
+WAVE_FORMAT_PCM=1
+WAVE_FORMAT_IEEE_FLOAT=3
+WAVE_FORMAT_EXTENSIBLE=0xFFFE
+
+
+class TranscodeError(RuntimeError):
+    pass
+
+
+@dataclass
+class PcmAudio:
+    samples: object  # int16 NumPy array shaped (frames, channels)
+    sample_rate: int
+
+    @property
+    def channels(self):
+        return self.samples.shape[1]
+
+    @property
+    def seconds(self):
+        return len(self.samples)/self.sample_rate
+
+    @property
+    def raw(self):
+        """Interleaved 16-bit little-endian PCM, what ffmpeg calls s16le."""
+        return self.samples.astype("<i2", copy=False).tobytes()
+
+
+#Step1: PCM in NumPy
+def pcm_from_bytes(data, sample_rate, channels):
+    """Wrap interleaved s16le PCM (bytes, bytearray or memoryview) without copying it."""
+    import numpy as np
+
+    usable=len(data)//(2*channels)*(2*channels)
+    return PcmAudio(np.frombuffer(data, dtype="<i2", count=usable//2).reshape(-1, channels), sample_rate)
+
+
+def read_wav(data):
+    """
+    Decode a WAV file held in memory into PcmAudio.
+    8/16/24/32-bit integer and 32-bit float samples are read; the sizes ffmpeg leaves unset
+    when it writes WAV to a pipe are tolerated.
+    """
+    import numpy as np
+
+    if data[:4]!=b"RIFF" or data[8:12]!=b"WAVE":
+        raise TranscodeError("not a WAV file")
+    view=memoryview(data)
+    position=12
+    fmt=None
+    while position+8<=len(data):
+        chunk_id=bytes(view[position:position+4])
+        size=int.from_bytes(view[position+4:position+8], "little")
+        body=position+8
+        if chunk_id==b"fmt ":
+            tag, channels, sample_rate, _, block_align, bits=struct.unpack_from("<HHIIHH", data, body)
+            if tag==WAVE_FORMAT_EXTENSIBLE and size>=26:
+                tag=struct.unpack_from("<H", data, body+24)[0]
+            fmt=(tag, channels, sample_rate, block_align, bits)
+        elif chunk_id==b"data":
+            if fmt is None:
+                raise TranscodeError("WAV data before its format")
+            end=len(data) if size in (0, 0xFFFFFFFF) else min(len(data), body+size)
+            tag, channels, sample_rate, block_align, bits=fmt
+            frames=view[body:body+(end-body)//block_align*block_align]
+            if tag==WAVE_FORMAT_IEEE_FLOAT and bits==32:
+                samples=(np.clip(np.frombuffer(frames, dtype="<f4"), -1.0, 1.0)*32767).astype(np.int16)
+            elif tag!=WAVE_FORMAT_PCM:
+                raise TranscodeError(f"unsupported WAV encoding {tag}")
+            elif bits==16:
+                samples=np.frombuffer(frames, dtype="<i2")
+            elif bits==8:
+                samples=((np.frombuffer(frames, dtype=np.uint8).astype(np.int16)-128)<<8)
+            elif bits==24:
+                triplets=np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3)
+                # The two high bytes of a 24-bit sample are its 16-bit value
+                samples=triplets[:, 1].astype(np.int16)|(triplets[:, 2].astype(np.int16)<<8)
+            elif bits==32:
+                samples=(np.frombuffer(frames, dtype="<i4")>>16).astype(np.int16)
+            else:
+                raise TranscodeError(f"unsupported WAV sample size {bits} bits")
+            return PcmAudio(samples.reshape(-1, channels), sample_rate)
+        position=body+size+(size&1)
+    raise TranscodeError("WAV file without audio data")
+
+
+def to_wav(audio):
+    buffer=io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(audio.channels)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(audio.sample_rate)
+        wav_file.writeframes(audio.raw)
+    return buffer.getvalue()
+
+
+def to_mono(audio):
+    if audio.channels==1:
+        return audio
+    import numpy as np
+
+    # Column by column: reducing along the short interleaved axis is several times slower
+    mixed=np.zeros(len(audio.samples), dtype=np.int32)
+    for channel in audio.samples.T:
+        mixed+=channel
+    mixed//=audio.channels
+    return PcmAudio(mixed.astype(np.int16).reshape(-1, 1), audio.sample_rate)
+
+
+def resample(audio, sample_rate):
+    """Linear interpolation, after a short moving average when downsampling to keep aliasing down."""
+    if audio.sample_rate==sample_rate or not len(audio.samples):
+        return audio
+    import numpy as np
+
+    ratio=audio.sample_rate/sample_rate
+    frames=len(audio.samples)
+    positions=np.arange(int(round(frames/ratio)))*ratio
+    left=np.minimum(positions.astype(np.int64), frames-1)
+    right=np.minimum(left+1, frames-1)
+    weight=(positions-left).astype(np.float32)
+    width=int(ratio)
+    channels=[]
+    for channel in audio.samples.T:
+        channel=channel.astype(np.float32)
+        if width>1:
+            # Average of each frame and the width-1 before it
+            averaged=channel.copy()
+            for shift in range(1, width):
+                averaged[shift:]+=channel[:-shift]
+            channel=averaged/width
+        channels.append(channel[left]*(1-weight)+channel[right]*weight)
+    samples=np.clip(np.rint(np.stack(channels, axis=1)), -32768, 32767).astype(np.int16)
+    return PcmAudio(samples, sample_rate)
+
+
+#Step2: pre-started ffmpeg processes
+class FfmpegPool:
+    def __init__(self, binary=FFMPEG_BINARY, spares=TRANSCODE_SPARES, timeout=TRANSCODE_TIMEOUT):
+        """
+        Args:
+        binary (str): ffmpeg executable.
+        spares (int): Processes kept started and waiting for each kind of conversion.
+        timeout (float): Seconds one conversion may take.
+        """
+        self.binary=binary
+        self.spares=spares
+        self.timeout=timeout
+        self._idle={}
+        self._lock=threading.Lock()
+        self._refill=None
+
+    def _spawn(self, args):
+        return subprocess.Popen([self.binary, "-hide_banner", "-loglevel", "error", *args],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def _take(self, args):
+        with self._lock:
+            idle=self._idle.setdefault(args, deque())
+            while idle:
+                process=idle.popleft()
+                if process.poll() is None:
+                    return process, "warm"
+        return self._spawn(args), "cold"
+
+    def _top_up(self, args):
+        try:
+            while True:
+                with self._lock:
+                    if len(self._idle.setdefault(args, deque()))>=self.spares:
+                        return
+                process=self._spawn(args)
+                with self._lock:
+                    self._idle[args].append(process)
+        except OSError as e:
+            logging.warning(f"Could not start a spare ffmpeg: {e}")
+
+    def warm(self, args):
+        """Start the spares for a kind of conversion now rather than on its first use."""
+        self._top_up(tuple(args))
+
+    def run(self, args, data=b"", pre_started=True):
+        """
+        Feed data to an ffmpeg started with args (reading pipe:0, writing pipe:1) and return its output.
+        Pass pre_started=False for one-off args (a file path as input) that are not worth keeping spares for.
+        """
+        args=tuple(args)
+        process, start=self._take(args) if pre_started else (self._spawn(args), "cold")
+        if self.spares and pre_started:
+            if self._refill is None:
+                self._refill=ThreadPoolExecutor(max_workers=1, thread_name_prefix="ffmpeg-spares")
+            self._refill.submit(self._top_up, args)
+        transcodes.inc(start=start)
+        with span("transcode", start=start, bytes_in=len(data)) as current:
+            try:
+                output, errors=process.communicate(data, timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.communicate()
+                raise TranscodeError(f"ffmpeg took longer than {self.timeout}s")
+            if process.returncode:
+                raise TranscodeError(errors.decode("utf-8", "replace").strip() or f"ffmpeg exited with {process.returncode}")
+            current.set(bytes_out=len(output))
+            return output
+
+    def close(self):
+        """Stop the waiting spares."""
+        with self._lock:
+            idle=[process for processes in self._idle.values() for process in processes]
+            self._idle.clear()
+        for process in idle:
+            process.kill()
+            process.wait()
+        if self._refill is not None:
+            self._refill.shutdown(wait=False)
+
+
+pool=FfmpegPool()
+atexit.register(pool.close)
+
+
+def encode_args(sample_rate, channels, output_format, bitrate=None):
+    bitrate_args=("-b:a", bitrate) if bitrate else ()
+    return ("-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels), "-i", "pipe:0", *bitrate_args, "-f", output_format, "pipe:1")
+
+
+def decode_args(sample_rate, channels, path=None):
+    # A path is read as a plain file (file: stops names like "http:..." being taken for protocols)
+    source=("-nostdin", "-i", f"file:{os.path.abspath(path)}") if path else ("-i", "pipe:0")
+    return (*source, "-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels), "pipe:1")
+
+
+def needs_seeking(data):
+    """
+    MP4-family files (M4A, MOV, 3GP: phone voice notes) often keep their index after the audio,
+    which ffmpeg can only reach by seeking, and a pipe cannot seek.
+    """
+    return data[4:8]==b"ftyp"
+
+
+#Step3: the transcoding service
+def encode(audio, output_format, bitrate=None):
+    """
+    Encode PcmAudio as output_format (wav in-process, anything else through ffmpeg) and return the bytes.
+
+    Args:
+    audio (PcmAudio): Samples to encode.
+    output_format (str): ffmpeg muxer name, e.g. mp3, flac, ogg or wav.
+    bitrate (str): Bitrate for lossy formats, e.g. "32k".
+    """
+    if output_format=="wav":
+        return to_wav(audio)
+    return pool.run(encode_args(audio.sample_rate, audio.channels, output_format, bitrate), audio.raw)
+
+
+def decode(data, sample_rate, channels=1, path=None):
+    """
+    Decode an audio file to PcmAudio at sample_rate with channels.
+    WAV is handled in-process and other formats are piped through a pre-started ffmpeg, except
+    MP4-family files, which ffmpeg reads from path (it has to seek in them).
+
+    Args:
+    data (bytes): The file's content.
+    sample_rate (int): Target sample rate in Hz.
+    channels (int): Target channel count.
+    path (str): Where data came from on disk; required for MP4-family files.
+    """
+    start=time.perf_counter()
+    if data[:4]==b"RIFF":
+        try:
+            audio=read_wav(data)
+            if channels==1:
+                audio=to_mono(audio)
+            if audio.channels==channels:
+                audio=resample(audio, sample_rate)
+                logging.debug(f"Decoded WAV in-process in {time.perf_counter()-start:.3f}s")
+                return audio
+        except TranscodeError as e:
+            logging.debug(f"Decoding WAV with ffmpeg instead: {e}")
+    if needs_seeking(data):
+        if path is None:
+            raise TranscodeError("MP4-family audio can only be decoded from a file path")
+        return pcm_from_bytes(pool.run(decode_args(sample_rate, channels, path), pre_started=False), sample_rate, channels)
+    return pcm_from_bytes(pool.run(decode_args(sample_rate, channels), data), sample_rate, channels)
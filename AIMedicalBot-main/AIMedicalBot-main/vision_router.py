@@ -0,0 +1,208 @@
+# Latency-aware routing for the vision call.
+# The primary model gets the request first. If it has not produced its first token by the time
+# most of its recent requests had (a percentile of its own history), the same request is also sent
+# to an alternate model. Whichever answers first is streamed back, the other is cancelled, and
+# the winning path is counted. A primary that fails outright falls back to the alternate at once.
+import os
+import math
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from collections import deque
+
+from brain_of_the_doctor import astream_image_with_query, vision_cache, vision_cache_key
+from telemetry import start_span, vision_routes
+
+VISION_FALLBACK_MODEL=os.environ.get("VISION_FALLBACK_MODEL", "llama-3.2-90b-vision-preview")
+# Hedge once the primary is slower than this percentile of its recent time to first token
+HEDGE_PERCENTILE=float(os.environ.get("HEDGE_PERCENTILE", "95"))
+# Until this many samples exist, hedge after HEDGE_DEFAULT_SECONDS
+HEDGE_MIN_SAMPLES=int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_DEFAULT_SECONDS=float(os.environ.get("HEDGE_DEFAULT_SECONDS", "3"))
+HEDGE_WINDOW=int(os.environ.get("HEDGE_WINDOW", "200"))
+
+
+class LatencyTracker:
+    def __init__(self, window=HEDGE_WINDOW):
+        self.samples=deque(maxlen=window)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, percent):
+        if not self.samples:
+            return None
+        # Nearest rank
+        ordered=sorted(self.samples)
+        rank=math.ceil(len(ordered)*percent/100)
+        return ordered[min(len(ordered), max(rank, 1))-1]
+
+
+# Time to first token per model, shared by every router in the process
+latencies={}
+
+
+def tracker(model):
+    return latencies.setdefault(model, LatencyTracker())
+
+
+def _latency_key(model, with_image):
+    # Text-only follow-ups answer much sooner than image requests, so they get a history of their own
+    return model if with_image else f"{model} (text)"
+
+
+class VisionRouter:
+    def __init__(self, model, fallback=VISION_FALLBACK_MODEL, stream=None, percentile=HEDGE_PERCENTILE,
+                 min_samples=HEDGE_MIN_SAMPLES, default_deadline=HEDGE_DEFAULT_SECONDS):
+        """
+        Args:
+        model (str): Primary vision model. Answers are cached under this name, whichever model won.
+        fallback (str): Alternate model for hedged and fallback requests; empty to disable hedging.
+        stream (callable): stream(query, model, encoded_image, mime_type, history) -> async iterator of tokens.
+        """
+        self.model=model
+        self.fallback=fallback
+        self._stream=stream or (lambda query, model, encoded_image, mime_type, history: astream_image_with_query(
+            query=query, model=model, encoded_image=encoded_image, mime_type=mime_type, use_cache=False, history=history))
+        self.percentile=percentile
+        self.min_samples=min_samples
+        self.default_deadline=default_deadline
+
+    def deadline(self, with_image=True):
+        """Seconds to give the primary before hedging."""
+        samples=tracker(_latency_key(self.model, with_image))
+        if len(samples.samples)<self.min_samples:
+            return self.default_deadline
+        return samples.percentile(self.percentile)
+
+    async def stream(self, query, encoded_image, mime_type=None, history=None):
+        """Yield the answer of whichever model produces a first token first."""
+        loop=asyncio.get_running_loop()
+        current=start_span("vision_route", model=self.model, fallback=self.fallback)
+        attempts={}
+        with_image=bool(encoded_image)
+
+        def launch(path, model):
+            tokens=self._stream(query, model, encoded_image, mime_type, history).__aiter__()
+            attempts[asyncio.ensure_future(tokens.__anext__())]=(path, model, tokens, loop.time())
+
+        launch("primary", self.model)
+        hedged=not self.fallback
+        winner=None
+        first_error=None
+        try:
+            deadline=self.deadline(with_image)
+            while winner is None and attempts:
+                done, _=await asyncio.wait(attempts, timeout=None if hedged else deadline, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # The primary is slower than usual, race it against the alternate
+                    hedged=True
+                    launch("hedge", self.fallback)
+                    continue
+                for task in done:
+                    path, model, tokens, launched=attempts.pop(task)
+                    error=task.exception()
+                    if error is None:
+                        winner=(task.result(), path, model, tokens)
+                        tracker(_latency_key(model, with_image)).add(loop.time()-launched)
+                        break
+                    if isinstance(error, StopAsyncIteration):
+                        error=RuntimeError(f"{model} returned an empty answer")
+                    first_error=first_error or error
+                    logging.warning(f"Vision request to {model} ({path}) failed: {error}")
+                    if not hedged:
+                        hedged=True
+                        launch("fallback", self.fallback)
+            if winner is None:
+                raise first_error
+        except BaseException as e:
+            current.end(e)
+            raise
+        finally:
+            # Cancel whatever lost the race and give its connection back
+            await _cancel(attempts, self.model, with_image, loop.time())
+
+        token, path, model, tokens=winner
+        vision_routes.inc(path=path, model=model)
+        current.set(path=path, winner=model, hedged=hedged and bool(self.fallback))
+        current.end()
+        logging.info(f"Vision answer from {model} ({path})")
+        yield token
+        try:
+            async for token in tokens:
+                yield token
+        finally:
+            await _close(tokens)
+
+    async def analyze(self, query, encoded_image, mime_type=None, use_cache=True):
+        """Return the whole answer, checking and filling the vision cache under the primary model."""
+        cache_key=vision_cache_key(query, self.model, encoded_image)
+        if use_cache:
+            cached=await asyncio.to_thread(vision_cache.get, cache_key)
+            if cached is not None:
+                return cached.decode('utf-8')
+        response="".join([token async for token in self.stream(query, encoded_image, mime_type)])
+        if use_cache and response:
+            await asyncio.to_thread(vision_cache.set, cache_key, response)
+        return response
+
+
+async def _close(tokens):
+    if hasattr(tokens, "aclose"):
+        await tokens.aclose()
+
+
+async def _cancel(attempts, primary, with_image, now):
+    for task, (path, model, tokens, launched) in attempts.items():
+        task.cancel()
+        try:
+            await task
+        except BaseException:
+            pass
+        await _close(tokens)
+        if model==primary:
+            # The primary took at least this long, which keeps its percentile honest
+            tracker(_latency_key(model, with_image)).add(now-launched)
+    attempts.clear()
+
+
+# Blocking callers share one loop on a background thread. asyncio.run per call would start a
+# fresh loop every time (pooled async clients are per loop) and cannot run inside a running loop.
+_background_loop=None
+_background_lock=threading.Lock()
+
+
+def _run_in_background(coroutine):
+    """Run coroutine on the shared background loop and block until it finishes."""
+    global _background_loop
+    with _background_lock:
+        if _background_loop is None:
+            _background_loop=asyncio.new_event_loop()
+            threading.Thread(target=_background_loop.run_forever, name="vision-router", daemon=True).start()
+    result=concurrent.futures.Future()
+
+    def start():
+        task=asyncio.ensure_future(coroutine)
+
+        def finish(task):
+            if task.cancelled():
+                result.cancel()
+            elif task.exception() is not None:
+                result.set_exception(task.exception())
+            else:
+                result.set_result(task.result())
+        task.add_done_callback(finish)
+
+    # call_soon_threadsafe carries the caller's context over, so the scheduler priority
+    # and the current span apply to the request
+    _background_loop.call_soon_threadsafe(start)
+    return result.result()
+
+
+def analyze_image_with_hedging(query, model, encoded_image, mime_type=None, use_cache=True, fallback=VISION_FALLBACK_MODEL):
+    """
+    Blocking counterpart of analyze_image_with_query that hedges slow requests to fallback.
+    Safe to call repeatedly and from any thread; async code should await VisionRouter.analyze instead.
+    """
+    return _run_in_background(VisionRouter(model, fallback).analyze(query, encoded_image, mime_type, use_cache))
@@ -1,12 +1,12 @@
-# if you dont use pipenv uncomment the following:
-from dotenv import load_dotenv
-load_dotenv()
-
 #Step1a: Setup Text to Speech–TTS–model with gTTS
+# Providers (gtts, elevenlabs) are imported on first use so importing this module stays cheap
 import os
-from gtts import gTTS
+from settings import get_env
+from telemetry import span
 
 def text_to_speech_with_gtts_old(input_text, output_filepath):
+    from gtts import gTTS
+
     language="en"
 
     audioobj= gTTS(
@@ -18,16 +18,14 @@ def text_to_speech_with_gtts_old(input_text, output_filepath):
 
 
 input_text="Hi this is Ai with Hassan!"
-text_to_speech_with_gtts_old(input_text=input_text, output_filepath="gtts_testing.mp3")
+#text_to_speech_with_gtts_old(input_text=input_text, output_filepath="gtts_testing.mp3")
 
 #Step1b: Setup Text to Speech–TTS–model with ElevenLabs
-import elevenlabs
-from elevenlabs.client import ElevenLabs
-
-ELEVENLABS_API_KEY=os.environ.get("ELEVENLABS_API_KEY")
-
 def text_to_speech_with_elevenlabs_old(input_text, output_filepath):
-    client=ElevenLabs(api_key=ELEVENLABS_API_KEY)
+    import elevenlabs
+    from elevenlabs.client import ElevenLabs
+
+    client=ElevenLabs(api_key=get_env("ELEVENLABS_API_KEY"))
     audio=client.generate(
         text= input_text,
         voice= "Aria",
@@ -38,61 +36,103 @@ def text_to_speech_with_elevenlabs_old(input_text, output_filepath):
 
 #text_to_speech_with_elevenlabs_old(input_text, output_filepath="elevenlabs_testing.mp3") 
 
+#Step1c: Synthesize straight to MP3 bytes (no file, no playback)
+from io import BytesIO
+
+ELEVENLABS_VOICE=os.environ.get("ELEVENLABS_VOICE", "Aria")
+ELEVENLABS_MODEL=os.environ.get("ELEVENLABS_MODEL", "eleven_turbo_v2")
+ELEVENLABS_OUTPUT_FORMAT=os.environ.get("ELEVENLABS_OUTPUT_FORMAT", "mp3_22050_32")
+
+def synthesize_with_gtts(input_text, language="en"):
+    from gtts import gTTS
+
+    with span("tts", engine="gtts", bytes_in=len(input_text.encode('utf-8'))) as current:
+        audioobj = gTTS(
+            text=input_text,
+            lang=language,
+            slow=False
+        )
+        buffer = BytesIO()
+        audioobj.write_to_fp(buffer)
+        current.set(bytes_out=buffer.tell())
+        return buffer.getvalue()
+
+def stream_with_elevenlabs(input_text, voice=ELEVENLABS_VOICE, model=ELEVENLABS_MODEL, output_format=ELEVENLABS_OUTPUT_FORMAT):
+    """Yield MP3 chunks from ElevenLabs as they are generated."""
+    from elevenlabs.client import ElevenLabs
+
+    client=ElevenLabs(api_key=get_env("ELEVENLABS_API_KEY"))
+    audio=client.generate(
+        text= input_text,
+        voice= voice,
+        output_format= output_format,
+        model= model
+    )
+    if isinstance(audio, bytes):
+        yield audio
+    else:
+        yield from audio
+
+def synthesize_with_elevenlabs(input_text, voice=ELEVENLABS_VOICE, model=ELEVENLABS_MODEL, output_format=ELEVENLABS_OUTPUT_FORMAT):
+    with span("tts", engine="elevenlabs", model=model, bytes_in=len(input_text.encode('utf-8'))) as current:
+        audio=b"".join(stream_with_elevenlabs(input_text, voice=voice, model=model, output_format=output_format))
+        current.set(bytes_out=len(audio))
+        return audio
+
 #Step2: Use Model for Text output to Voice
 
+import shutil
 import subprocess
 import platform
 
-def text_to_speech_with_gtts(input_text, output_filepath):
-    language = "en"
-
-    audioobj = gTTS(
-        text=input_text,
-        lang=language,
-        slow=False
-    )
-    audioobj.save(output_filepath)
+def play_audio(filepath):
+    """
+    Start playing an audio file on this machine without waiting for it to finish.
+    Returns the player process, or None when no player is available.
+    """
     os_name = platform.system()
     try:
         if os_name == "Darwin":  # macOS
-            subprocess.run(['afplay', output_filepath])
+            command = ['afplay', filepath]
         elif os_name == "Windows":  # Windows
             # Simply use the Windows default player with 'start'
-            subprocess.run(['start', output_filepath], shell=True)
+            return subprocess.Popen(['start', '', filepath], shell=True)
         elif os_name == "Linux":  # Linux
-            subprocess.run(['aplay', output_filepath])
+            # aplay only understands WAV, so prefer a player that can decode MP3
+            if shutil.which('mpg123'):
+                command = ['mpg123', '-q', filepath]
+            elif shutil.which('ffplay'):
+                command = ['ffplay', '-nodisp', '-autoexit', '-loglevel', 'quiet', filepath]
+            else:
+                command = ['aplay', filepath]
         else:
             raise OSError("Unsupported operating system")
+        return subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     except Exception as e:
         print(f"An error occurred while trying to play the audio: {e}")
+        return None
 
 
-input_text="Hi this is Ai with Hassan, autoplay testing!"
-# # text_to_speech_with_gtts(input_text=input_text, output_filepath="gtts_testing_autoplay.mp3")
+def _save(audio, output_filepath):
+    with open(output_filepath, "wb") as audio_file:
+        audio_file.write(audio)
 
 
-def text_to_speech_with_elevenlabs(input_text, output_filepath):
+def text_to_speech_with_gtts(input_text, output_filepath, play=False):
+    _save(synthesize_with_gtts(input_text), output_filepath)
+    if play:
+        play_audio(output_filepath)
+    return output_filepath
 
-    # elevenlabs.set_api_key(ELEVENLABS_API_KEY)
-    client=ElevenLabs(api_key=ELEVENLABS_API_KEY)
-    audio=client.generate(
-        text= input_text,
-        voice= "Aria",
-        output_format= "mp3_22050_32",
-        model= "eleven_turbo_v2"
-    )
-    elevenlabs.save(audio, output_filepath)
-    os_name = platform.system()
-    try:
-        if os_name == "Darwin":  # macOS
-            subprocess.run(['afplay', output_filepath])
-        elif os_name == "Windows":  # Windows
-            subprocess.run(['powershell', '-c', f'(New-Object Media.SoundPlayer "{output_filepath}").PlaySync();'])
-        elif os_name == "Linux":  # Linux
-            subprocess.run(['aplay', output_filepath])  # Alternative: use 'mpg123' or 'ffplay'
-        else:
-            raise OSError("Unsupported operating system")
-    except Exception as e:
-        print(f"An error occurred while trying to play the audio: {e}")
 
-# text_to_speech_with_elevenlabs(input_text, output_filepath="elevenlabs_testing_autoplay.mp3")
\ No newline at end of file
+input_text="Hi this is Ai with Hassan, autoplay testing!"
+# # text_to_speech_with_gtts(input_text=input_text, output_filepath="gtts_testing_autoplay.mp3", play=True)
+
+
+def text_to_speech_with_elevenlabs(input_text, output_filepath, play=False):
+    _save(synthesize_with_elevenlabs(input_text), output_filepath)
+    if play:
+        play_audio(output_filepath)
+    return output_filepath
+
+# text_to_speech_with_elevenlabs(input_text, output_filepath="elevenlabs_testing_autoplay.mp3", play=True)
@@ -1,25 +1,27 @@
-# if you dont use pipenv uncomment the following:
-from dotenv import load_dotenv
-load_dotenv()
-
 #Step1: Setup Audio recorder (ffmpeg & portaudio)
 # ffmpeg, portaudio, pyaudio
+# speech_recognition and pydub are imported on first use so importing this module stays cheap
+import os
 import logging
-import speech_recognition as sr
-from pydub import AudioSegment
 from io import BytesIO
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Recordings are saved at a fixed rate and bitrate, so the MP3 encoder can be started ahead of time
+RECORD_SAMPLE_RATE=int(os.environ.get("RECORD_SAMPLE_RATE", "44100"))
+RECORD_BITRATE=os.environ.get("RECORD_BITRATE", "128k")
 
 def record_audio(file_path, timeout=20, phrase_time_limit=None):
     """
-    Simplified function to record audio from the microphone and save it as an MP3 file.
+    Simplified function to record audio from the microphone and save it as an MP3 file
+    (or as WAV, without any transcode, when file_path ends in .wav).
 
     Args:
     file_path (str): Path to save the recorded audio file.
     timeout (int): Maximum time to wait for a phrase to start (in seconds).
     phrase_time_lfimit (int): Maximum time for the phrase to be recorded (in seconds).
     """
+    import speech_recognition as sr
+    from transcoder import encode, read_wav
+
     recognizer = sr.Recognizer()
     
     try:
@@ -32,10 +34,16 @@ def record_audio(file_path, timeout=20, phrase_time_limit=None):
             audio_data = recognizer.listen(source, timeout=timeout, phrase_time_limit=phrase_time_limit)
             logging.info("Recording complete.")
             
-            # Convert the recorded audio to an MP3 file
-            wav_data = audio_data.get_wav_data()
-            audio_segment = AudioSegment.from_wav(BytesIO(wav_data))
-            audio_segment.export(file_path, format="mp3", bitrate="128k")
+            wav_data = audio_data.get_wav_data(convert_rate=RECORD_SAMPLE_RATE, convert_width=2)
+            if file_path.lower().endswith(".wav"):
+                # Whisper takes WAV directly, no need to spawn ffmpeg for an MP3
+                with open(file_path, "wb") as wav_file:
+                    wav_file.write(wav_data)
+            else:
+                # Convert the recorded audio to an MP3 file, through a pre-started ffmpeg and in-memory pipes
+                mp3_data = encode(read_wav(wav_data), "mp3", bitrate=RECORD_BITRATE)
+                with open(file_path, "wb") as mp3_file:
+                    mp3_file.write(mp3_data)
             
             logging.info(f"Audio saved to {file_path}")
 
@@ -45,21 +53,418 @@ def record_audio(file_path, timeout=20, phrase_time_limit=None):
 audio_filepath="patient_voice_test_for_patient.mp3"
 #record_audio(file_path=audio_filepath)
 
-#Step2: Setup Speech to text–STT–model for transcription
+#Step1b: Clean up the recording before upload
+# Energy-based VAD trims the silence around the speech, then the audio is downmixed
+# to mono, resampled to 16 kHz and re-encoded compactly. Whisper works at 16 kHz mono anyway.
+# Long recordings are also split at pauses into overlapping chunks that are transcribed in parallel.
+# Decoding and re-encoding go through transcoder: WAV in-process, other formats via pre-started ffmpeg.
 import os
-from groq import Groq
+import re
+import time
+from dataclasses import dataclass
+from ingest import MAX_AUDIO_BYTES, UploadTooLarge, check_size, read_upload
+import transcoder
 
-GROQ_API_KEY=os.environ.get("GROQ_API_KEY")
-stt_model="whisper-large-v3"
+STT_SAMPLE_RATE=int(os.environ.get("STT_SAMPLE_RATE", "16000"))
+STT_UPLOAD_FORMAT=os.environ.get("STT_UPLOAD_FORMAT", "mp3")
+STT_UPLOAD_BITRATE=os.environ.get("STT_UPLOAD_BITRATE", "32k")
+# Anything this many dB below the clip's average loudness counts as silence
+VAD_THRESHOLD_DB=float(os.environ.get("VAD_THRESHOLD_DB", "-16"))
+VAD_MIN_SILENCE_MS=int(os.environ.get("VAD_MIN_SILENCE_MS", "300"))
+# Speech padding kept on both sides so the first and last words are not clipped
+VAD_PADDING_MS=int(os.environ.get("VAD_PADDING_MS", "200"))
 
-def transcribe_with_groq(stt_model, audio_filepath, GROQ_API_KEY):
-    client=Groq(api_key=GROQ_API_KEY)
-    
-    audio_file=open(audio_filepath, "rb")
-    transcription=client.audio.transcriptions.create(
-        model=stt_model,
-        file=audio_file,
-        language="en"
+# Recordings longer than this are chunked
+LONG_AUDIO_SECONDS=float(os.environ.get("LONG_AUDIO_SECONDS", "60"))
+CHUNK_SECONDS=float(os.environ.get("CHUNK_SECONDS", "30"))
+CHUNK_OVERLAP_MS=int(os.environ.get("CHUNK_OVERLAP_MS", "1000"))
+STT_WORKERS=int(os.environ.get("STT_WORKERS", "4"))
+# Largest file the STT API takes in one request (Groq: 25 MB); only matters when a recording cannot be chunked
+MAX_STT_UPLOAD_BYTES=int(os.environ.get("MAX_STT_UPLOAD_BYTES", str(25*1024*1024)))
+# Longest run of words looked at when removing duplicates where chunks overlap
+STITCH_MAX_WORDS=int(os.environ.get("STITCH_MAX_WORDS", "8"))
+
+@dataclass
+class PreparedAudio:
+    uploads: list
+    seconds_before: float
+    seconds_after: float
+    bytes_before: int
+    bytes_after: int
+    processing_seconds: float
+
+    @property
+    def filename(self):
+        return self.uploads[0][0]
+
+    @property
+    def data(self):
+        return self.uploads[0][1]
+
+    @property
+    def seconds_removed(self):
+        return self.seconds_before-self.seconds_after
+
+    @property
+    def bytes_removed(self):
+        return self.bytes_before-self.bytes_after
+
+
+def trim_silence(audio, threshold_db=VAD_THRESHOLD_DB, min_silence_ms=VAD_MIN_SILENCE_MS, padding_ms=VAD_PADDING_MS):
+    """Cut leading and trailing silence from a pydub AudioSegment."""
+    from pydub.silence import detect_nonsilent
+
+    if audio.dBFS==float("-inf"):
+        return audio  # pure digital silence, nothing to measure against
+    speech=detect_nonsilent(audio, min_silence_len=min_silence_ms, silence_thresh=audio.dBFS+threshold_db, seek_step=10)
+    if not speech:
+        return audio
+    start=max(0, speech[0][0]-padding_ms)
+    end=min(len(audio), speech[-1][1]+padding_ms)
+    return audio[start:end]
+
+
+def split_audio(audio, chunk_ms=int(CHUNK_SECONDS*1000), overlap_ms=CHUNK_OVERLAP_MS, threshold_db=VAD_THRESHOLD_DB, min_silence_ms=VAD_MIN_SILENCE_MS):
+    """
+    Split a pydub AudioSegment into chunks of about chunk_ms, cutting in the middle of a pause
+    where there is one. Each chunk also starts overlap_ms early so no word is lost at a hard cut.
+    """
+    from pydub.silence import detect_silence
+
+    if len(audio)<=chunk_ms:
+        return [audio]
+    pauses=[]
+    if audio.dBFS!=float("-inf"):
+        pauses=detect_silence(audio, min_silence_len=min_silence_ms, silence_thresh=audio.dBFS+threshold_db, seek_step=10)
+    cuts=[(pause_start+pause_end)//2 for pause_start, pause_end in pauses]
+
+    chunks=[]
+    start=0
+    while start<len(audio):
+        end=min(start+chunk_ms, len(audio))
+        if end<len(audio):
+            # Prefer the latest pause in the second half of the window
+            candidates=[cut for cut in cuts if start+chunk_ms//2<cut<=end]
+            if candidates:
+                end=candidates[-1]
+        chunks.append(audio[max(0, start-overlap_ms):end])
+        start=end
+    return chunks
+
+
+def merge_transcripts(texts, max_overlap_words=STITCH_MAX_WORDS):
+    """Join chunk transcripts in order, dropping words repeated where the chunks overlap."""
+    def normalize(word):
+        return re.sub(r"[^\w]", "", word.lower())
+
+    merged=[]
+    for text in texts:
+        words=text.split()
+        if merged and words:
+            tail=[normalize(word) for word in merged[-max_overlap_words:]]
+            head=[normalize(word) for word in words[:max_overlap_words]]
+            for size in range(min(len(tail), len(head)), 0, -1):
+                if tail[-size:]==head[:size]:
+                    words=words[size:]
+                    break
+        merged.extend(words)
+    return " ".join(merged)
+
+
+def preprocess_audio(audio_filepath, sample_rate=STT_SAMPLE_RATE, output_format=STT_UPLOAD_FORMAT, bitrate=STT_UPLOAD_BITRATE, long_audio_seconds=LONG_AUDIO_SECONDS):
+    """
+    Trim silence, downmix to mono, resample and re-encode a recording for transcription.
+    Recordings longer than long_audio_seconds come back as several overlapping chunks.
+
+    Args:
+    audio_filepath (str): Path to the recorded audio.
+    sample_rate (int): Target sample rate in Hz.
+    output_format (str): Container/codec understood by ffmpeg and Whisper (mp3, flac, wav, ...).
+    bitrate (str): Bitrate for lossy formats.
+    long_audio_seconds (float): Length above which the recording is chunked.
+    """
+    from pydub import AudioSegment
+
+    start=time.perf_counter()
+    data=read_upload(audio_filepath, MAX_AUDIO_BYTES)
+    bytes_before=len(data)
+    # Decoded straight to 16-bit mono at the target rate; the VAD below works on that PCM
+    pcm=transcoder.decode(data, sample_rate, channels=1, path=audio_filepath)
+    seconds_before=pcm.seconds
+
+    audio=trim_silence(AudioSegment(data=pcm.raw, sample_width=2, frame_rate=sample_rate, channels=1))
+    segments=split_audio(audio) if len(audio)>long_audio_seconds*1000 else [audio]
+
+    name=os.path.splitext(os.path.basename(audio_filepath))[0]
+    uploads=[]
+    for index, segment in enumerate(segments):
+        encoded=transcoder.encode(transcoder.pcm_from_bytes(segment.raw_data, sample_rate, 1), output_format,
+                                  bitrate=None if output_format in ("wav", "flac") else bitrate)
+        suffix=f"_{index}" if len(segments)>1 else ""
+        uploads.append((f"{name}{suffix}.{output_format}", encoded))
+
+    return PreparedAudio(
+        uploads=uploads,
+        seconds_before=seconds_before,
+        seconds_after=len(audio)/1000,
+        bytes_before=bytes_before,
+        bytes_after=sum(len(data) for _, data in uploads),
+        processing_seconds=time.perf_counter()-start
     )
 
-    return transcription.text
+
+def prepare_uploads(audio_filepath, preprocess=True):
+    """Return the list of (filename, bytes) pairs to upload, cleaned up (and chunked) when possible."""
+    # A missing or oversize recording is the caller's problem, not a reason to fall back
+    check_size(audio_filepath, MAX_AUDIO_BYTES)
+    if preprocess:
+        try:
+            prepared=preprocess_audio(audio_filepath)
+            logging.info(
+                f"Audio preprocessed in {prepared.processing_seconds:.2f}s: removed {prepared.seconds_removed:.1f}s "
+                f"of silence and {prepared.bytes_removed} bytes ({prepared.bytes_before} -> {prepared.bytes_after}), "
+                f"{len(prepared.uploads)} chunk(s)"
+            )
+            return prepared.uploads
+        except Exception as e:
+            # e.g. ffmpeg missing or an unusual container: upload the original in one piece instead,
+            # unless it is too big for a single STT request
+            size=os.path.getsize(audio_filepath)
+            if size>MAX_STT_UPLOAD_BYTES:
+                logging.error(f"Audio preprocessing failed and the {size} byte recording cannot be chunked: {e}")
+                raise UploadTooLarge(audio_filepath, size, MAX_STT_UPLOAD_BYTES) from e
+            logging.error(f"Audio preprocessing failed, uploading the original file unchunked ({size} bytes): {e}")
+
+    return [(os.path.basename(audio_filepath), read_upload(audio_filepath, MAX_AUDIO_BYTES))]
+
+
+def warm_transcoder(sample_rate=STT_SAMPLE_RATE, output_format=STT_UPLOAD_FORMAT, bitrate=STT_UPLOAD_BITRATE):
+    """
+    Start the ffmpeg processes that recording and preprocessing use, so the first consultation
+    after startup does not wait for a spawn. Call once when the app or a batch starts.
+    """
+    import shutil
+
+    if not shutil.which(transcoder.pool.binary):
+        logging.warning(f"{transcoder.pool.binary} not found, audio other than WAV cannot be transcoded")
+        return
+    argument_sets=[
+        transcoder.decode_args(sample_rate, 1),  # non-WAV uploads
+        transcoder.encode_args(RECORD_SAMPLE_RATE, 1, "mp3", RECORD_BITRATE),  # record_audio
+    ]
+    if output_format!="wav":
+        argument_sets.append(transcoder.encode_args(sample_rate, 1, output_format, None if output_format=="flac" else bitrate))
+    for args in argument_sets:
+        transcoder.pool.warm(args)
+    logging.info(f"Started {transcoder.pool.spares} spare ffmpeg processes for each of {len(argument_sets)} conversions")
+
+
+#Step2: Setup Speech to text–STT–model for transcription
+from concurrent.futures import ThreadPoolExecutor
+from groq_client import get_groq_client, get_async_groq_client
+from groq_scheduler import scheduler, current_priority, INTERACTIVE
+from ingest import hash_upload
+from response_cache import CACHE_DIR, DiskCache, make_key
+from telemetry import span
+
+stt_model="whisper-large-v3"
+STT_LANGUAGE=os.environ.get("STT_LANGUAGE", "en")
+
+# Retries, double submits and repeat runs send the same recording again; its transcript is kept
+# under the hash of the audio, so a duplicate costs one read of the file instead of an upload
+TRANSCRIPT_CACHE_TTL=float(os.environ.get("TRANSCRIPT_CACHE_TTL", str(7*24*60*60)))
+TRANSCRIPT_CACHE_MAX_BYTES=int(os.environ.get("TRANSCRIPT_CACHE_MAX_BYTES", str(5*1024*1024)))
+
+transcript_cache=DiskCache(os.path.join(CACHE_DIR, "transcripts.sqlite3"), max_bytes=TRANSCRIPT_CACHE_MAX_BYTES, ttl=TRANSCRIPT_CACHE_TTL)
+
+def transcript_cache_key(audio_filepath, stt_model, language):
+    return make_key(hash_upload(audio_filepath, MAX_AUDIO_BYTES), stt_model, language)
+
+def transcribe_with_groq(stt_model, audio_filepath, GROQ_API_KEY, preprocess=True, max_workers=STT_WORKERS, language=STT_LANGUAGE, use_cache=True):
+    client=get_groq_client(api_key=GROQ_API_KEY)
+    # Chunks run on pool threads, which do not inherit the caller's priority by themselves
+    level=current_priority()
+
+    def transcribe(upload):
+        transcription=scheduler.call(stt_model, lambda: client.audio.transcriptions.create(
+            model=stt_model,
+            file=upload,
+            language=language
+        ), level)
+        return transcription.text
+
+    with span("stt", model=stt_model) as current:
+        if use_cache:
+            cache_key=transcript_cache_key(audio_filepath, stt_model, language)
+            cached=transcript_cache.get(cache_key)
+            current.set(cache="miss" if cached is None else "hit")
+            if cached is not None:
+                current.set(bytes_out=len(cached))
+                return cached.decode('utf-8')
+
+        uploads=prepare_uploads(audio_filepath, preprocess)
+        current.set(chunks=len(uploads), bytes_in=sum(len(data) for _, data in uploads))
+        if len(uploads)==1:
+            text=transcribe(uploads[0])
+        else:
+            # Long recording: chunks go out concurrently, so wall-clock time stays close to one chunk
+            start=time.perf_counter()
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(uploads)), thread_name_prefix="stt") as pool:
+                texts=list(pool.map(transcribe, uploads))
+            logging.info(f"Transcribed {len(uploads)} chunks in {time.perf_counter()-start:.2f}s")
+            text=merge_transcripts(texts)
+        current.set(bytes_out=len(text.encode('utf-8')))
+        if use_cache and text:
+            transcript_cache.set(cache_key, text)
+        return text
+
+
+async def atranscribe_with_groq(stt_model, audio_filepath, GROQ_API_KEY, preprocess=True, max_workers=STT_WORKERS, language=STT_LANGUAGE, use_cache=True):
+    """Async version of transcribe_with_groq built on the pooled AsyncGroq client."""
+    import asyncio
+
+    client=get_async_groq_client(api_key=GROQ_API_KEY)
+    slots=asyncio.Semaphore(max_workers)
+
+    async def transcribe(upload):
+        async with slots:
+            transcription=await scheduler.acall(stt_model, lambda: client.audio.transcriptions.create(
+                model=stt_model,
+                file=upload,
+                language=language
+            ))
+            return transcription.text
+
+    with span("stt", model=stt_model) as current:
+        if use_cache:
+            cache_key=await asyncio.to_thread(transcript_cache_key, audio_filepath, stt_model, language)
+            cached=await asyncio.to_thread(transcript_cache.get, cache_key)
+            current.set(cache="miss" if cached is None else "hit")
+            if cached is not None:
+                current.set(bytes_out=len(cached))
+                return cached.decode('utf-8')
+
+        uploads=await asyncio.to_thread(prepare_uploads, audio_filepath, preprocess)
+        current.set(chunks=len(uploads), bytes_in=sum(len(data) for _, data in uploads))
+        texts=await asyncio.gather(*(transcribe(upload) for upload in uploads))
+        text=merge_transcripts(texts)
+        current.set(bytes_out=len(text.encode('utf-8')))
+        if use_cache and text:
+            await asyncio.to_thread(transcript_cache.set, cache_key, text)
+        return text
+
+
+#Step3: Stream the microphone and transcribe while the patient is still talking
+# Audio is cut into rolling windows (with a little overlap) that go to Whisper as soon
+# as each one fills up. When the patient stops, only the last short window is left to send.
+import wave
+
+STREAM_WINDOW_SECONDS=float(os.environ.get("STREAM_WINDOW_SECONDS", "5"))
+
+class RollingTranscriber:
+    def __init__(self, transcribe, sample_rate, sample_width, window_seconds=STREAM_WINDOW_SECONDS, overlap_ms=CHUNK_OVERLAP_MS, max_workers=STT_WORKERS):
+        """
+        Args:
+        transcribe (callable): Turns WAV bytes into text.
+        sample_rate (int): Sample rate of the raw mono PCM fed to add().
+        sample_width (int): Bytes per sample of that PCM.
+        window_seconds (float): Length of each window sent for transcription.
+        overlap_ms (int): How far each window reaches back into the previous one.
+        max_workers (int): Windows transcribed at the same time.
+        """
+        self.transcribe=transcribe
+        self.sample_rate=sample_rate
+        self.sample_width=sample_width
+        bytes_per_ms=sample_rate*sample_width/1000
+        self.window_bytes=int(window_seconds*1000*bytes_per_ms)//sample_width*sample_width
+        self.overlap_bytes=int(overlap_ms*bytes_per_ms)//sample_width*sample_width
+        self.audio=bytearray()
+        self._window_start=0
+        self._futures=[]
+        self._pool=ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stt-stream")
+
+    def wav(self, raw):
+        buffer=BytesIO()
+        with wave.open(buffer, "wb") as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(self.sample_width)
+            wav_file.setframerate(self.sample_rate)
+            wav_file.writeframes(raw)
+        return buffer.getvalue()
+
+    def _send(self, end):
+        start=max(0, self._window_start-self.overlap_bytes)
+        self._futures.append(self._pool.submit(self.transcribe, self.wav(bytes(self.audio[start:end]))))
+        self._window_start=end
+
+    def add(self, raw):
+        """Append raw PCM and send every window that is now complete."""
+        self.audio+=raw
+        while len(self.audio)-self._window_start>=self.window_bytes:
+            self._send(self._window_start+self.window_bytes)
+
+    def partial(self):
+        """Transcript of the leading windows that have come back so far."""
+        texts=[]
+        for future in self._futures:
+            if not future.done():
+                break
+            texts.append(future.result())
+        return merge_transcripts(texts)
+
+    def finish(self):
+        """Send whatever is left and return the full transcript."""
+        try:
+            if len(self.audio)>self._window_start:
+                self._send(len(self.audio))
+            return merge_transcripts([future.result() for future in self._futures])
+        finally:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def stream_transcription(stt_model=stt_model, GROQ_API_KEY=None, timeout=20, phrase_time_limit=None, window_seconds=STREAM_WINDOW_SECONDS, file_path=None):
+    """
+    Record from the microphone and transcribe while recording.
+    Yields (text, is_final): partial transcripts as windows come back, then the final transcript.
+
+    Args:
+    stt_model (str): Whisper model name.
+    GROQ_API_KEY (str): Groq API key, defaults to the environment.
+    timeout (int): Maximum time to wait for a phrase to start (in seconds).
+    phrase_time_limit (int): Maximum time for the phrase to be recorded (in seconds).
+    window_seconds (float): Length of each window sent while the patient is talking.
+    file_path (str): Optionally keep the recording as a WAV file.
+    """
+    import speech_recognition as sr
+
+    client=get_groq_client(api_key=GROQ_API_KEY)
+
+    def transcribe(wav_bytes):
+        transcription=scheduler.call(stt_model, lambda: client.audio.transcriptions.create(
+            model=stt_model,
+            file=("window.wav", wav_bytes),
+            language=STT_LANGUAGE
+        ), INTERACTIVE)
+        return transcription.text
+
+    recognizer=sr.Recognizer()
+    with sr.Microphone(sample_rate=STT_SAMPLE_RATE) as source:
+        logging.info("Adjusting for ambient noise...")
+        recognizer.adjust_for_ambient_noise(source, duration=1)
+        logging.info("Start speaking now...")
+
+        rolling=RollingTranscriber(transcribe, source.SAMPLE_RATE, source.SAMPLE_WIDTH, window_seconds=window_seconds)
+        last_partial=""
+        for chunk in recognizer.listen(source, timeout=timeout, phrase_time_limit=phrase_time_limit, stream=True):
+            rolling.add(chunk.get_raw_data())
+            partial=rolling.partial()
+            if partial and partial!=last_partial:
+                last_partial=partial
+                yield partial, False
+        logging.info("Recording complete.")
+
+    final=rolling.finish()
+    if file_path:
+        with open(file_path, "wb") as wav_file:
+            wav_file.write(rolling.wav(bytes(rolling.audio)))
+    yield final, True